@@ -0,0 +1,270 @@
+# End-to-end timings of the app's hot paths, run offscreen against the synthetic capture backend, so
+# they can be tracked for regressions on any machine:
+#   add_call      Add Call to the new row being visible, through MainPane.lap_button_clicked,
+#                 the capture pool and update_on_finish
+#   add_call_full Add Call before any region is selected, which grabs the whole screen
+#   timer_tick    TimerWidget.update_timer while running, per timeline size
+#   row_switch    selecting a row until PreviewPane shows its screenshot, cold and cached
+#   phase_save    Save Phase of a whole timeline
+#   phase_load    Open Phase streamed into the timeline, until the loader is done
+#
+#   python -m Benchmarks.app_benchmark [--sizes 1000 10000 100000] [--json results.json]
+#       [--compare baseline.json]
+#
+# Everything is written under a temporary home folder, never the real util.BASE_PATH. --json writes
+# every result with the run's environment; --compare prints each result against a previous --json.
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+HOME = tempfile.mkdtemp(prefix="fftimer_benchmark_")
+os.environ["HOME"] = os.environ["USERPROFILE"] = HOME
+# grabs come from a made-up screen, and no time is spent calibrating
+os.environ["FFTIMER_CAPTURE_BACKEND"] = "synthetic"
+
+from PySide6 import QtCore, QtWidgets
+
+import util
+from Capture.capture_backends import SyntheticBackend
+from Models.callout import Callout
+from Storage.phase_stream import iter_phase_chunks
+from UI.main_pane import MainPane
+
+ADD_CALL_COUNT = 50
+TICK_COUNT = 2000
+ROW_SWITCH_COUNT = 50
+CAPTURE_REGION = (320, 180, 2240, 1260)
+CAST_BAR_REGION = (1080, 300, 1480, 340)
+SCREENSHOT_COUNT = 20
+WAIT_TIMEOUT_S = 30
+
+
+def summarize(samples_ms):
+    ordered = sorted(samples_ms)
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered),
+        "median_ms": statistics.median(ordered),
+        "p95_ms": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+        "max_ms": ordered[-1],
+    }
+
+
+def wait_until(app, condition):
+    deadline = time.perf_counter() + WAIT_TIMEOUT_S
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("benchmark step did not finish")
+        app.processEvents(QtCore.QEventLoop.AllEvents, 5)
+
+
+def make_callouts(count, screenshots):
+    return [
+        Callout(
+            timestamp=i * 250.0,
+            description=f"Mechanic {i % 40}",
+            active=i % 3 != 0,
+            notes="",
+            screen_image_path=screenshots[i % len(screenshots)],
+            cast_image_path="")
+        for i in range(count)]
+
+
+def make_screenshots(folder):
+    paths = []
+    grab = SyntheticBackend().grab
+    for i in range(SCREENSHOT_COUNT):
+        path = os.path.join(folder, f"benchmark_{i}.png")
+        grab(bbox=CAPTURE_REGION).save(path)
+        paths.append(path)
+    return paths
+
+
+class Suite:
+    def __init__(self, app):
+        self.app = app
+        self.results = []
+        # the app only makes the screenshots folder on the first Add Call
+        os.makedirs(util.SCREENSHOTS_FOLDER, exist_ok=True)
+        self.box = QtWidgets.QGroupBox()
+        layout = QtWidgets.QVBoxLayout()
+        self.pane = MainPane(self.box)
+        layout.addWidget(self.pane)
+        self.box.setLayout(layout)
+        self.box.resize(1280, 720)
+        self.box.show()
+        self.pane.capture_region = CAPTURE_REGION
+        self.pane.cast_bar_region = CAST_BAR_REGION
+        self.screenshots = make_screenshots(util.SCREENSHOTS_FOLDER)
+        self.app.processEvents()
+
+    def record(self, name, params, samples_ms=None, **values):
+        result = {"name": name, "params": params, **values}
+        if samples_ms is not None:
+            result.update(summarize(samples_ms))
+        self.results.append(result)
+        shown = ", ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                          for (key, value) in result.items() if key not in ("name", "params"))
+        print(f"{name:<11} {json.dumps(params):<34} {shown}")
+
+    def load_timeline(self, callouts):
+        controls = self.pane.settings_widget
+        controls.load_callouts(callouts, "benchmark")
+        self.app.processEvents()
+
+    def add_call(self):
+        self.load_timeline([])
+        model = self.pane.table_model
+        view = self.pane.table_view
+        samples = []
+        for i in range(ADD_CALL_COUNT):
+            rows = model.rowCount()
+            start = time.perf_counter()
+            self.pane.lap_button_clicked(i * 1000.0)
+            wait_until(self.app, lambda: model.rowCount() > rows)
+            view.viewport().repaint()
+            samples.append((time.perf_counter() - start) * 1000)
+        # the encodes still queued are not part of the latency, but should not spill into the next step
+        wait_until(self.app, lambda: self.pane.image_encoder.pending_count() == 0)
+        self.record("add_call", {}, samples)
+
+    def add_call_full_screen(self):
+        self.load_timeline([])
+        model = self.pane.table_model
+        (self.pane.capture_region, self.pane.cast_bar_region) = (None, None)
+        try:
+            start = time.perf_counter()
+            self.pane.lap_button_clicked(0.0)
+            wait_until(self.app, lambda: model.rowCount() > 0)
+            seconds = time.perf_counter() - start
+        finally:
+            self.pane.capture_region = CAPTURE_REGION
+            self.pane.cast_bar_region = CAST_BAR_REGION
+        wait_until(self.app, lambda: self.pane.image_encoder.pending_count() == 0)
+        callout = model.callouts[0]
+        if not callout.screen_image_path or not callout.cast_image_path:
+            raise AssertionError("Add Call with no regions added the callout without screenshots")
+        self.record("add_call_full", {}, seconds_s=seconds)
+
+    def timer_tick(self, size):
+        self.load_timeline(make_callouts(size, self.screenshots))
+        timer = self.pane.timer_widget
+        timer.start_button_clicked(None)
+        # only the tick itself is timed, not the QTimer that would drive it
+        timer.timer.stop()
+        samples = []
+        for _ in range(TICK_COUNT):
+            start = time.perf_counter()
+            timer.update_timer()
+            samples.append((time.perf_counter() - start) * 1000)
+        # the timing stats would be printed on reset
+        timer.clear_timing_stats()
+        timer.reset()
+        self.record("timer_tick", {"rows": size}, samples)
+
+    def row_switch(self, size):
+        self.load_timeline(make_callouts(size, self.screenshots))
+        preview = self.pane.preview_pane
+        rows = [(i * 7919) % size for i in range(ROW_SWITCH_COUNT)]
+        for (label, clear_cache) in (("cold", True), ("cached", False)):
+            samples = []
+            for row in rows:
+                if clear_cache:
+                    preview.pixmap_cache.clear()
+                    preview.image_loader.retain(set())
+                start = time.perf_counter()
+                self.pane.select_row(row)
+                wait_until(self.app, lambda: preview.image_key == self.pane.table_model.callouts[row].screen_image_path
+                           and preview.image_label.pixmap() is not None and not preview.image_label.pixmap().isNull())
+                samples.append((time.perf_counter() - start) * 1000)
+            self.record("row_switch", {"rows": size, "cache": label}, samples)
+
+    def phase_save_load(self, size):
+        controls = self.pane.settings_widget
+        self.load_timeline(make_callouts(size, self.screenshots))
+        controls.phase_name.setText(f"benchmark_{size}")
+        path = controls.phase_path()
+
+        start = time.perf_counter()
+        controls.save_phase()
+        seconds = time.perf_counter() - start
+        self.record("phase_save", {"rows": size}, seconds_s=seconds, rows_per_s=size / seconds,
+                    bytes=os.path.getsize(path))
+
+        controls.new_phase()
+        start = time.perf_counter()
+        controls.stream_callouts(lambda: iter_phase_chunks(path), f"benchmark_{size}", path, path)
+        wait_until(self.app, lambda: controls.phase_loader is None)
+        seconds = time.perf_counter() - start
+        if self.pane.table_model.rowCount() != size:
+            raise AssertionError(f"loaded {self.pane.table_model.rowCount()} of {size} rows")
+        self.record("phase_load", {"rows": size}, seconds_s=seconds, rows_per_s=size / seconds)
+
+    def close(self):
+        self.app.aboutToQuit.emit()
+        self.box.close()
+
+
+def environment():
+    from PySide6 import __version__ as pyside_version
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pyside": pyside_version,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, 'r') as f:
+        baseline = {(r["name"], json.dumps(r["params"], sort_keys=True)): r for r in json.load(f)["results"]}
+
+    print(f"\ncompared with {baseline_path} (ratio above 1 is slower)")
+    for result in results:
+        old = baseline.get((result["name"], json.dumps(result["params"], sort_keys=True)))
+        if old is None:
+            continue
+        key = "median_ms" if "median_ms" in result else "seconds_s"
+        if old.get(key):
+            print(f"{result['name']:<11} {json.dumps(result['params']):<34} {key} "
+                  f"{old[key]:.3f} -> {result[key]:.3f} ({result[key] / old[key]:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--compare", help="a previous --json to compare against")
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+    suite = Suite(app)
+    try:
+        suite.add_call()
+        suite.add_call_full_screen()
+        for size in args.sizes:
+            suite.timer_tick(size)
+            suite.row_switch(size)
+            suite.phase_save_load(size)
+    finally:
+        suite.close()
+        shutil.rmtree(HOME, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"environment": environment(), "results": suite.results}, f, indent=2)
+    if args.compare:
+        compare(suite.results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# Per-callout grab time with one grab per region versus one grab of the union.
+#
+#   python -m Benchmarks.capture_benchmark [--synthetic] [--iterations N]
+#
+# --synthetic crops from an in-memory 2560x1440 frame instead of the real screen, for machines
+# without a display. It only measures copying, not the cost of a screen grab round trip.
+import argparse
+import statistics
+import time
+
+from Capture import screen_capture
+
+CAPTURE_REGION = (320, 180, 2240, 1260)
+CAST_BAR_REGION = (1080, 300, 1480, 340)
+
+
+def synthetic_grab():
+    from PIL import Image
+    screen = Image.new("RGB", (2560, 1440), (40, 80, 120))
+
+    def grab(bbox=None):
+        return screen.crop(bbox)
+
+    return grab
+
+
+def measure(func, grab, iterations):
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func(CAPTURE_REGION, CAST_BAR_REGION, grab=grab)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def report(name, times):
+    print(f"{name:<10} mean {statistics.mean(times):8.2f} ms  "
+          f"median {statistics.median(times):8.2f} ms  max {max(times):8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--synthetic", action="store_true")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        grab = synthetic_grab()
+    else:
+        from PIL import ImageGrab
+        grab = ImageGrab.grab
+
+    report("separate", measure(screen_capture.grab_regions_separately, grab, args.iterations))
+    report("union", measure(screen_capture.grab_regions, grab, args.iterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# Export throughput of every format, streamed from a TimelineStore to a file, and the peak memory the
+# export itself allocates, which should stay flat as the timeline grows.
+#
+#   python -m Benchmarks.export_benchmark [--sizes 10000 100000 1000000] [--formats tsv csv ...]
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from Models.callout import Callout
+from Models.timeline_store import TimelineStore
+from Storage.phase_export import EXPORT_FORMATS, export_file
+
+DESCRIPTIONS = 60
+
+
+def make_store(count):
+    return TimelineStore(
+        Callout(
+            timestamp=i * 250.0,
+            description=f"Mechanic {i % DESCRIPTIONS}",
+            active=i % 3 != 0,
+            notes="" if i % 10 else f"note on row {i}",
+            screen_image_path=f"screenshots/{i:032x}_capture.png",
+            cast_image_path=f"screenshots/{i:032x}_cast_bar.png")
+        for i in range(count))
+
+
+def run(store, export_format, path):
+    start = time.perf_counter()
+    export_file(path, store, export_format, active_only=False)
+    seconds = time.perf_counter() - start
+
+    # a second pass under tracemalloc, which slows it down too much to time
+    tracemalloc.start()
+    export_file(path, store, export_format, active_only=False)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (seconds, os.path.getsize(path), peak)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--formats", nargs="+", choices=EXPORT_FORMATS, default=list(EXPORT_FORMATS))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        print(f"{'rows':>8} {'format':>8} {'time':>10} {'rows/s':>11} {'MB/s':>8} {'size':>10} {'peak mem':>10}")
+        for size in args.sizes:
+            store = make_store(size)
+            for export_format in args.formats:
+                path = os.path.join(folder, f"export{EXPORT_FORMATS[export_format][0]}")
+                (seconds, file_size, peak) = run(store, export_format, path)
+                print(f"{size:>8} {export_format:>8} {seconds * 1000:>8.1f}ms {size / seconds:>11.0f} "
+                      f"{file_size / 1e6 / seconds:>8.1f} {file_size / 1e6:>8.2f}MB {peak / 1e6:>8.2f}MB")
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# Phase file size and load time, JSON against the binary columnar format.
+#
+#   python -m Benchmarks.phase_file_benchmark [--sizes 10000 100000 1000000] [--folder DIR]
+#
+# "load" builds every Callout, "timestamps" is what a seek or a merge needs: JSON has to parse the
+# whole file for it, the binary format maps the file and reads one column.
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from Models.callout import Callout
+from Storage.phase_file import BinaryPhase, read_phase, write_phase
+
+DESCRIPTIONS = 60
+
+
+def make_callouts(count, folder):
+    screenshots = os.path.join(folder, "screenshots")
+    return [
+        Callout(
+            timestamp=i * 250.0,
+            description=f"Mechanic {i % DESCRIPTIONS}",
+            active=i % 3 != 0,
+            notes="" if i % 10 else f"note on pull {i}",
+            screen_image_path=os.path.join(screenshots, f"{i:032x}.png"),
+            cast_image_path=os.path.join(screenshots, f"{i:032x}_cast_bar.png"))
+        for i in range(count)]
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return ((time.perf_counter() - start) * 1000, result)
+
+
+def json_timestamps(path):
+    with open(path, 'r') as f:
+        return [c["timestamp"] for c in json.load(f)]
+
+
+def binary_timestamps(path):
+    with BinaryPhase(path) as phase:
+        return max(phase.timestamps)
+
+
+def run(size, folder):
+    callouts = make_callouts(size, folder)
+    results = {}
+    for (name, extension, timestamps) in (("json", ".json", json_timestamps),
+                                          ("binary", ".phase", binary_timestamps)):
+        path = os.path.join(folder, f"benchmark_{size}{extension}")
+        (write_ms, _) = timed(lambda: write_phase(path, callouts))
+        (load_ms, loaded) = timed(lambda: read_phase(path))
+        (scan_ms, _) = timed(lambda: timestamps(path))
+        if loaded != callouts:
+            raise AssertionError(f"{name} phase did not round trip")
+        results[name] = (os.path.getsize(path), write_ms, load_ms, scan_ms)
+        os.remove(path)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--folder", default=None, help="where the files are written, a temporary folder by default")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary:
+        folder = args.folder or temporary
+        print(f"{'rows':>8} {'format':>7} {'size':>10} {'write':>10} {'load':>10} {'timestamps':>11}")
+        for size in args.sizes:
+            for (name, (file_size, write_ms, load_ms, scan_ms)) in run(size, folder).items():
+                print(f"{size:>8} {name:>7} {file_size / 1e6:>8.2f}MB {write_ms:>8.1f}ms {load_ms:>8.1f}ms "
+                      f"{scan_ms:>9.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# Time from a fresh interpreter to the main window's first paint, building the window the way main.py
+# does. Every run is its own process, so nothing is imported or cached from an earlier run.
+#
+#   python -m Benchmarks.startup_benchmark [--runs 10] [--tree PATH ...] [--json results.json]
+#
+# --tree measures other checkouts as well, e.g. one made with "git worktree add" at an older commit,
+# so the numbers can be compared side by side on the same machine. Runs use a temporary home folder
+# and Qt's offscreen platform unless QT_QPA_PLATFORM is set.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROBE = r"""
+import json
+import sys
+import time
+
+start = time.perf_counter()
+from PySide6 import QtCore, QtWidgets
+from UI import main_pane
+imported = time.perf_counter()
+
+app = QtWidgets.QApplication(sys.argv)
+box = QtWidgets.QGroupBox()
+v_layout = QtWidgets.QVBoxLayout()
+widget = main_pane.MainPane(box)
+v_layout.addWidget(widget)
+box.setLayout(v_layout)
+box.resize(1280, 720)
+built = time.perf_counter()
+
+
+class PaintWatcher(QtCore.QObject):
+    painted = None
+
+    def eventFilter(self, watched, event):
+        if event.type() == QtCore.QEvent.Paint and self.painted is None:
+            self.painted = time.perf_counter()
+            QtCore.QTimer.singleShot(0, app.quit)
+        return False
+
+
+watcher = PaintWatcher()
+box.installEventFilter(watcher)
+box.show()
+QtCore.QTimer.singleShot(10000, app.quit)
+app.exec()
+
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "build_ms": (built - imported) * 1000,
+    "first_paint_ms": ((watcher.painted or time.perf_counter()) - start) * 1000,
+    "painted": watcher.painted is not None,
+    "heavy_modules": sorted(name for name in ("PIL", "numpy") if name in sys.modules),
+}))
+"""
+
+
+def run_probe(tree, home):
+    environment = dict(os.environ, HOME=home, USERPROFILE=home, PYTHONPATH=tree)
+    environment.setdefault("QT_QPA_PLATFORM", "offscreen")
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", PROBE], cwd=tree, env=environment, capture_output=True,
+                            text=True, check=True).stdout
+    process_ms = (time.perf_counter() - start) * 1000
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_ms"] = process_ms
+    return result
+
+
+def summarize(tree, samples):
+    summary = {"tree": tree, "runs": len(samples), "heavy_modules": samples[-1]["heavy_modules"],
+               "painted": all(sample["painted"] for sample in samples)}
+    for key in ("import_ms", "build_ms", "first_paint_ms", "process_ms"):
+        summary[key] = statistics.median(sample[key] for sample in samples)
+    return summary
+
+
+def measure(trees, runs):
+    # trees take turns run by run, so a machine that slows down mid-way skews them all alike
+    samples = {tree: [] for tree in trees}
+    with tempfile.TemporaryDirectory() as home:
+        # the app expects its folder to exist, as it does once it has been run
+        os.makedirs(os.path.join(home, "Documents", "FFTimer"))
+        for _ in range(runs):
+            for tree in trees:
+                samples[tree].append(run_probe(tree, home))
+    return [summarize(tree, tree_samples) for (tree, tree_samples) in samples.items()]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--tree", nargs="+", default=[], help="other checkouts to measure as well")
+    parser.add_argument("--json", help="write the results here")
+    args = parser.parse_args()
+
+    trees = [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] + [os.path.abspath(t) for t in args.tree]
+    results = measure(trees, args.runs)
+    print(f"medians of {args.runs} runs")
+    print(f"{'import':>10} {'build':>10} {'paint':>10} {'process':>10}  loaded before paint  tree")
+    for result in results:
+        print(f"{result['import_ms']:>8.1f}ms {result['build_ms']:>8.1f}ms {result['first_paint_ms']:>8.1f}ms "
+              f"{result['process_ms']:>8.1f}ms  {', '.join(result['heavy_modules']) or '-':<19}  {result['tree']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# Timeline table population, scrolling and editing cost at increasing sizes, run offscreen.
+#
+#   python -m Benchmarks.table_model_benchmark [--sizes 1000 10000 100000]
+import argparse
+import os
+import random
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6 import QtCore, QtWidgets
+
+from Models.callout import Callout
+from UI.timeline_table_model import TimelineTableModel, TIMESTAMP_COLUMN, CALLOUT_COLUMN, configure_view
+
+SCROLL_STEPS = 200
+EDIT_COUNT = 200
+
+
+def make_callouts(count):
+    return [
+        Callout(
+            timestamp=i * 250.0,
+            description=f"Mechanic {i % 40}",
+            active=i % 3 != 0,
+            notes="",
+            screen_image_path=f"{i:032x}.png",
+            cast_image_path=f"{i:032x}_cast_bar.png")
+        for i in range(count)]
+
+
+def make_view(model):
+    view = QtWidgets.QTableView()
+    view.setModel(model)
+    configure_view(view)
+    view.resize(400, 600)
+    view.show()
+    return view
+
+
+def settle(app, view):
+    view.viewport().repaint()
+    app.processEvents()
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1000
+
+
+def run(app, size):
+    callouts = make_callouts(size)
+    model = TimelineTableModel(None)
+    view = make_view(model)
+    settle(app, view)
+
+    def populate():
+        model.insert_callouts(callouts)
+        settle(app, view)
+
+    def scroll():
+        bar = view.verticalScrollBar()
+        for step in range(SCROLL_STEPS):
+            bar.setValue(bar.maximum() * step // (SCROLL_STEPS - 1))
+            settle(app, view)
+
+    rows = random.Random(size).sample(range(size), min(EDIT_COUNT, size))
+
+    def edit():
+        for row in rows:
+            model.setData(model.index(row, TIMESTAMP_COLUMN), str(row * 0.25 + 0.01), QtCore.Qt.EditRole)
+            model.setData(model.index(row, CALLOUT_COLUMN), f"Edited {row}", QtCore.Qt.EditRole)
+            view.scrollTo(model.index(row, 0))
+            settle(app, view)
+
+    results = (timed(populate), timed(scroll), timed(edit))
+    view.close()
+    view.deleteLater()
+    app.processEvents()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    print(f"{'rows':>8} {'populate':>12} {f'scroll x{SCROLL_STEPS}':>12} {f'edit x{EDIT_COUNT}':>12}")
+    for size in args.sizes:
+        (populate, scroll, edit) = run(app, size)
+        print(f"{size:>8} {populate:>10.1f}ms {scroll:>10.1f}ms {edit:>10.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
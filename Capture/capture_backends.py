@@ -0,0 +1,274 @@
+# Screen grabbing behind one interface, so the fastest way this machine has can be used. A backend
+# has a name, grab(bbox=None) returning an RGB PIL image, and close(). bbox is always in physical
+# pixels of the virtual desktop, the space SelectRegionWidget maps its selection into (see
+# to_physical_region) and the one ImageGrab and X11 use; backends working in Qt's logical pixels map
+# it themselves. Every backend must be safe to call from the capture and sampler threads. Grabs go
+# through grab(), and a backend that is replaced is only closed once the grabs running on it return.
+#
+# select_fastest() times a few grabs with every backend that works here and keeps the fastest;
+# FFTIMER_CAPTURE_BACKEND names one to use instead, skipping the calibration.
+#
+#   python -m Capture.capture_backends [--bbox X1 Y1 X2 Y2] [--grabs 10]
+import argparse
+import itertools
+import math
+import os
+import statistics
+import threading
+import time
+
+BACKEND_ENVIRONMENT_VARIABLE = "FFTIMER_CAPTURE_BACKEND"
+DEFAULT_BACKEND = "pil"
+
+# the backends calibration picks among, in the order they are tried
+SCREEN_BACKENDS = ("x11shm", "qt", "pil")
+CALIBRATION_GRABS = 10
+CALIBRATION_SIZE = (1280, 720)
+
+SYNTHETIC_SCREEN_SIZE = (2560, 1440)
+
+
+def to_physical(x, y, origin, ratio):
+    # Qt keeps a screen's top left corner in physical pixels and scales the rest of it by its
+    # devicePixelRatio, so only the offset into the screen is scaled
+    return (origin[0] + (x - origin[0]) * ratio, origin[1] + (y - origin[1]) * ratio)
+
+
+def to_logical(x, y, origin, ratio):
+    return (origin[0] + (x - origin[0]) / ratio, origin[1] + (y - origin[1]) / ratio)
+
+
+def to_physical_region(begin, end, origin, ratio):
+    # the bbox of two logical corner points, on a screen with the given origin and ratio
+    (x1, y1) = to_physical(min(begin[0], end[0]), min(begin[1], end[1]), origin, ratio)
+    (x2, y2) = to_physical(max(begin[0], end[0]), max(begin[1], end[1]), origin, ratio)
+    return (x1, y1, x2, y2)
+
+
+def physical_screen_rect(origin, size, ratio):
+    return (origin[0], origin[1], origin[0] + size[0] * ratio, origin[1] + size[1] * ratio)
+
+
+def logical_cover(bbox, origin, ratio):
+    # the smallest whole logical rect covering a physical bbox, and where the bbox starts in a
+    # physical grab of that rect
+    (x1, y1) = to_logical(bbox[0], bbox[1], origin, ratio)
+    (x2, y2) = to_logical(bbox[2], bbox[3], origin, ratio)
+    logical = (math.floor(x1), math.floor(y1), math.ceil(x2), math.ceil(y2))
+    (grab_x, grab_y) = to_physical(logical[0], logical[1], origin, ratio)
+    return (logical, (int(round(bbox[0] - grab_x)), int(round(bbox[1] - grab_y))))
+
+
+def bbox_size(bbox):
+    return (int(bbox[2] - bbox[0]), int(bbox[3] - bbox[1]))
+
+
+class PilBackend:
+    # PIL.ImageGrab: GDI on Windows, screencapture on macOS, an XCB GetImage on Linux
+    name = "pil"
+
+    def grab(self, bbox=None):
+        # looked up on every grab so a replaced ImageGrab.grab is honoured
+        from PIL import ImageGrab
+        return ImageGrab.grab(bbox=bbox)
+
+    def close(self):
+        return
+
+
+class SyntheticBackend:
+    # A made-up screen for benchmarks and machines with no display. Red follows x and green follows y,
+    # so a region mapped to the wrong place grabs different colours, and a counter is drawn into every
+    # grab so consecutive grabs differ.
+    name = "synthetic"
+
+    def __init__(self, size=SYNTHETIC_SCREEN_SIZE):
+        from PIL import Image
+        gradient = Image.linear_gradient("L")
+        self.screen = Image.merge("RGB", (
+            gradient.rotate(90).resize(size),
+            gradient.resize(size),
+            Image.new("L", size, 120)))
+        self.grabs = itertools.count(1)
+
+    def grab(self, bbox=None):
+        from PIL import ImageDraw
+        frame = self.screen.crop(tuple(int(round(v)) for v in bbox)) if bbox is not None else self.screen.copy()
+        ImageDraw.Draw(frame).text((10, 10), str(next(self.grabs)), fill=(255, 255, 255))
+        return frame
+
+    def close(self):
+        return
+
+
+def qt_backend():
+    from Capture.qt_capture import QtScreenBackend
+    return QtScreenBackend()
+
+
+def x11_shm_backend():
+    from Capture.x11_capture import X11ShmBackend
+    return X11ShmBackend()
+
+
+CAPTURE_BACKENDS = {
+    "pil": PilBackend,
+    "qt": qt_backend,
+    "x11shm": x11_shm_backend,
+    "synthetic": SyntheticBackend,
+}
+
+backend = None
+backend_lock = threading.Lock()
+# grabs still running on each backend; a backend replaced meanwhile is closed once its last one returns
+running_grabs = {}
+retired = set()
+
+
+def add_backend(name, factory):
+    CAPTURE_BACKENDS[name] = factory
+
+
+def create_backend(name):
+    factory = CAPTURE_BACKENDS.get(name)
+    if factory is None:
+        print(f"unknown capture backend {name}, choose from {', '.join(CAPTURE_BACKENDS)}")
+        return None
+    try:
+        return factory()
+    except Exception as e:
+        print(f"capture backend {name} is not available: {e}")
+        return None
+
+
+def forced_backend_name():
+    return os.environ.get(BACKEND_ENVIRONMENT_VARIABLE) or None
+
+
+def current_backend():
+    global backend
+    if backend is None:
+        with backend_lock:
+            if backend is None:
+                backend = create_backend(forced_backend_name() or DEFAULT_BACKEND) or PilBackend()
+    return backend
+
+
+def set_backend(new_backend):
+    global backend
+    with backend_lock:
+        (old_backend, backend) = (backend, new_backend)
+        if old_backend is new_backend:
+            return
+        if old_backend is not None and old_backend in running_grabs:
+            retired.add(old_backend)
+            return
+    if old_backend is not None:
+        old_backend.close()
+
+
+def grab(bbox=None):
+    # with the current backend, which stays open until this returns even if it is replaced meanwhile
+    while True:
+        active = current_backend()
+        with backend_lock:
+            if backend is active:
+                running_grabs[active] = running_grabs.get(active, 0) + 1
+                break
+    try:
+        return active.grab(bbox=bbox)
+    finally:
+        with backend_lock:
+            running_grabs[active] -= 1
+            close = running_grabs[active] == 0 and active in retired
+            if running_grabs[active] == 0:
+                del running_grabs[active]
+                retired.discard(active)
+        if close:
+            active.close()
+
+
+def shutdown():
+    set_backend(None)
+
+
+def time_backend(candidate, bbox, grabs):
+    # median ms per grab; the first grab is not timed, as it sets up buffers and connections
+    if candidate.grab(bbox=bbox).size != bbox_size(bbox):
+        raise ValueError("grabbed the wrong size")
+    samples = []
+    for _ in range(grabs):
+        start = time.perf_counter()
+        image = candidate.grab(bbox=bbox)
+        samples.append((time.perf_counter() - start) * 1000)
+    if image.size != bbox_size(bbox) or image.mode != "RGB":
+        raise ValueError(f"grabbed a {image.mode} image of {image.size}")
+    return statistics.median(samples)
+
+
+def calibrate(bbox, names=SCREEN_BACKENDS, grabs=CALIBRATION_GRABS):
+    # (ms per grab, backend) for every backend that grabs bbox correctly here, fastest first
+    bbox = tuple(int(round(v)) for v in bbox)
+    results = []
+    for name in names:
+        candidate = create_backend(name)
+        if candidate is None:
+            continue
+        try:
+            results.append((time_backend(candidate, bbox, grabs), candidate))
+        except Exception as e:
+            print(f"capture backend {name} failed calibration: {e}")
+            candidate.close()
+    results.sort(key=lambda result: result[0])
+    return results
+
+
+def calibration_bbox(screen_rect):
+    # CALIBRATION_SIZE from a screen's top left, or the whole screen if it is smaller
+    (x1, y1) = (int(screen_rect[0]), int(screen_rect[1]))
+    return (x1, y1, min(x1 + CALIBRATION_SIZE[0], int(screen_rect[2])),
+            min(y1 + CALIBRATION_SIZE[1], int(screen_rect[3])))
+
+
+def select_fastest(bbox, names=SCREEN_BACKENDS, grabs=CALIBRATION_GRABS):
+    forced = forced_backend_name()
+    if forced is not None:
+        set_backend(create_backend(forced) or PilBackend())
+        return backend
+
+    results = calibrate(bbox, names, grabs)
+    if not results:
+        print("no capture backend could grab the screen, keeping the default")
+        return current_backend()
+
+    for (_, slower) in results[1:]:
+        slower.close()
+    set_backend(results[0][1])
+    print("capture backend: " + ", ".join(f"{b.name} {ms:.1f}ms" for (ms, b) in results))
+    return backend
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bbox", type=int, nargs=4, metavar=("X1", "Y1", "X2", "Y2"),
+                        default=(0, 0) + CALIBRATION_SIZE)
+    parser.add_argument("--grabs", type=int, default=CALIBRATION_GRABS)
+    parser.add_argument("--backends", nargs="+", choices=CAPTURE_BACKENDS, default=list(SCREEN_BACKENDS))
+    args = parser.parse_args()
+
+    # the Qt backend needs an application; grabs run on this thread, so none wait on an event loop
+    try:
+        from PySide6 import QtGui
+        app = QtGui.QGuiApplication.instance() or QtGui.QGuiApplication([])
+    except ImportError:
+        app = None
+
+    bbox = tuple(args.bbox)
+    print(f"{'backend':>10} {'per grab':>10} {'grabs/s':>8}  bbox {bbox}")
+    for (ms, candidate) in calibrate(bbox, args.backends, args.grabs):
+        print(f"{candidate.name:>10} {ms:>8.2f}ms {1000 / ms if ms else float('inf'):>8.1f}")
+        candidate.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import queue
+
+from PySide6 import QtCore
+
+from Diagnostics import tracing
+
+DEFAULT_WORKER_COUNT = 2
+DEFAULT_MAX_PENDING = 16
+
+
+class CaptureThread(QtCore.QThread):
+    def __init__(self, pool):
+        QtCore.QThread.__init__(self)
+        self.pool = pool
+
+    def run(self):
+        while True:
+            job = self.pool.jobs.get()
+            if job is None:
+                return
+
+            (sequence, func, args, kwargs) = job
+            result = None
+            error = None
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                error = e
+            # drop our references before blocking on the next job so finished work can be freed
+            job = func = args = kwargs = None
+            self.pool.job_done.emit(sequence, result, error)
+
+
+class CapturePool(QtCore.QObject):
+    # Long-lived worker threads fed from a bounded queue. Results are emitted on the owning (GUI)
+    # thread in submission order, even when a later job finishes first. A failed job is handed back
+    # with the positional arguments it was submitted with, so its caller can still use them.
+    finished = QtCore.Signal(object)
+    failed = QtCore.Signal(object, object)
+    queue_depth_changed = QtCore.Signal(int)
+    job_done = QtCore.Signal(int, object, object)
+
+    def __init__(self, parent=None, worker_count=DEFAULT_WORKER_COUNT, max_pending=DEFAULT_MAX_PENDING):
+        QtCore.QObject.__init__(self, parent)
+        self.max_pending = max_pending
+        self.jobs = queue.Queue()
+        self.next_sequence = 0
+        self.next_to_emit = 0
+        self.completed = {}
+        # the arguments of every job not emitted yet, by sequence
+        self.arguments = {}
+        self.dropped_count = 0
+
+        self.job_done.connect(self.on_job_done)
+
+        self.threads = [CaptureThread(self) for _ in range(worker_count)]
+        for thread in self.threads:
+            thread.start()
+
+    def depth(self):
+        return self.next_sequence - self.next_to_emit
+
+    def is_full(self):
+        return self.depth() >= self.max_pending
+
+    def submit(self, func, *args, **kwargs):
+        if self.threads is None:
+            return False
+
+        if self.is_full():
+            self.dropped_count += 1
+            tracing.increment("dropped captures")
+            return False
+
+        self.jobs.put((self.next_sequence, func, args, kwargs))
+        self.arguments[self.next_sequence] = args
+        self.next_sequence += 1
+        tracing.counter("capture queue", self.depth())
+        self.queue_depth_changed.emit(self.depth())
+        return True
+
+    def on_job_done(self, sequence, result, error):
+        self.completed[sequence] = (result, error)
+
+        while self.next_to_emit in self.completed:
+            (result, error) = self.completed.pop(self.next_to_emit)
+            args = self.arguments.pop(self.next_to_emit)
+            self.next_to_emit += 1
+            if error is None:
+                self.finished.emit(result)
+            else:
+                self.failed.emit(error, args)
+
+        tracing.counter("capture queue", self.depth())
+        self.queue_depth_changed.emit(self.depth())
+
+    def shutdown(self):
+        if self.threads is None:
+            return
+
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.wait()
+        self.threads = None
@@ -0,0 +1,94 @@
+import numpy as np
+
+# description given to callouts made from detected casts
+DETECTED_DESCRIPTION = "Detected Cast"
+
+# frames are compared as greyscale, shrunk by this factor in each direction
+DEFAULT_DOWNSAMPLE = 2
+# standard deviation (0-255) above which the cast bar counts as showing a cast
+DEFAULT_VISIBLE_THRESHOLD = 12.0
+# with a template of the idle bar: mean absolute difference from it above which a cast is showing
+DEFAULT_TEMPLATE_THRESHOLD = 18.0
+# mean absolute difference between two samples above which a showing bar has switched to a new cast,
+# a bar filling up changes far less than this between samples
+DEFAULT_CHANGE_THRESHOLD = 20.0
+# samples a new cast has to stay on screen for before it is reported
+DEFAULT_CONFIRM_SAMPLES = 2
+# casts starting within this long of the previous one are taken to be the same cast
+DEFAULT_DEBOUNCE_MS = 1000
+
+
+def prepare_frame(image, downsample=DEFAULT_DOWNSAMPLE):
+    image = image.convert("L")
+    if downsample > 1:
+        image = image.reduce(downsample)
+    return np.asarray(image, dtype=np.float32)
+
+
+class CastStartDetector:
+    # Finds the samples at which a new cast starts on the cast bar: the bar appearing, or a showing bar
+    # changing at once to another cast. update() returns the elapsed_ms the cast started at once it
+    # has been confirmed, and None otherwise.
+    def __init__(self, visible_threshold=DEFAULT_VISIBLE_THRESHOLD, change_threshold=DEFAULT_CHANGE_THRESHOLD,
+                 confirm_samples=DEFAULT_CONFIRM_SAMPLES, debounce_ms=DEFAULT_DEBOUNCE_MS,
+                 downsample=DEFAULT_DOWNSAMPLE, template=None, template_threshold=DEFAULT_TEMPLATE_THRESHOLD):
+        self.visible_threshold = visible_threshold
+        self.change_threshold = change_threshold
+        self.confirm_samples = confirm_samples
+        self.debounce_ms = debounce_ms
+        self.downsample = downsample
+        self.template_threshold = template_threshold
+        self.template = None
+        if template is not None:
+            self.set_template(template)
+        self.reset()
+
+    def reset(self):
+        self.previous = None
+        self.casting = False
+        self.candidate_ms = None
+        self.confirmed = 0
+        self.last_detection_ms = None
+
+    def set_template(self, image):
+        # a grab of the bar with no cast showing; casts are then told apart from it rather than by contrast
+        self.template = prepare_frame(image, self.downsample)
+
+    def visible(self, frame):
+        if self.template is not None and self.template.shape == frame.shape:
+            return float(np.abs(frame - self.template).mean()) > self.template_threshold
+        return float(frame.std()) > self.visible_threshold
+
+    def update(self, elapsed_ms, image):
+        frame = prepare_frame(image, self.downsample)
+        previous = self.previous
+        self.previous = frame
+
+        if self.last_detection_ms is not None and elapsed_ms < self.last_detection_ms:
+            # the timer was reset or seeked backwards
+            self.last_detection_ms = None
+
+        if not self.visible(frame):
+            self.casting = False
+            self.candidate_ms = None
+            return None
+
+        changed = previous is not None and previous.shape == frame.shape and \
+            float(np.abs(frame - previous).mean()) > self.change_threshold
+        if self.candidate_ms is None and (not self.casting or changed):
+            self.candidate_ms = elapsed_ms
+            self.confirmed = 0
+        self.casting = True
+
+        if self.candidate_ms is None:
+            return None
+        self.confirmed += 1
+        if self.confirmed < self.confirm_samples:
+            return None
+
+        start_ms = self.candidate_ms
+        self.candidate_ms = None
+        if self.last_detection_ms is not None and start_ms - self.last_detection_ms < self.debounce_ms:
+            return None
+        self.last_detection_ms = start_ms
+        return start_ms
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from PySide6 import QtCore
+
+from Capture.cast_detector import CastStartDetector
+from Capture.screen_capture import default_grab
+from Diagnostics.histogram import LatencyHistogram
+
+DEFAULT_SAMPLE_RATE = 20
+
+
+class CastSampler(QtCore.QThread):
+    # Samples the cast bar region and emits cast_started(elapsed_ms) on the GUI thread for every new
+    # cast. clock returns the phase timer's elapsed_ms.
+    cast_started = QtCore.Signal(float)
+
+    def __init__(self, clock, detector=None, sample_rate=DEFAULT_SAMPLE_RATE, grab=None):
+        QtCore.QThread.__init__(self)
+        self.clock = clock
+        self.detector = detector or CastStartDetector()
+        self.interval = 1 / sample_rate
+        self.grab = grab
+        self.cast_bar_region = None
+        self.stopped = threading.Event()
+        self.sample_time = LatencyHistogram("cast detection sample")
+        self.missed_samples = 0
+
+    def set_region(self, cast_bar_region):
+        self.cast_bar_region = cast_bar_region
+        self.detector.reset()
+
+    def sample(self):
+        cast_bar_region = self.cast_bar_region
+        if cast_bar_region is None:
+            return
+
+        start = time.perf_counter()
+        elapsed_ms = self.clock()
+        started_ms = self.detector.update(elapsed_ms, (self.grab or default_grab())(bbox=cast_bar_region))
+        self.sample_time.record((time.perf_counter() - start) * 1000)
+        if started_ms is not None:
+            self.cast_started.emit(started_ms)
+
+    def run(self):
+        next_sample = time.perf_counter()
+        while not self.stopped.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"cast detection sample failed: {e}")
+
+            next_sample += self.interval
+            delay = next_sample - time.perf_counter()
+            if delay < 0:
+                # fell behind, skip the missed samples rather than bursting to catch up
+                self.missed_samples += int(-delay / self.interval) + 1
+                next_sample = time.perf_counter()
+                delay = 0
+            self.stopped.wait(delay)
+
+    def report(self):
+        return f"{self.sample_time.report()}\nmissed samples: {self.missed_samples}"
+
+    def stop(self):
+        self.stopped.set()
+        self.wait()
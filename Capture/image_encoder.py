@@ -0,0 +1,93 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PySide6 import QtCore
+
+from Diagnostics import tracing
+
+FORMAT_PNG = "png"
+FORMAT_WEBP = "webp"
+FORMAT_RAW = "ppm"
+
+DEFAULT_FORMAT = FORMAT_PNG
+DEFAULT_LEVEL = 1
+
+
+def png_options(level):
+    return {"format": "PNG", "compress_level": level}
+
+
+def webp_options(level):
+    return {"format": "WEBP", "lossless": True, "method": min(level, 6)}
+
+
+def raw_options(level):
+    return {"format": "PPM"}
+
+
+ENCODE_OPTIONS = {
+    FORMAT_PNG: png_options,
+    FORMAT_WEBP: webp_options,
+    FORMAT_RAW: raw_options,
+}
+
+
+class ImageEncoder(QtCore.QObject):
+    # Saves grabbed images on a thread per core. Pillow releases the GIL while encoding, so threads
+    # scale across cores without pickling frames to other processes. Images stay available through
+    # pending_image until they are on disk.
+    saved = QtCore.Signal(str)
+    failed = QtCore.Signal(str, object)
+
+    def __init__(self, parent=None, image_format=DEFAULT_FORMAT, level=DEFAULT_LEVEL, worker_count=None):
+        QtCore.QObject.__init__(self, parent)
+        self.image_format = image_format
+        self.level = level
+        self.executor = ThreadPoolExecutor(worker_count or os.cpu_count())
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def extension(self):
+        return self.image_format
+
+    def pending_count(self):
+        with self.lock:
+            return len(self.pending)
+
+    def pending_image(self, path):
+        with self.lock:
+            return self.pending.get(path)
+
+    def submit(self, image, path, image_format=None):
+        image_format = image_format or self.image_format
+        if image.mode not in ("RGB", "L") and image_format == FORMAT_RAW:
+            image = image.convert("RGB")
+
+        options = ENCODE_OPTIONS[image_format](self.level)
+        with self.lock:
+            self.pending[path] = image
+            tracing.counter("encode queue", len(self.pending))
+        self.executor.submit(self.encode, image, path, options)
+        return path
+
+    def encode(self, image, path, options):
+        error = None
+        try:
+            with tracing.span("encode", "encode"):
+                image.save(path, **options)
+        except Exception as e:
+            error = e
+        finally:
+            # failed or not, the image is no longer pending
+            with self.lock:
+                self.pending.pop(path, None)
+                tracing.counter("encode queue", len(self.pending))
+
+        if error is not None:
+            self.failed.emit(path, error)
+        else:
+            self.saved.emit(path)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
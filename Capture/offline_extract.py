@@ -0,0 +1,238 @@
+# Builds a timeline from a recorded pull instead of a live one. The recording is a folder of frames
+# named by their timestamp in ms (or numbered, with --fps), or a video file, which needs opencv-python.
+# Regions are in the recording's pixel coordinates.
+#
+#   python -m Capture.offline_extract RECORDING --capture-region X1 Y1 X2 Y2 --cast-bar-region X1 Y1 X2 Y2
+#       [--name PHASE] [--output-folder DIR] [--fps N] [--sample-rate 20] [--offset-ms MS] [--workers N]
+#
+# Cast-bar detection runs over chunks of the recording in a process pool. Every chunk starts a few
+# samples early, so the detector knows whether a cast was already showing, and runs a few samples past
+# its end, so a cast starting at the very end is still confirmed. The phase file and the cropped
+# screenshots are written in the layout open_phase reads.
+import argparse
+import collections
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image
+
+import util
+from Capture import cast_detector
+from Capture.cast_detector import CastStartDetector, DETECTED_DESCRIPTION
+from Capture.screen_capture import to_pixel_bbox
+from Models.callout import Callout
+from Storage.phase_file import BINARY_EXTENSION, write_phase
+
+FRAME_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".webp")
+LAST_NUMBER = re.compile(r"(\d+)\D*$")
+
+DEFAULT_SAMPLE_RATE = 20
+CHUNKS_PER_WORKER = 4
+
+
+class FolderSource:
+    def __init__(self, folder, fps=None):
+        self.folder = folder
+        self.fps = fps
+
+    def samples(self):
+        # (ms, file name) for every frame, in time order
+        samples = []
+        for name in os.listdir(self.folder):
+            match = LAST_NUMBER.search(os.path.splitext(name)[0])
+            if match is None or os.path.splitext(name)[1].lower() not in FRAME_EXTENSIONS:
+                continue
+            number = int(match.group(1))
+            samples.append((number * 1000 / self.fps if self.fps else float(number), name))
+        samples.sort()
+        return samples
+
+    def read(self, samples):
+        for (ms, name) in samples:
+            with Image.open(os.path.join(self.folder, name)) as image:
+                image.load()
+                yield (ms, image)
+
+
+class VideoSource:
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def open_video(path):
+        try:
+            import cv2
+        except ImportError:
+            raise SystemExit("reading video needs opencv-python, or extract the frames to a folder first")
+        video = cv2.VideoCapture(path)
+        if not video.isOpened():
+            raise ValueError(f"cannot open video {path}")
+        return (cv2, video)
+
+    def samples(self):
+        (cv2, video) = self.open_video(self.path)
+        fps = video.get(cv2.CAP_PROP_FPS)
+        frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        video.release()
+        return [(index * 1000 / fps, index) for index in range(frame_count)]
+
+    def read(self, samples):
+        (cv2, video) = self.open_video(self.path)
+        try:
+            position = samples[0][1]
+            video.set(cv2.CAP_PROP_POS_FRAMES, position)
+            for (ms, index) in samples:
+                # frames between samples are only grabbed, not decoded into images
+                while position < index:
+                    video.grab()
+                    position += 1
+                (ok, frame) = video.read()
+                position += 1
+                if not ok:
+                    return
+                yield (ms, Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+        finally:
+            video.release()
+
+
+def open_source(recording, fps=None):
+    if os.path.isdir(recording):
+        return FolderSource(recording, fps)
+    return VideoSource(recording)
+
+
+def thin_samples(samples, sample_rate):
+    # about sample_rate samples a second, as the live detector would have seen the recording
+    interval = 1000 / sample_rate
+    kept = []
+    next_ms = None
+    for sample in samples:
+        if next_ms is None or sample[0] >= next_ms - 1e-6:
+            kept.append(sample)
+            next_ms = (next_ms if next_ms is not None else sample[0]) + interval
+            while next_ms <= sample[0]:
+                next_ms += interval
+    return kept
+
+
+def save_detection(start_ms, image, capture_region, cast_bar_region, screenshots_folder):
+    file_id = str(uuid.uuid4())
+    screen_image_path = os.path.join(screenshots_folder, f"{file_id}_capture.png")
+    cast_image_path = os.path.join(screenshots_folder, f"{file_id}_cast_bar.png")
+    image.crop(capture_region).save(screen_image_path)
+    image.crop(cast_bar_region).save(cast_image_path)
+    return Callout(
+        timestamp=start_ms,
+        description=DETECTED_DESCRIPTION,
+        active=True,
+        notes="",
+        screen_image_path=screen_image_path,
+        cast_image_path=cast_image_path)
+
+
+def extract_chunk(source, samples, report_from_ms, report_until_ms, capture_region, cast_bar_region,
+                  screenshots_folder, settings):
+    # runs in a pool worker; debouncing happens once all chunks are in
+    detector = CastStartDetector(**settings, debounce_ms=0)
+    recent = collections.deque(maxlen=detector.confirm_samples)
+    callouts = []
+    for (ms, image) in source.read(samples):
+        recent.append((ms, image))
+        start_ms = detector.update(ms, image.crop(cast_bar_region))
+        if start_ms is None or not report_from_ms <= start_ms < report_until_ms:
+            continue
+        # the cast is confirmed a few samples after it started, the screenshot is of the first one
+        start_image = next(image for (frame_ms, image) in recent if frame_ms == start_ms)
+        callouts.append(save_detection(start_ms, start_image, capture_region, cast_bar_region, screenshots_folder))
+    return callouts
+
+
+def chunk_tasks(samples, chunk_count, confirm_samples):
+    warmup = confirm_samples + 1
+    size = max(1, -(-len(samples) // chunk_count))
+    for first in range(0, len(samples), size):
+        last = min(first + size, len(samples))
+        report_until_ms = samples[last][0] if last < len(samples) else float("inf")
+        yield (samples[max(0, first - warmup):last + confirm_samples], samples[first][0], report_until_ms)
+
+
+def debounce(callouts, debounce_ms):
+    # the same rule the live detector applies, over the merged results of every chunk
+    kept = []
+    for callout in sorted(callouts, key=lambda callout: callout.timestamp):
+        if kept and callout.timestamp - kept[-1].timestamp < debounce_ms:
+            for path in (callout.screen_image_path, callout.cast_image_path):
+                os.remove(path)
+            continue
+        kept.append(callout)
+    return kept
+
+
+def extract(recording, capture_region, cast_bar_region, name, output_folder=util.BASE_PATH, fps=None,
+            sample_rate=DEFAULT_SAMPLE_RATE, offset_ms=0, workers=None, debounce_ms=cast_detector.DEFAULT_DEBOUNCE_MS,
+            **settings):
+    # returns (phase path, callouts, number of samples looked at)
+    source = open_source(recording, fps)
+    samples = thin_samples(source.samples(), sample_rate)
+    screenshots_folder = os.path.join(output_folder, "screenshots")
+    os.makedirs(screenshots_folder, exist_ok=True)
+
+    workers = workers or os.cpu_count() or 1
+    confirm_samples = settings.get("confirm_samples", cast_detector.DEFAULT_CONFIRM_SAMPLES)
+    capture_region = to_pixel_bbox(capture_region)
+    cast_bar_region = to_pixel_bbox(cast_bar_region)
+
+    callouts = []
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(extract_chunk, source, chunk, report_from_ms, report_until_ms, capture_region,
+                                   cast_bar_region, screenshots_folder, settings)
+                   for (chunk, report_from_ms, report_until_ms)
+                   in chunk_tasks(samples, workers * CHUNKS_PER_WORKER, confirm_samples)]
+        for (done, future) in enumerate(as_completed(futures), 1):
+            callouts.extend(future.result())
+            print(f"\r{done}/{len(futures)} chunks, {len(callouts)} casts", end="", flush=True)
+    print()
+
+    callouts = debounce(callouts, debounce_ms)
+    for callout in callouts:
+        callout.timestamp += offset_ms
+
+    phase_path = os.path.join(output_folder, f"{name}{BINARY_EXTENSION}")
+    write_phase(phase_path, callouts)
+    return (phase_path, callouts, len(samples))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a phase from a recorded pull.")
+    parser.add_argument("recording", help="a folder of frames or a video file")
+    parser.add_argument("--capture-region", type=int, nargs=4, required=True, metavar=("X1", "Y1", "X2", "Y2"))
+    parser.add_argument("--cast-bar-region", type=int, nargs=4, required=True, metavar=("X1", "Y1", "X2", "Y2"))
+    parser.add_argument("--name", help="phase name, the recording's name by default")
+    parser.add_argument("--output-folder", default=util.BASE_PATH)
+    parser.add_argument("--fps", type=float, help="frames are numbered at this rate rather than named in ms")
+    parser.add_argument("--sample-rate", type=float, default=DEFAULT_SAMPLE_RATE)
+    parser.add_argument("--offset-ms", type=float, default=0, help="added to every timestamp, e.g. the pull start")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--visible-threshold", type=float, default=cast_detector.DEFAULT_VISIBLE_THRESHOLD)
+    parser.add_argument("--change-threshold", type=float, default=cast_detector.DEFAULT_CHANGE_THRESHOLD)
+    parser.add_argument("--confirm-samples", type=int, default=cast_detector.DEFAULT_CONFIRM_SAMPLES)
+    parser.add_argument("--debounce-ms", type=float, default=cast_detector.DEFAULT_DEBOUNCE_MS)
+    args = parser.parse_args()
+
+    name = args.name or os.path.splitext(os.path.basename(os.path.normpath(args.recording)))[0]
+    start = time.perf_counter()
+    (phase_path, callouts, sample_count) = extract(
+        args.recording, args.capture_region, args.cast_bar_region, name, args.output_folder, args.fps,
+        args.sample_rate, args.offset_ms, args.workers, args.debounce_ms,
+        visible_threshold=args.visible_threshold, change_threshold=args.change_threshold,
+        confirm_samples=args.confirm_samples)
+    seconds = time.perf_counter() - start
+    print(f"{len(callouts)} callouts from {sample_count} samples in {seconds:.1f}s "
+          f"({sample_count / args.sample_rate / max(seconds, 1e-9):.1f}x real time), written to {phase_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import bisect
+import threading
+import time
+
+from Capture.screen_capture import default_grab, grab_regions
+
+DEFAULT_SAMPLE_RATE = 20
+DEFAULT_BYTE_BUDGET = 64 * 1024 * 1024
+
+
+def image_size_bytes(image):
+    # Pillow stores every multi-band mode in 32-bit pixels
+    return image.width * image.height * (1 if len(image.getbands()) == 1 else 4)
+
+
+def cast_bar_score(frame):
+    # a cast bar with a name and fill has far more contrast than an empty or hidden bar
+    from PIL import ImageStat
+    return ImageStat.Stat(frame.cast_image.convert("L")).var[0]
+
+
+class PrerollFrame:
+    __slots__ = ("elapsed_ms", "screen_image", "cast_image", "size_bytes")
+
+    def __init__(self, elapsed_ms, screen_image, cast_image):
+        self.elapsed_ms = elapsed_ms
+        self.screen_image = screen_image
+        self.cast_image = cast_image
+        self.size_bytes = image_size_bytes(cast_image)
+        if screen_image is not None:
+            self.size_bytes += image_size_bytes(screen_image)
+
+
+class FrameRingBuffer:
+    # Frames ordered by the timer's elapsed_ms, evicting the oldest once byte_budget is exceeded.
+    def __init__(self, byte_budget=DEFAULT_BYTE_BUDGET):
+        self.byte_budget = byte_budget
+        self.size_bytes = 0
+        self.timestamps = []
+        self.frames = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def clear(self):
+        with self.lock:
+            self.timestamps = []
+            self.frames = []
+            self.size_bytes = 0
+
+    def add(self, frame):
+        with self.lock:
+            if self.timestamps and frame.elapsed_ms < self.timestamps[-1]:
+                # the timer was reset or seeked backwards, older frames no longer line up
+                self.timestamps = []
+                self.frames = []
+                self.size_bytes = 0
+            elif self.timestamps and frame.elapsed_ms == self.timestamps[-1]:
+                # paused: keep only the latest frame for this timestamp
+                self.size_bytes -= self.frames.pop().size_bytes
+                self.timestamps.pop()
+
+            self.timestamps.append(frame.elapsed_ms)
+            self.frames.append(frame)
+            self.size_bytes += frame.size_bytes
+
+            evict = 0
+            while self.size_bytes > self.byte_budget and evict < len(self.frames) - 1:
+                self.size_bytes -= self.frames[evict].size_bytes
+                evict += 1
+            if evict:
+                del self.timestamps[:evict]
+                del self.frames[:evict]
+
+    def frame_at(self, elapsed_ms):
+        # latest frame taken at or before elapsed_ms
+        with self.lock:
+            i = bisect.bisect_right(self.timestamps, elapsed_ms)
+            return self.frames[i - 1] if i > 0 else None
+
+    def frames_between(self, start_ms, end_ms):
+        with self.lock:
+            lo = bisect.bisect_left(self.timestamps, start_ms)
+            hi = bisect.bisect_right(self.timestamps, end_ms)
+            return self.frames[lo:hi]
+
+    def best_frame(self, start_ms, end_ms, score=cast_bar_score):
+        frames = self.frames_between(start_ms, end_ms)
+        if not frames:
+            return self.frame_at(start_ms)
+        return max(frames, key=score)
+
+
+class PrerollSampler(threading.Thread):
+    # Background sampler filling a FrameRingBuffer. clock returns the phase timer's elapsed_ms.
+    def __init__(self, clock, buffer, sample_rate=DEFAULT_SAMPLE_RATE, include_capture_region=False):
+        threading.Thread.__init__(self, daemon=True)
+        self.clock = clock
+        self.buffer = buffer
+        self.interval = 1 / sample_rate
+        self.include_capture_region = include_capture_region
+        self.capture_region = None
+        self.cast_bar_region = None
+        self.stopped = threading.Event()
+
+    def set_regions(self, capture_region, cast_bar_region):
+        self.capture_region = capture_region
+        self.cast_bar_region = cast_bar_region
+        self.buffer.clear()
+
+    def sample(self):
+        (capture_region, cast_bar_region) = (self.capture_region, self.cast_bar_region)
+        if cast_bar_region is None:
+            return
+
+        elapsed_ms = self.clock()
+        if self.include_capture_region and capture_region is not None:
+            (screen_image, cast_image) = grab_regions(capture_region, cast_bar_region)
+        else:
+            screen_image = None
+            cast_image = default_grab()(bbox=cast_bar_region)
+
+        self.buffer.add(PrerollFrame(elapsed_ms, screen_image, cast_image))
+
+    def run(self):
+        next_sample = time.perf_counter()
+        while not self.stopped.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"pre-roll sample failed: {e}")
+
+            next_sample += self.interval
+            delay = next_sample - time.perf_counter()
+            if delay < 0:
+                # fell behind, skip the missed samples rather than bursting to catch up
+                next_sample = time.perf_counter()
+                delay = 0
+            self.stopped.wait(delay)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
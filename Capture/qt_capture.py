@@ -0,0 +1,98 @@
+import sys
+import threading
+
+from PIL import Image
+from PySide6 import QtCore, QtGui
+
+from Capture.capture_backends import logical_cover, physical_screen_rect
+
+# QImage.Format_RGB32 is 0xffRRGGBB in native byte order
+RGB32_RAW_MODE = "BGRX" if sys.byteorder == "little" else "XRGB"
+
+# how long a grab from another thread waits for the GUI thread; bounded so a thread being waited on
+# while the app quits cannot wait on the GUI thread in turn
+GUI_GRAB_TIMEOUT_S = 1
+
+
+def screen_origin(screen):
+    geometry = screen.geometry()
+    return (geometry.x(), geometry.y())
+
+
+def screen_for(bbox):
+    # the screen holding the bbox's top left corner, in physical pixels
+    for screen in QtGui.QGuiApplication.screens():
+        geometry = screen.geometry()
+        rect = physical_screen_rect(screen_origin(screen), (geometry.width(), geometry.height()),
+                                    screen.devicePixelRatio())
+        if rect[0] <= bbox[0] < rect[2] and rect[1] <= bbox[1] < rect[3]:
+            return screen
+    return None
+
+
+class QtScreenBackend(QtCore.QObject):
+    # QScreen.grabWindow, which goes through the platform's own screen grabbing (BitBlt, CoreGraphics,
+    # XCB). Screens are grabbed in logical pixels, so the physical bbox is widened to whole logical
+    # pixels and the physical grab cropped back to it. Grabbing is only safe on the GUI thread, so
+    # grabs from other threads are queued to it and wait for the result.
+    name = "qt"
+    requested = QtCore.Signal(object)
+
+    def __init__(self):
+        QtCore.QObject.__init__(self)
+        app = QtGui.QGuiApplication.instance()
+        if app is None or not QtGui.QGuiApplication.screens():
+            raise RuntimeError("no Qt screens")
+        self.moveToThread(app.thread())
+        self.requested.connect(self.grab_requested, QtCore.Qt.QueuedConnection)
+
+    def grab_qimage(self, bbox):
+        screen = screen_for(bbox)
+        if screen is None:
+            raise ValueError(f"region {bbox} is not on any screen")
+
+        (logical, offset) = logical_cover(bbox, screen_origin(screen), screen.devicePixelRatio())
+        (x, y) = screen_origin(screen)
+        pixmap = screen.grabWindow(0, logical[0] - x, logical[1] - y, logical[2] - logical[0],
+                                   logical[3] - logical[1])
+        return (pixmap.toImage(), offset)
+
+    @QtCore.Slot(object)
+    def grab_requested(self, request):
+        (bbox, done) = request
+        try:
+            request.append(self.grab_qimage(bbox))
+        except Exception as e:
+            request.append(e)
+        done.set()
+
+    def grab(self, bbox=None):
+        if bbox is None:
+            screen = QtGui.QGuiApplication.primaryScreen()
+            geometry = screen.geometry()
+            bbox = physical_screen_rect(screen_origin(screen), (geometry.width(), geometry.height()),
+                                        screen.devicePixelRatio())
+        bbox = tuple(int(round(v)) for v in bbox)
+
+        if QtCore.QThread.currentThread() == self.thread():
+            (image, offset) = self.grab_qimage(bbox)
+        else:
+            request = [bbox, threading.Event()]
+            self.requested.emit(request)
+            if not request[1].wait(GUI_GRAB_TIMEOUT_S):
+                raise TimeoutError("the GUI thread did not get to the grab in time")
+            if isinstance(request[2], Exception):
+                raise request[2]
+            (image, offset) = request[2]
+
+        # converted here rather than on the GUI thread
+        image = image.convertToFormat(QtGui.QImage.Format_RGB32)
+        frame = Image.frombuffer("RGB", (image.width(), image.height()), image.constBits(), "raw",
+                                 RGB32_RAW_MODE, image.bytesPerLine(), 1)
+        (width, height) = (bbox[2] - bbox[0], bbox[3] - bbox[1])
+        if offset != (0, 0) or frame.size != (width, height):
+            frame = frame.crop((offset[0], offset[1], offset[0] + width, offset[1] + height))
+        return frame
+
+    def close(self):
+        return
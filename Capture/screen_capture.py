@@ -0,0 +1,71 @@
+from Capture import capture_backends
+from Diagnostics import tracing
+
+
+def default_grab():
+    # the backend calibration picked, or ImageGrab until it has run; PIL is imported by the first grab
+    # rather than at startup
+    return capture_backends.grab
+
+
+def to_pixel_bbox(bbox):
+    return tuple(int(round(v)) for v in bbox)
+
+
+def union_bbox(a, b):
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def crop_from(frame, frame_bbox, bbox):
+    if bbox == frame_bbox:
+        return frame
+
+    (x, y) = frame_bbox[:2]
+    return frame.crop((bbox[0] - x, bbox[1] - y, bbox[2] - x, bbox[3] - y))
+
+
+def grab_regions(capture_region, cast_bar_region, grab=None):
+    # One grab of the bounding union, so both images come from the same frame. When the capture
+    # region already contains the cast bar (the usual case) the capture image is the grabbed
+    # frame itself and only the small cast bar strip is copied out of it.
+    if capture_region is None or cast_bar_region is None:
+        # a region not selected yet is the whole screen, which grab takes as bbox=None
+        return grab_regions_separately(capture_region, cast_bar_region, grab)
+
+    capture_region = to_pixel_bbox(capture_region)
+    cast_bar_region = to_pixel_bbox(cast_bar_region)
+    frame_bbox = union_bbox(capture_region, cast_bar_region)
+    frame = (grab or default_grab())(bbox=frame_bbox)
+
+    return (crop_from(frame, frame_bbox, capture_region),
+            crop_from(frame, frame_bbox, cast_bar_region))
+
+
+def grab_regions_separately(capture_region, cast_bar_region, grab=None):
+    grab = grab or default_grab()
+    return (grab(bbox=capture_region), grab(bbox=cast_bar_region))
+
+
+def save_image(image, path):
+    image.save(path)
+    return path
+
+
+def capture_callout(callout, capture_region, cast_bar_region, single_grab=True, preroll_frame=None,
+                    save=save_image):
+    with tracing.span("grab", "capture"):
+        if preroll_frame is not None:
+            cast_image = preroll_frame.cast_image
+            screen_image = preroll_frame.screen_image
+            if screen_image is None:
+                screen_image = default_grab()(bbox=capture_region)
+        elif single_grab:
+            (screen_image, cast_image) = grab_regions(capture_region, cast_bar_region)
+        else:
+            (screen_image, cast_image) = grab_regions_separately(capture_region, cast_bar_region)
+
+    # save may store the image somewhere other than the suggested path, e.g. a shared blob
+    with tracing.span("save", "capture"):
+        callout.screen_image_path = save(screen_image, callout.screen_image_path)
+        callout.cast_image_path = save(cast_image, callout.cast_image_path)
+    return callout
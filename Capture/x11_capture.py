@@ -0,0 +1,251 @@
+import ctypes
+import ctypes.util
+import threading
+
+from PIL import Image
+
+# X11 grabs through the MIT-SHM extension: the server writes the pixels straight into a shared memory
+# segment, which is decoded into the PIL image, instead of sending them over the socket. One segment
+# the size of the screen is made up front and every grab size gets its own XImage header over it.
+# Needs libX11 and libXext, loaded with ctypes, and a local X server with MIT-SHM.
+
+Z_PIXMAP = 2
+ALL_PLANES = ctypes.c_ulong(-1).value
+IPC_PRIVATE = 0
+IPC_CREAT = 0o1000
+IPC_RMID = 0
+SHM_PERMISSIONS = 0o600
+
+# grab sizes keep their XImage header until there are more than this many
+MAX_IMAGE_HEADERS = 8
+
+
+class XImage(ctypes.Structure):
+    # the leading fields of Xlib's XImage, which are all that is read
+    _fields_ = [
+        ("width", ctypes.c_int),
+        ("height", ctypes.c_int),
+        ("xoffset", ctypes.c_int),
+        ("format", ctypes.c_int),
+        ("data", ctypes.c_void_p),
+        ("byte_order", ctypes.c_int),
+        ("bitmap_unit", ctypes.c_int),
+        ("bitmap_bit_order", ctypes.c_int),
+        ("bitmap_pad", ctypes.c_int),
+        ("depth", ctypes.c_int),
+        ("bytes_per_line", ctypes.c_int),
+        ("bits_per_pixel", ctypes.c_int),
+    ]
+
+
+class XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ("shmseg", ctypes.c_ulong),
+        ("shmid", ctypes.c_int),
+        ("shmaddr", ctypes.c_void_p),
+        ("readOnly", ctypes.c_int),
+    ]
+
+
+class XErrorEvent(ctypes.Structure):
+    _fields_ = [
+        ("type", ctypes.c_int),
+        ("display", ctypes.c_void_p),
+        ("resourceid", ctypes.c_ulong),
+        ("serial", ctypes.c_ulong),
+        ("error_code", ctypes.c_ubyte),
+        ("request_code", ctypes.c_ubyte),
+        ("minor_code", ctypes.c_ubyte),
+    ]
+
+
+ERROR_HANDLER_TYPE = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(XErrorEvent))
+
+# Xlib exits the process on an X error unless a handler is set. The handler is set once for the whole
+# process and lives as long as it does, since Xlib may still call it after any one backend is closed.
+# It records errors on the backends' displays, so a failed request is reported by its caller, and
+# hands errors on any other display to the handler it replaced.
+display_errors = {}
+error_handler_lock = threading.Lock()
+previous_error_handler = None
+error_handler_installed = False
+
+
+def on_x_error(display, event):
+    if display in display_errors:
+        display_errors[display] = event.contents.error_code
+        return 0
+    if previous_error_handler is not None:
+        return previous_error_handler(display, event)
+    return 0
+
+
+ERROR_HANDLER = ERROR_HANDLER_TYPE(on_x_error)
+
+
+def install_error_handler(set_error_handler):
+    global previous_error_handler, error_handler_installed
+    with error_handler_lock:
+        if error_handler_installed:
+            return
+        previous = set_error_handler(ERROR_HANDLER)
+        previous_error_handler = ERROR_HANDLER_TYPE(previous) if previous else None
+        error_handler_installed = True
+
+
+def load_library(name):
+    path = ctypes.util.find_library(name)
+    if path is None:
+        raise OSError(f"lib{name} not found")
+    return ctypes.CDLL(path)
+
+
+def declare(function, restype, *argtypes):
+    function.restype = restype
+    function.argtypes = argtypes
+    return function
+
+
+class X11ShmBackend:
+    name = "x11shm"
+
+    def __init__(self):
+        x11 = load_library("X11")
+        xext = load_library("Xext")
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        display_p = ctypes.c_void_p
+        image_p = ctypes.POINTER(XImage)
+        info_p = ctypes.POINTER(XShmSegmentInfo)
+
+        self.open_display = declare(x11.XOpenDisplay, display_p, ctypes.c_char_p)
+        self.close_display = declare(x11.XCloseDisplay, ctypes.c_int, display_p)
+        self.sync = declare(x11.XSync, ctypes.c_int, display_p, ctypes.c_int)
+        self.free = declare(x11.XFree, ctypes.c_int, ctypes.c_void_p)
+        self.set_error_handler = declare(x11.XSetErrorHandler, ctypes.c_void_p, ERROR_HANDLER_TYPE)
+        self.query_extension = declare(xext.XShmQueryExtension, ctypes.c_int, display_p)
+        self.create_image = declare(xext.XShmCreateImage, image_p, display_p, ctypes.c_void_p, ctypes.c_uint,
+                                    ctypes.c_int, ctypes.c_void_p, info_p, ctypes.c_uint, ctypes.c_uint)
+        self.attach = declare(xext.XShmAttach, ctypes.c_int, display_p, info_p)
+        self.detach = declare(xext.XShmDetach, ctypes.c_int, display_p, info_p)
+        self.get_image = declare(xext.XShmGetImage, ctypes.c_int, display_p, ctypes.c_ulong, image_p,
+                                 ctypes.c_int, ctypes.c_int, ctypes.c_ulong)
+        self.shmget = declare(libc.shmget, ctypes.c_int, ctypes.c_int, ctypes.c_size_t, ctypes.c_int)
+        self.shmat = declare(libc.shmat, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_int)
+        self.shmdt = declare(libc.shmdt, ctypes.c_int, ctypes.c_void_p)
+        self.shmctl = declare(libc.shmctl, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_void_p)
+
+        self.lock = threading.Lock()
+        self.images = {}
+        self.info = None
+        self.display = self.open_display(None)
+        if not self.display:
+            raise OSError("cannot open the X display")
+
+        display_errors[self.display] = None
+        install_error_handler(self.set_error_handler)
+
+        try:
+            if not self.query_extension(self.display):
+                raise OSError("the X server has no MIT-SHM extension")
+            screen = declare(x11.XDefaultScreen, ctypes.c_int, display_p)(self.display)
+            self.root = declare(x11.XRootWindow, ctypes.c_ulong, display_p, ctypes.c_int)(self.display, screen)
+            self.visual = declare(x11.XDefaultVisual, ctypes.c_void_p, display_p, ctypes.c_int)(self.display, screen)
+            self.depth = declare(x11.XDefaultDepth, ctypes.c_int, display_p, ctypes.c_int)(self.display, screen)
+            self.screen_size = (declare(x11.XDisplayWidth, ctypes.c_int, display_p, ctypes.c_int)(self.display, screen),
+                                declare(x11.XDisplayHeight, ctypes.c_int, display_p, ctypes.c_int)(self.display, screen))
+            self.attach_segment()
+        except Exception:
+            self.close()
+            raise
+
+    def error_code(self):
+        return display_errors.get(self.display)
+
+    def clear_error(self):
+        display_errors[self.display] = None
+
+    def attach_segment(self):
+        size = self.screen_size[0] * self.screen_size[1] * 4
+        info = XShmSegmentInfo()
+        info.shmid = self.shmget(IPC_PRIVATE, size, IPC_CREAT | SHM_PERMISSIONS)
+        if info.shmid < 0:
+            raise OSError(ctypes.get_errno(), "shmget failed")
+        info.shmaddr = self.shmat(info.shmid, None, 0)
+        if info.shmaddr in (None, ctypes.c_void_p(-1).value):
+            self.shmctl(info.shmid, IPC_RMID, None)
+            raise OSError(ctypes.get_errno(), "shmat failed")
+        info.readOnly = 0
+        self.info = info
+
+        self.clear_error()
+        attached = self.attach(self.display, ctypes.byref(info))
+        self.sync(self.display, 0)
+        # removed now, so the segment goes away with the process however it ends
+        self.shmctl(info.shmid, IPC_RMID, None)
+        if not attached or self.error_code() is not None:
+            self.shmdt(info.shmaddr)
+            self.info = None
+            raise OSError("XShmAttach failed, the X server is probably not local")
+
+    def image_for(self, size):
+        image = self.images.get(size)
+        if image is None:
+            if len(self.images) >= MAX_IMAGE_HEADERS:
+                self.free_images()
+            image = self.create_image(self.display, self.visual, self.depth, Z_PIXMAP, self.info.shmaddr,
+                                      ctypes.byref(self.info), size[0], size[1])
+            if not image:
+                raise OSError("XShmCreateImage failed")
+            bits_per_pixel = image.contents.bits_per_pixel
+            if bits_per_pixel != 32:
+                self.free(image)
+                raise OSError(f"{bits_per_pixel} bit X visuals are not supported")
+            self.images[size] = image
+        return image
+
+    def free_images(self):
+        # the headers only; their data is the shared segment
+        for image in self.images.values():
+            self.free(image)
+        self.images.clear()
+
+    def grab(self, bbox=None):
+        (width, height) = self.screen_size
+        (x1, y1, x2, y2) = tuple(int(round(v)) for v in bbox) if bbox is not None else (0, 0, width, height)
+        # X refuses a grab reaching past the screen, so only the part on it is grabbed
+        (left, top, right, bottom) = (max(x1, 0), max(y1, 0), min(x2, width), min(y2, height))
+        if right <= left or bottom <= top:
+            raise ValueError(f"region {(x1, y1, x2, y2)} is off the screen")
+
+        with self.lock:
+            # Xlib would be handed a null display
+            if not self.display:
+                raise OSError("the X11 capture backend is closed")
+            image = self.image_for((right - left, bottom - top))
+            self.clear_error()
+            if not self.get_image(self.display, self.root, image, left, top, ALL_PLANES) or self.error_code():
+                raise OSError(f"XShmGetImage failed with X error {self.error_code()}")
+            stride = image.contents.bytes_per_line
+            data = (ctypes.c_char * (stride * (bottom - top))).from_address(image.contents.data)
+            # decoded into an image of its own before the next grab reuses the segment
+            frame = Image.frombuffer("RGB", (right - left, bottom - top), data, "raw", "BGRX", stride, 1)
+
+        if (left, top, right, bottom) != (x1, y1, x2, y2):
+            padded = Image.new("RGB", (x2 - x1, y2 - y1))
+            padded.paste(frame, (left - x1, top - y1))
+            frame = padded
+        return frame
+
+    def close(self):
+        with self.lock:
+            if not self.display:
+                return
+            self.free_images()
+            if self.info is not None:
+                self.detach(self.display, ctypes.byref(self.info))
+                self.sync(self.display, 0)
+                self.shmdt(self.info.shmaddr)
+                self.info = None
+            self.close_display(self.display)
+            display_errors.pop(self.display, None)
+            self.display = None
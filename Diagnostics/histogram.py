@@ -0,0 +1,63 @@
+import bisect
+import math
+
+# upper bucket edges in ms; values past the last edge land in an overflow bucket
+DEFAULT_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 250)
+
+
+class LatencyHistogram:
+    def __init__(self, name, buckets_ms=DEFAULT_BUCKETS_MS):
+        self.name = name
+        self.buckets_ms = tuple(buckets_ms)
+        self.clear()
+
+    def clear(self):
+        self.counts = [0] * (len(self.buckets_ms) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def record(self, value_ms):
+        self.counts[bisect.bisect_left(self.buckets_ms, abs(value_ms))] += 1
+        self.count += 1
+        self.total += value_ms
+        self.total_squares += value_ms * value_ms
+        self.min = min(self.min, value_ms)
+        self.max = max(self.max, value_ms)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def stddev(self):
+        if self.count < 2:
+            return 0.0
+        return math.sqrt(max(0.0, self.total_squares / self.count - self.mean() ** 2))
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "count": self.count,
+            "mean_ms": self.mean(),
+            "stddev_ms": self.stddev(),
+            "min_ms": self.min if self.count else 0.0,
+            "max_ms": self.max if self.count else 0.0,
+            "buckets_ms": list(self.buckets_ms),
+            "counts": list(self.counts),
+        }
+
+    def report(self):
+        if not self.count:
+            return f"{self.name}: no samples"
+
+        lines = [f"{self.name}: n={self.count} mean={self.mean():.2f}ms stddev={self.stddev():.2f}ms "
+                 f"min={self.min:.2f}ms max={self.max:.2f}ms"]
+        width = max(self.counts)
+        lower = 0
+        for (edge, count) in zip(self.buckets_ms + (math.inf,), self.counts):
+            label = f"<{edge:g}ms" if edge != math.inf else f">={lower:g}ms"
+            bar = "#" * math.ceil(40 * count / width) if count else ""
+            lines.append(f"  {label:>9} {count:7d} {bar}")
+            lower = edge
+        return "\n".join(lines)
@@ -0,0 +1,132 @@
+import collections
+import json
+import os
+import threading
+import time
+
+from Diagnostics.histogram import LatencyHistogram
+
+# Spans and counters for finding where a stutter comes from. Tracing is off unless enable() is called
+# (or FFTIMER_TRACE names a file to write on exit); while off, span() hands back one shared no-op
+# context manager and counter() returns straight away, so instrumented code pays a function call.
+# write_trace() saves the Chrome trace event format, which chrome://tracing and ui.perfetto.dev open.
+
+# the newest events are kept, older ones are dropped once this many are buffered
+MAX_EVENTS = 200000
+TRACE_ENVIRONMENT_VARIABLE = "FFTIMER_TRACE"
+
+enabled = False
+events = collections.deque(maxlen=MAX_EVENTS)
+span_stats = {}
+counters = {}
+origin_ns = time.perf_counter_ns()
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ("name", "category", "args", "start_ns")
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *args):
+        end_ns = time.perf_counter_ns()
+        events.append(("X", self.name, self.category, self.start_ns, end_ns - self.start_ns,
+                       threading.get_ident(), self.args))
+        stats = span_stats.get(self.name)
+        if stats is None:
+            stats = span_stats.setdefault(self.name, LatencyHistogram(self.name))
+        stats.record((end_ns - self.start_ns) / 1e6)
+        return False
+
+
+def span(name, category="app", **args):
+    if not enabled:
+        return NULL_SPAN
+    return Span(name, category, args)
+
+
+def counter(name, value):
+    if not enabled:
+        return
+    counters[name] = value
+    events.append(("C", name, "counter", time.perf_counter_ns(), 0, threading.get_ident(), {"value": value}))
+
+
+def increment(name, amount=1):
+    if enabled:
+        counter(name, counters.get(name, 0) + amount)
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def clear():
+    events.clear()
+    span_stats.clear()
+    counters.clear()
+
+
+def trace_events():
+    # a copy of the buffer as Chrome trace events, timestamps in microseconds since import
+    pid = os.getpid()
+    thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+    trace = []
+    seen_threads = set()
+    for (phase, name, category, start_ns, duration_ns, tid, args) in list(events):
+        event = {"ph": phase, "name": name, "cat": category, "ts": (start_ns - origin_ns) / 1000,
+                 "pid": pid, "tid": tid}
+        if phase == "X":
+            event["dur"] = duration_ns / 1000
+        if args:
+            event["args"] = args
+        trace.append(event)
+        seen_threads.add(tid)
+    for tid in seen_threads:
+        trace.append({"ph": "M", "name": "thread_name", "pid": pid, "tid": tid,
+                      "args": {"name": thread_names.get(tid, f"thread {tid}")}})
+    return trace
+
+
+def write_trace(path):
+    with open(path, 'w') as f:
+        json.dump({"traceEvents": trace_events(), "displayTimeUnit": "ms"}, f)
+    return path
+
+
+def report():
+    lines = [f"{name:<20} n={stats.count:<7} mean={stats.mean():7.2f}ms max={stats.max:8.2f}ms"
+             for (name, stats) in sorted(span_stats.items())]
+    lines += [f"{name:<20} {value}" for (name, value) in sorted(counters.items())]
+    return "\n".join(lines)
+
+
+def trace_path_from_environment():
+    return os.environ.get(TRACE_ENVIRONMENT_VARIABLE) or None
+
+
+if trace_path_from_environment():
+    enable()
@@ -7,4 +7,26 @@ class Callout:
     active: bool
     notes: str
     screen_image_path: str
-    cast_image_path: str
\ No newline at end of file
+    cast_image_path: str
+
+
+def callout_from_dict(c):
+    return Callout(
+        timestamp=c["timestamp"],
+        description=c["description"],
+        active=c["active"],
+        notes=c["notes"],
+        screen_image_path=c["screen_image_path"],
+        cast_image_path=c["cast_image_path"])
+
+
+def callout_to_dict(c):
+    # works for Callout and for TimelineStore row views
+    return {
+        "timestamp": c.timestamp,
+        "description": c.description,
+        "active": c.active,
+        "notes": c.notes,
+        "screen_image_path": c.screen_image_path,
+        "cast_image_path": c.cast_image_path,
+    }
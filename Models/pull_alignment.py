@@ -0,0 +1,311 @@
+# Builds one consensus timeline from many recorded pulls of the same phase. Every pull's callouts are
+# shifted by a per-pull offset, found by cross-correlating its callout train against a reference,
+# then matched to the reference callouts with a monotonic alignment in which unmatched callouts cost a
+# gap penalty. The consensus time of a callout is the mean of its aligned times, with their variance
+# kept as the callout's jitter.
+#
+#   python -m Models.pull_alignment PHASE [PHASE ...] [--output consensus.phase] [--report stats.json]
+import argparse
+import collections
+import json
+import os
+
+import numpy as np
+
+import util
+from Models.callout import Callout
+from Storage.phase_file import BINARY_EXTENSION, read_phase, write_phase
+
+# bin width of the callout trains used to find each pull's offset
+DEFAULT_BIN_MS = 50
+# pulls are not shifted by more than this relative to the reference
+DEFAULT_MAX_OFFSET_MS = 5000
+# width of the gaussian the trains are smoothed with, so nearby callouts still line up
+DEFAULT_SMOOTH_MS = 250
+# cost of leaving a callout unmatched, in ms of timing error
+DEFAULT_GAP_MS = 1500
+# extra cost of matching callouts with different descriptions
+DEFAULT_DESCRIPTION_PENALTY_MS = 1000
+# fraction of the pulls that got as far as a callout which have to agree on it
+DEFAULT_MIN_SUPPORT = 0.5
+DEFAULT_ITERATIONS = 3
+# alignment tables are built for this many cells at most at a time
+MAX_ALIGNMENT_CELLS = 1 << 25
+
+DIAGONAL = 0
+UP = 1
+LEFT = 2
+
+
+class Pull:
+    __slots__ = ("path", "callouts", "timestamps", "codes")
+
+    def __init__(self, path, callouts, vocabulary):
+        self.path = path
+        self.callouts = sorted(callouts, key=lambda callout: callout.timestamp)
+        self.timestamps = np.array([callout.timestamp for callout in self.callouts], dtype=np.float64)
+        self.codes = np.array([vocabulary.setdefault(callout.description, len(vocabulary))
+                               for callout in self.callouts], dtype=np.int32)
+
+
+def load_pulls(paths):
+    vocabulary = {}
+    return [Pull(path, read_phase(path), vocabulary) for path in paths]
+
+
+def estimate_offsets(pulls, reference_times, bin_ms=DEFAULT_BIN_MS, max_offset_ms=DEFAULT_MAX_OFFSET_MS,
+                     smooth_ms=DEFAULT_SMOOTH_MS):
+    # offset of every pull against the reference, from one batched FFT cross-correlation
+    times = [pull.timestamps for pull in pulls if len(pull.timestamps)] + [reference_times]
+    origin = min(t.min() for t in times if len(t)) - max_offset_ms
+    end = max(t.max() for t in times if len(t)) + max_offset_ms
+    length = int((end - origin) // bin_ms) + 1
+    size = 1 << int(2 * length - 1).bit_length()
+
+    trains = np.zeros((len(pulls) + 1, length))
+    for (row, t) in enumerate([pull.timestamps for pull in pulls] + [reference_times]):
+        np.add.at(trains[row], ((t - origin) // bin_ms).astype(np.int64), 1.0)
+
+    sigma = smooth_ms / bin_ms
+    frequencies = np.fft.rfftfreq(size)
+    gaussian = np.exp(-0.5 * (2 * np.pi * frequencies * sigma) ** 2)
+    spectra = np.fft.rfft(trains, size, axis=1)
+    correlation = np.fft.irfft(spectra[:-1] * np.conj(spectra[-1]) * gaussian, size, axis=1)
+
+    max_lag = int(max_offset_ms // bin_ms)
+    lags = np.arange(-max_lag, max_lag + 1)
+    best = np.argmax(correlation[:, lags % size], axis=1)
+    return lags[best] * float(bin_ms)
+
+
+def alignment_moves(times, codes, lengths, reference_times, reference_codes, gap_ms, description_penalty_ms):
+    # Needleman-Wunsch over a batch of pulls at once: times and codes are padded to the longest pull.
+    # The left moves within a row are resolved with a running minimum, so every row is a handful of
+    # array operations over (pulls, reference callouts).
+    (pull_count, row_count) = times.shape
+    column_gaps = gap_ms * np.arange(len(reference_times) + 1)
+    moves = np.empty((pull_count, row_count + 1, len(reference_times) + 1), dtype=np.int8)
+    moves[:, 0, :] = LEFT
+    previous = np.broadcast_to(column_gaps, (pull_count, len(column_gaps))).copy()
+
+    for row in range(row_count):
+        cost = np.abs(times[:, row, None] - reference_times) + \
+            description_penalty_ms * (codes[:, row, None] != reference_codes)
+        diagonal = previous[:, :-1] + cost
+        up = previous + gap_ms
+        from_diagonal = np.zeros(up.shape, dtype=bool)
+        from_diagonal[:, 1:] = diagonal <= up[:, 1:]
+        best = np.where(from_diagonal, np.pad(diagonal, ((0, 0), (1, 0))), up)
+
+        shifted = best - column_gaps
+        running = np.minimum.accumulate(shifted, axis=1)
+        from_left = running < shifted
+        current = np.where(from_left, running + column_gaps, best)
+        moves[:, row + 1] = np.where(from_left, LEFT, np.where(from_diagonal, DIAGONAL, UP))
+        # rows past the end of a pull leave its table as it was
+        active = (row < lengths)[:, None]
+        previous = np.where(active, current, previous)
+    return moves
+
+
+def trace_matches(moves, length, column_count):
+    # (pull callout, reference callout) pairs along the best path, in order
+    (row, column) = (length, column_count)
+    matches = []
+    while row > 0 and column > 0:
+        move = moves[row, column]
+        if move == DIAGONAL:
+            matches.append((row - 1, column - 1))
+            row -= 1
+            column -= 1
+        elif move == UP:
+            row -= 1
+        else:
+            column -= 1
+    matches.reverse()
+    return matches
+
+
+def align_pulls(pulls, offsets, reference_times, reference_codes, gap_ms=DEFAULT_GAP_MS,
+                description_penalty_ms=DEFAULT_DESCRIPTION_PENALTY_MS):
+    # matched pairs for every pull, aligned in batches that keep the move tables bounded
+    column_count = len(reference_times)
+    order = sorted(range(len(pulls)), key=lambda p: len(pulls[p].timestamps))
+    matches = [[] for _ in pulls]
+
+    start = 0
+    while start < len(order):
+        # pulls are in length order, so the last one in a batch sets its table size
+        end = start + 1
+        while end < len(order) and \
+                (end - start + 1) * (len(pulls[order[end]].timestamps) + 1) * (column_count + 1) <= MAX_ALIGNMENT_CELLS:
+            end += 1
+        batch = order[start:end]
+        longest = max(len(pulls[p].timestamps) for p in batch)
+
+        times = np.full((len(batch), longest), np.inf)
+        codes = np.full((len(batch), longest), -1, dtype=np.int32)
+        lengths = np.zeros(len(batch), dtype=np.int64)
+        for (i, p) in enumerate(batch):
+            n = len(pulls[p].timestamps)
+            times[i, :n] = pulls[p].timestamps - offsets[p]
+            codes[i, :n] = pulls[p].codes
+            lengths[i] = n
+
+        moves = alignment_moves(times, codes, lengths, reference_times, reference_codes, gap_ms,
+                                description_penalty_ms)
+        for (i, p) in enumerate(batch):
+            matches[p] = trace_matches(moves[i], lengths[i], column_count)
+        start = end
+    return matches
+
+
+def missing_callouts(pulls, offsets, matches, pull_ends, min_support, gap_ms):
+    # callouts the reference lacks: unmatched callouts that enough pulls put within half a gap of each other
+    unmatched = []
+    for (p, pull) in enumerate(pulls):
+        mask = np.ones(len(pull.timestamps), dtype=bool)
+        if matches[p]:
+            mask[np.array(matches[p])[:, 0]] = False
+        unmatched.append((pull.timestamps[mask] - offsets[p], pull.codes[mask]))
+    times = np.concatenate([t for (t, _) in unmatched])
+    codes = np.concatenate([c for (_, c) in unmatched])
+    if not len(times):
+        return (np.array([]), np.array([], dtype=np.int32))
+    order = np.argsort(times, kind="stable")
+    (times, codes) = (times[order], codes[order])
+
+    window = gap_ms / 2
+    starts = np.searchsorted(times, times - window, side="left")
+    ends = np.searchsorted(times, times + window, side="right")
+    eligible = np.maximum(np.sum(pull_ends[:, None] >= times - gap_ms, axis=0), 1)
+    candidates = np.flatnonzero(ends - starts >= min_support * eligible)
+
+    # densest first, and nothing within a gap of a callout already found
+    found_times = []
+    found_codes = []
+    for i in candidates[np.argsort(starts[candidates] - ends[candidates], kind="stable")]:
+        center = float(np.median(times[starts[i]:ends[i]]))
+        if any(abs(center - t) < gap_ms for t in found_times):
+            continue
+        found_times.append(center)
+        found_codes.append(collections.Counter(codes[starts[i]:ends[i]].tolist()).most_common(1)[0][0])
+    return (np.array(found_times), np.array(found_codes, dtype=np.int32))
+
+
+def build_consensus(pulls, min_support=DEFAULT_MIN_SUPPORT, iterations=DEFAULT_ITERATIONS, gap_ms=DEFAULT_GAP_MS,
+                    description_penalty_ms=DEFAULT_DESCRIPTION_PENALTY_MS, **offset_settings):
+    # returns (callouts, per-callout stats, {pull path: offset in ms})
+    pulls = [pull for pull in pulls if len(pull.timestamps)]
+    if not pulls:
+        return ([], [], {})
+
+    # the pull with the most callouts is the first reference, later ones are the consensus so far
+    reference = max(pulls, key=lambda pull: len(pull.timestamps))
+    (reference_times, reference_codes) = (reference.timestamps, reference.codes)
+
+    for iteration in range(iterations):
+        offsets = estimate_offsets(pulls, reference_times, **offset_settings)
+        matches = align_pulls(pulls, offsets, reference_times, reference_codes, gap_ms, description_penalty_ms)
+        for (p, pull) in enumerate(pulls):
+            # refine the cross-correlation estimate with the matched callouts themselves
+            if matches[p]:
+                (rows, columns) = np.array(matches[p]).T
+                offsets[p] += np.median(pull.timestamps[rows] - offsets[p] - reference_times[columns])
+
+        matches = align_pulls(pulls, offsets, reference_times, reference_codes, gap_ms, description_penalty_ms)
+        aligned = np.full((len(pulls), len(reference_times)), np.nan)
+        members = np.full((len(pulls), len(reference_times)), -1, dtype=np.int64)
+        for (p, pull) in enumerate(pulls):
+            if matches[p]:
+                (rows, columns) = np.array(matches[p]).T
+                aligned[p, columns] = pull.timestamps[rows] - offsets[p]
+                members[p, columns] = rows
+
+        counts = np.sum(members >= 0, axis=0)
+        # a pull that ended (wiped) before a callout does not count against it
+        pull_ends = np.array([pull.timestamps[-1] - offsets[p] for (p, pull) in enumerate(pulls)])
+        eligible = np.maximum(np.sum(pull_ends[:, None] >= reference_times - gap_ms, axis=0), 1)
+        keep = (counts > 0) & (counts >= min_support * eligible)
+
+        with np.errstate(invalid="ignore"):
+            means = np.nanmean(aligned[:, keep], axis=0) if keep.any() else np.array([])
+        kept_codes = []
+        for column in np.flatnonzero(keep):
+            column_codes = [pulls[p].codes[members[p, column]] for p in np.flatnonzero(members[:, column] >= 0)]
+            kept_codes.append(collections.Counter(column_codes).most_common(1)[0][0])
+
+        if iteration == iterations - 1 or not keep.any():
+            break
+        # callouts the reference missed are added, to be aligned on the next iteration
+        (found_times, found_codes) = missing_callouts(pulls, offsets, matches, pull_ends, min_support, gap_ms)
+        times = np.concatenate([means, found_times])
+        order = np.argsort(times, kind="stable")
+        (reference_times, reference_codes) = (times[order],
+                                              np.concatenate([np.array(kept_codes, dtype=np.int32), found_codes])[order])
+
+    return consensus_callouts(pulls, offsets, aligned[:, keep], members[:, keep], counts[keep], eligible[keep])
+
+
+def consensus_callouts(pulls, offsets, aligned, members, counts, eligible):
+    # consensus times keep the pulls' mean offset, so they line up with a typical pull's timer
+    mean_offset = float(np.mean(offsets))
+    with np.errstate(invalid="ignore"):
+        means = np.nanmean(aligned, axis=0)
+        variances = np.nanvar(aligned, axis=0, ddof=1) if len(pulls) > 1 else np.zeros(len(means))
+    variances = np.nan_to_num(variances)
+
+    callouts = []
+    stats = []
+    for column in np.argsort(means, kind="stable"):
+        contributors = np.flatnonzero(members[:, column] >= 0)
+        matched = [pulls[p].callouts[members[p, column]] for p in contributors]
+        description = collections.Counter(callout.description for callout in matched).most_common(1)[0][0]
+        active = sum(callout.active for callout in matched) * 2 >= len(matched)
+        # screenshots of the pull closest to the consensus time
+        closest = matched[int(np.argmin(np.abs(aligned[contributors, column] - means[column])))]
+        stddev = float(np.sqrt(variances[column]))
+
+        callouts.append(Callout(
+            timestamp=float(means[column]) + mean_offset,
+            description=description,
+            active=active,
+            notes=f"seen in {counts[column]}/{eligible[column]} pulls, sd {util.format_ms(stddev)}s",
+            screen_image_path=closest.screen_image_path,
+            cast_image_path=closest.cast_image_path))
+        stats.append({
+            "description": description,
+            "mean_ms": float(means[column]) + mean_offset,
+            "variance_ms2": float(variances[column]),
+            "stddev_ms": stddev,
+            "count": int(counts[column]),
+            "eligible": int(eligible[column]),
+        })
+    return (callouts, stats, {pull.path: float(offset) for (pull, offset) in zip(pulls, offsets)})
+
+
+def consensus_from_files(paths, **settings):
+    return build_consensus(load_pulls(paths), **settings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge recorded pulls of a phase into one consensus timeline.")
+    parser.add_argument("phases", nargs="+")
+    parser.add_argument("--output", default=os.path.join(util.BASE_PATH, f"consensus{BINARY_EXTENSION}"))
+    parser.add_argument("--report", help="write per-callout mean and variance and per-pull offsets as JSON")
+    parser.add_argument("--min-support", type=float, default=DEFAULT_MIN_SUPPORT)
+    parser.add_argument("--gap-ms", type=float, default=DEFAULT_GAP_MS)
+    parser.add_argument("--max-offset-ms", type=float, default=DEFAULT_MAX_OFFSET_MS)
+    args = parser.parse_args()
+
+    (callouts, stats, offsets) = consensus_from_files(
+        args.phases, min_support=args.min_support, gap_ms=args.gap_ms, max_offset_ms=args.max_offset_ms)
+    write_phase(args.output, callouts)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({"callouts": stats, "offsets_ms": offsets}, f, indent=2)
+    print(f"{len(callouts)} callouts from {len(args.phases)} pulls written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+import bisect
+import itertools
+import operator
+import sys
+from array import array
+
+from Models.callout import Callout
+
+FIELDS = ("timestamp", "description", "active", "notes", "screen_image_path", "cast_image_path")
+
+
+class CalloutView:
+    # A row of a TimelineStore that reads and writes like a Callout. Views follow their row through
+    # inserts and removals by a stable id instead of holding the position.
+    __slots__ = ("store", "id", "row")
+
+    def __init__(self, store, row):
+        self.store = store
+        self.id = store.ids[row]
+        self.row = row
+
+    def current_row(self):
+        # None once the row has been removed
+        ids = self.store.ids
+        if self.row >= len(ids) or ids[self.row] != self.id:
+            try:
+                self.row = ids.index(self.id)
+            except ValueError:
+                return None
+        return self.row
+
+    @property
+    def timestamp(self):
+        return self.store.timestamps[self.current_row()]
+
+    @timestamp.setter
+    def timestamp(self, value):
+        self.store.timestamps[self.current_row()] = value
+
+    @property
+    def description(self):
+        return self.store.descriptions[self.current_row()]
+
+    @description.setter
+    def description(self, value):
+        self.store.descriptions[self.current_row()] = sys.intern(value)
+
+    @property
+    def active(self):
+        return bool(self.store.active[self.current_row()])
+
+    @active.setter
+    def active(self, value):
+        self.store.active[self.current_row()] = bool(value)
+
+    @property
+    def notes(self):
+        return self.store.notes[self.current_row()]
+
+    @notes.setter
+    def notes(self, value):
+        self.store.notes[self.current_row()] = value
+
+    @property
+    def screen_image_path(self):
+        return self.store.screen_image_paths[self.current_row()]
+
+    @screen_image_path.setter
+    def screen_image_path(self, value):
+        self.store.screen_image_paths[self.current_row()] = sys.intern(value)
+
+    @property
+    def cast_image_path(self):
+        return self.store.cast_image_paths[self.current_row()]
+
+    @cast_image_path.setter
+    def cast_image_path(self, value):
+        self.store.cast_image_paths[self.current_row()] = sys.intern(value)
+
+    def __eq__(self, other):
+        return all(getattr(self, field) == getattr(other, field, None) for field in FIELDS)
+
+    def __repr__(self):
+        values = ", ".join(f"{field}={getattr(self, field)!r}" for field in FIELDS)
+        return f"CalloutView({values})"
+
+
+class TimelineStore:
+    # Struct-of-arrays timeline: timestamps and active flags in typed arrays, repeated strings
+    # (descriptions, shared screenshot paths) interned. Indexing returns CalloutView rows.
+    def __init__(self, callouts=()):
+        self.ids = array('q')
+        self.timestamps = array('d')
+        self.active = array('b')
+        self.descriptions = []
+        self.notes = []
+        self.screen_image_paths = []
+        self.cast_image_paths = []
+        self.next_id = itertools.count()
+        self.extend(callouts)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [CalloutView(self, i) for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("timeline row out of range")
+        return CalloutView(self, row)
+
+    def __iter__(self):
+        return (CalloutView(self, row) for row in range(len(self)))
+
+    def __delitem__(self, rows):
+        for column in self.columns():
+            del column[rows]
+
+    def columns(self):
+        return (self.ids, self.timestamps, self.active, self.descriptions, self.notes,
+                self.screen_image_paths, self.cast_image_paths)
+
+    def copy(self):
+        return TimelineStore(Callout(*values) for values in self.rows())
+
+    def rows(self):
+        # plain value tuples in Callout field order, without building views
+        return zip(self.timestamps, self.descriptions, map(bool, self.active), self.notes,
+                   self.screen_image_paths, self.cast_image_paths)
+
+    def insert(self, row, callout):
+        self.ids.insert(row, next(self.next_id))
+        self.timestamps.insert(row, callout.timestamp)
+        self.active.insert(row, bool(callout.active))
+        self.descriptions.insert(row, sys.intern(callout.description))
+        self.notes.insert(row, callout.notes)
+        self.screen_image_paths.insert(row, sys.intern(callout.screen_image_path))
+        self.cast_image_paths.insert(row, sys.intern(callout.cast_image_path))
+
+    def append(self, callout):
+        self.ids.append(next(self.next_id))
+        self.timestamps.append(callout.timestamp)
+        self.active.append(bool(callout.active))
+        self.descriptions.append(sys.intern(callout.description))
+        self.notes.append(callout.notes)
+        self.screen_image_paths.append(sys.intern(callout.screen_image_path))
+        self.cast_image_paths.append(sys.intern(callout.cast_image_path))
+
+    def extend(self, callouts):
+        for callout in callouts:
+            self.append(callout)
+
+    def clear(self):
+        del self[:]
+
+    def is_sorted(self):
+        return all(map(operator.le, self.timestamps, itertools.islice(self.timestamps, 1, None)))
+
+    def sorted_rows(self):
+        return sorted(range(len(self)), key=self.timestamps.__getitem__)
+
+    def reorder(self, order):
+        # rebuild every column so that new row i is old row order[i]; order may also drop rows
+        self.ids = array('q', (self.ids[i] for i in order))
+        self.timestamps = array('d', (self.timestamps[i] for i in order))
+        self.active = array('b', (self.active[i] for i in order))
+        for name in ("descriptions", "notes", "screen_image_paths", "cast_image_paths"):
+            column = getattr(self, name)
+            setattr(self, name, [column[i] for i in order])
+
+    def sort(self):
+        # stable sort of every column by timestamp
+        self.reorder(self.sorted_rows())
+
+    def insert_sorted(self, callout):
+        # after any rows with the same timestamp, so equal callouts keep the order they were added in
+        row = self.bisect_right(callout.timestamp)
+        self.insert(row, callout)
+        return row
+
+    def merge(self, callouts):
+        # adds callouts to a sorted store and returns the rows they ended up in, ascending
+        first_new = len(self)
+        self.extend(callouts)
+        order = self.sorted_rows()
+        self.reorder(order)
+        return [row for (row, old_row) in enumerate(order) if old_row >= first_new]
+
+    def delete_rows(self, rows):
+        rows = set(rows)
+        self.reorder([row for row in range(len(self)) if row not in rows])
+
+    def move(self, row, to_row):
+        for column in self.columns():
+            column.insert(to_row, column.pop(row))
+
+    def sorted_position(self, row, timestamp):
+        # where row belongs once its timestamp becomes timestamp, with the other rows left in place
+        timestamps = self.timestamps
+        if row + 1 < len(timestamps) and timestamp > timestamps[row + 1]:
+            return bisect.bisect_right(timestamps, timestamp, row + 1) - 1
+        if row > 0 and timestamp < timestamps[row - 1]:
+            return bisect.bisect_right(timestamps, timestamp, 0, row)
+        return row
+
+    def bisect_left(self, timestamp):
+        # only meaningful while the store is sorted by timestamp
+        return bisect.bisect_left(self.timestamps, timestamp)
+
+    def bisect_right(self, timestamp):
+        return bisect.bisect_right(self.timestamps, timestamp)
+
+    def active_rows(self):
+        return [row for (row, active) in enumerate(self.active) if active]
+
+    def rows_between(self, start_ms, end_ms):
+        if self.is_sorted():
+            return range(self.bisect_left(start_ms), self.bisect_right(end_ms))
+        return [row for (row, timestamp) in enumerate(self.timestamps) if start_ms <= timestamp <= end_ms]
@@ -0,0 +1,147 @@
+import csv
+import io
+import itertools
+import json
+
+import util
+from Models.callout import Callout, callout_to_dict
+
+EXPORT_EXTENSION = ".txt"
+
+# formats produce text in pieces of about this many characters, written out as they come
+CHUNK_CHARS = 1 << 16
+# a subtitle cue lasts until the next callout, and at most this long
+DEFAULT_CUE_MS = 5000
+
+CSV_HEADER = ("timestamp_s", "description", "active", "notes", "screen_image_path", "cast_image_path")
+
+
+def select_callouts(callouts, active_only=True, start_ms=None, end_ms=None):
+    # callouts in [start_ms, end_ms], lazily; a TimelineStore range is found by bisection
+    start_ms = float("-inf") if start_ms is None else start_ms
+    end_ms = float("inf") if end_ms is None else end_ms
+    if hasattr(callouts, "rows_between"):
+        rows = callouts.rows_between(start_ms, end_ms)
+        if isinstance(rows, range):
+            selected = itertools.starmap(Callout, itertools.islice(callouts.rows(), rows.start, rows.stop))
+        else:
+            selected = (callouts[row] for row in rows)
+    else:
+        selected = (callout for callout in callouts if start_ms <= callout.timestamp <= end_ms)
+    if active_only:
+        selected = (callout for callout in selected if callout.active)
+    return selected
+
+
+def batched_lines(lines):
+    # joins lines into pieces of about CHUNK_CHARS, so the writer is called a few times per MB
+    chunk = []
+    size = 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if size >= CHUNK_CHARS:
+            yield "".join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield "".join(chunk)
+
+
+def tsv_chunks(callouts):
+    # the clipboard format: "seconds<TAB>description"
+    return batched_lines(f"{util.format_ms(callout.timestamp)}\t{callout.description}\n" for callout in callouts)
+
+
+def csv_chunks(callouts):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(CSV_HEADER)
+    for callout in callouts:
+        writer.writerow((util.format_ms(callout.timestamp), callout.description, int(callout.active), callout.notes,
+                         callout.screen_image_path, callout.cast_image_path))
+        if buffer.tell() >= CHUNK_CHARS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def jsonl_chunks(callouts):
+    return batched_lines(json.dumps(callout_to_dict(callout)) + "\n" for callout in callouts)
+
+
+def srt_time(ms):
+    ms = max(0, int(round(ms)))
+    (seconds, ms) = divmod(ms, 1000)
+    (minutes, seconds) = divmod(seconds, 60)
+    (hours, minutes) = divmod(minutes, 60)
+    return f"{hours:02}:{minutes:02}:{seconds:02},{ms:03}"
+
+
+def srt_cues(callouts, cue_ms=DEFAULT_CUE_MS):
+    # a cue ends where the next one starts, so each one is written once the next callout is seen
+    (current, upcoming) = itertools.tee(callouts)
+    next(upcoming, None)
+    for (number, (callout, following)) in enumerate(itertools.zip_longest(current, upcoming), 1):
+        end_ms = callout.timestamp + cue_ms
+        if following is not None:
+            end_ms = min(end_ms, max(following.timestamp, callout.timestamp + 1))
+        text = callout.description + (f"\n{callout.notes}" if callout.notes else "")
+        yield f"{number}\n{srt_time(callout.timestamp)} --> {srt_time(end_ms)}\n{text}\n\n"
+
+
+def srt_chunks(callouts):
+    return batched_lines(srt_cues(callouts))
+
+
+def overlay_chunks(callouts):
+    # timeline file for raid overlays (cactbot style): one "seconds "text"" entry per line
+    lines = (f'{callout.timestamp / 1000:.1f} "{callout.description.replace(chr(34), chr(39))}"\n'
+             for callout in callouts)
+    return batched_lines(itertools.chain(["# exported from fftimer\n"], lines))
+
+
+# name: (file extension, function from callouts to text chunks); add_format registers more
+EXPORT_FORMATS = {
+    "tsv": (EXPORT_EXTENSION, tsv_chunks),
+    "csv": (".csv", csv_chunks),
+    "jsonl": (".jsonl", jsonl_chunks),
+    "srt": (".srt", srt_chunks),
+    "overlay": (".timeline", overlay_chunks),
+}
+
+
+def add_format(name, extension, chunks):
+    EXPORT_FORMATS[name] = (extension, chunks)
+
+
+def format_for_path(path, default="tsv"):
+    for (name, (extension, _)) in EXPORT_FORMATS.items():
+        if path.lower().endswith(extension):
+            return name
+    return default
+
+
+def export_chunks(callouts, export_format="tsv", **filters):
+    (_, chunks) = EXPORT_FORMATS[export_format]
+    return chunks(select_callouts(callouts, **filters))
+
+
+def write_export(f, callouts, export_format="tsv", **filters):
+    # streams into an open text file; returns the number of characters written
+    written = 0
+    for chunk in export_chunks(callouts, export_format, **filters):
+        f.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def export_file(path, callouts, export_format=None, **filters):
+    with open(path, 'w', encoding="utf-8", newline="") as f:
+        return write_export(f, callouts, export_format or format_for_path(path), **filters)
+
+
+def export_text(callouts, export_format="tsv", **filters):
+    # for the clipboard, which only takes the whole text at once
+    return "".join(export_chunks(callouts, export_format, **filters))
@@ -0,0 +1,258 @@
+import json
+import mmap
+import operator
+import os
+import struct
+import sys
+from array import array
+
+from Models.callout import Callout, callout_from_dict, callout_to_dict
+
+JSON_EXTENSION = ".json"
+BINARY_EXTENSION = ".phase"
+
+# A binary phase is a header followed by one section per column, every string stored once in a
+# string table and referenced by index. Screenshot paths are split into a folder, relative to the
+# phase file's folder, and a file name, so the folder shared by every screenshot is stored and
+# resolved once; a folder that was relative to begin with is stored behind a NUL, which no path can
+# contain, and read back as written. Sections start on 8 byte boundaries so the file can be mapped
+# and the timestamps read in place without touching the strings. Everything is little-endian.
+#   header: magic, version, row count, string count, string data size
+#   timestamps: float64 per row
+#   description, notes, and a folder and a name for each screenshot path: uint32 string index per row
+#   active: uint8 per row
+#   string offsets: uint64 per string plus one, into the string data
+#   string data: utf-8
+MAGIC = b"FFTP"
+VERSION = 2
+# version 1 had no kept-relative folders, its files read the same
+READABLE_VERSIONS = (1, 2)
+KEPT_FOLDER_PREFIX = "\0"
+HEADER = struct.Struct("<4sHxxQQQ")
+PATH_COLUMNS = ("screen_image_path", "cast_image_path")
+STRING_SECTIONS = ("description", "notes", "screen_image_folder", "screen_image_name", "cast_image_folder",
+                   "cast_image_name")
+
+
+def align(offset):
+    return (offset + 7) & ~7
+
+
+def section_layout(row_count, string_count):
+    # offsets of every section, in file order
+    offsets = {}
+    offset = HEADER.size
+    for (name, size) in (("timestamps", 8 * row_count),
+                         *((section, 4 * row_count) for section in STRING_SECTIONS),
+                         ("active", row_count),
+                         ("string_offsets", 8 * (string_count + 1)),
+                         ("string_data", 0)):
+        offset = align(offset)
+        offsets[name] = offset
+        offset += size
+    return offsets
+
+
+def is_binary_phase(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def relative_folder(folder, phase_folder):
+    if not folder:
+        return folder
+    if not os.path.isabs(folder):
+        return KEPT_FOLDER_PREFIX + folder
+    try:
+        relative = os.path.relpath(folder, phase_folder)
+    except ValueError:
+        # another drive on Windows
+        return folder
+    # "." rather than "" for the phase's own folder, an empty folder is kept for bare file names
+    return relative
+
+
+def absolute_folder(folder, phase_folder):
+    # with the separator appended, so a path is its folder and name concatenated
+    if folder.startswith(KEPT_FOLDER_PREFIX):
+        return os.path.join(folder[len(KEPT_FOLDER_PREFIX):], "")
+    return os.path.join(os.path.normpath(os.path.join(phase_folder, folder)), "")
+
+
+def little_endian(data):
+    if sys.byteorder == "little" or not isinstance(data, array):
+        return data
+    swapped = array(data.typecode, data)
+    swapped.byteswap()
+    return swapped
+
+
+def write_binary_phase(path, callouts):
+    phase_folder = os.path.dirname(os.path.abspath(path))
+    strings = {"": 0}
+    folders = {}
+    timestamps = array('d')
+    active = bytearray()
+    sections = {section: array('I') for section in STRING_SECTIONS}
+    (descriptions, notes, screen_folders, screen_names, cast_folders, cast_names) = sections.values()
+
+    def add_path(path, folder_section, name_section):
+        (folder, name) = os.path.split(path)
+        folder_index = folders.get(folder)
+        if folder_index is None:
+            folder_index = strings.setdefault(relative_folder(folder, phase_folder), len(strings))
+            folders[folder] = folder_index
+        folder_section.append(folder_index)
+        name_section.append(strings.setdefault(name, len(strings)))
+
+    for callout in callouts:
+        timestamps.append(callout.timestamp)
+        active.append(1 if callout.active else 0)
+        descriptions.append(strings.setdefault(callout.description, len(strings)))
+        notes.append(strings.setdefault(callout.notes, len(strings)))
+        add_path(callout.screen_image_path, screen_folders, screen_names)
+        add_path(callout.cast_image_path, cast_folders, cast_names)
+
+    encoded = [string.encode("utf-8") for string in strings]
+    string_offsets = array('Q', [0])
+    for data in encoded:
+        string_offsets.append(string_offsets[-1] + len(data))
+
+    row_count = len(timestamps)
+    layout = section_layout(row_count, len(encoded))
+    sections = {"timestamps": timestamps, **sections, "active": active, "string_offsets": string_offsets}
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, row_count, len(encoded), string_offsets[-1]))
+        for (name, data) in sections.items():
+            f.write(b"\0" * (layout[name] - f.tell()))
+            f.write(little_endian(data))
+        f.write(b"\0" * (layout["string_data"] - f.tell()))
+        f.write(b"".join(encoded))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class BinaryPhase:
+    # A mapped binary phase. Columns are memoryviews into the file, strings are only decoded when a
+    # string column is asked for.
+    def __init__(self, path):
+        self.folder = os.path.dirname(os.path.abspath(path))
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.row_count, self.string_count, data_size) = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a binary phase")
+        if version not in READABLE_VERSIONS:
+            raise ValueError(f"{path} has unsupported phase version {version}")
+
+        layout = section_layout(self.row_count, self.string_count)
+        if layout["string_data"] + data_size > len(self.map):
+            raise ValueError(f"{path} is truncated")
+
+        view = self.view = memoryview(self.map)
+        self.timestamps = self.section(view, layout["timestamps"], 8 * self.row_count, 'd')
+        self.string_ids = {section: self.section(view, layout[section], 4 * self.row_count, 'I')
+                           for section in STRING_SECTIONS}
+        self.active = self.section(view, layout["active"], self.row_count, 'B')
+        self.string_offsets = self.section(view, layout["string_offsets"], 8 * (self.string_count + 1), 'Q')
+        self.string_data = view[layout["string_data"]:layout["string_data"] + data_size]
+
+    def __len__(self):
+        return self.row_count
+
+    @staticmethod
+    def section(view, offset, size, typecode):
+        section = view[offset:offset + size].cast(typecode)
+        if sys.byteorder == "little" or typecode == 'B':
+            return section
+        # a swapped copy, the map can only be read in place on a little-endian machine
+        swapped = array(typecode, section)
+        section.release()
+        swapped.byteswap()
+        return swapped
+
+    def strings(self):
+        data = self.string_data.tobytes()
+        offsets = self.string_offsets.tolist()
+        return [data[start:end].decode("utf-8") for (start, end) in zip(offsets, offsets[1:])]
+
+    def column(self, name, strings=None):
+        # one column as a list, screenshot paths made absolute again
+        strings = strings or self.strings()
+        if name not in PATH_COLUMNS:
+            return list(map(strings.__getitem__, self.string_ids[name].tolist()))
+
+        prefix = name[:-len("path")]
+        folder_ids = self.string_ids[prefix + "folder"].tolist()
+        folders = {index: absolute_folder(strings[index], self.folder) for index in set(folder_ids)}
+        names = map(strings.__getitem__, self.string_ids[prefix + "name"].tolist())
+        # an empty path has neither a folder nor a name and stays empty
+        folders[0] = ""
+        return list(map(operator.add, map(folders.__getitem__, folder_ids), names))
+
+    def callouts(self):
+        strings = self.strings()
+        return map(
+            Callout,
+            self.timestamps.tolist(),
+            self.column("description", strings),
+            map(bool, self.active.tolist()),
+            self.column("notes", strings),
+            self.column("screen_image_path", strings),
+            self.column("cast_image_path", strings))
+
+    def close(self):
+        # every view into the map has to be released before it can be closed
+        for view in (self.timestamps, self.active, self.string_offsets, self.string_data,
+                     *self.string_ids.values(), self.view):
+            if isinstance(view, memoryview):
+                view.release()
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def iter_phase(path):
+    # callouts of a phase file in either format, in file order
+    if is_binary_phase(path):
+        with BinaryPhase(path) as phase:
+            yield from phase.callouts()
+    else:
+        with open(path, 'r') as f:
+            yield from map(callout_from_dict, json.load(f))
+
+
+def read_phase(path):
+    return list(iter_phase(path))
+
+
+def is_binary_path(path):
+    return os.path.splitext(path)[1] == BINARY_EXTENSION
+
+
+def write_phase(path, callouts, binary=None):
+    # binary defaults to following the extension, anything but .phase is written as JSON
+    if binary is None:
+        binary = is_binary_path(path)
+    if binary:
+        write_binary_phase(path, callouts)
+        return
+
+    with open(path, 'w') as f:
+        json.dump([callout_to_dict(callout) for callout in callouts], f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def convert_phase(source, destination):
+    write_phase(destination, read_phase(source))
+
+
+if __name__ == '__main__':
+    import sys
+    convert_phase(sys.argv[1], sys.argv[2])
@@ -0,0 +1,439 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from Models.callout import callout_from_dict, callout_to_dict
+from Storage.phase_file import is_binary_path, iter_phase, write_phase
+
+JOURNAL_EXTENSION = ".journal"
+# a journal's own copy of the timeline it applies on top of, next to it
+SNAPSHOT_EXTENSION = ".base"
+
+# fold the journal into its snapshot and truncate it once this many records have piled up
+DEFAULT_COMPACT_AFTER = 1000
+
+# A journal is one JSON record per line. The first line names what it applies on top of: its
+# snapshot, another phase file or nothing, with that file's digest, and the phase file it saves to.
+# Every later line is a single change:
+#   {"op": "insert", "row": 3, "callout": {...}}
+#   {"op": "edit", "row": 3, "field": "notes", "value": "..."}
+#   {"op": "remove", "first": 2, "last": 5}
+#   {"op": "move", "row": 3, "to": 7}
+#   {"op": "clear"}
+#   {"op": "save"}
+#   {"op": "published"}
+#   {"op": "saved_as", "path": "..."}
+# Changes after the last "save" record are an unsaved session that recover() brings back. Saving only
+# appends the "save" record; the phase file is then written from the journal in the background, and
+# "published" follows once it is. "saved_as" ends a session that continues under another phase. Only
+# publishing ever replaces the phase file: compaction writes the snapshot, and carries whether there
+# were unsaved changes over in the base record's "unsaved" flag. Rows are in timestamp order, so the
+# base is sorted on load the same way the timeline model sorts it.
+
+
+def file_digest(path):
+    if path is None or not os.path.exists(path):
+        return None
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def snapshot_path(journal_path):
+    return journal_path + SNAPSHOT_EXTENSION
+
+
+def base_record(base_path, digest, phase_path, snapshot=False, unsaved=False):
+    # a snapshot base is named after the journal rather than written in, so it follows a renamed journal
+    return {"op": "base", "path": None if snapshot else base_path, "snapshot": snapshot, "digest": digest,
+            "phase": phase_path, "unsaved": unsaved}
+
+
+def journal_base_file(header, journal_path):
+    # the file a journal applies on top of, None for an empty timeline
+    return snapshot_path(journal_path) if header.get("snapshot") else header["path"]
+
+
+def read_journal(path):
+    with open(path, 'r') as f:
+        lines = f.read().split("\n")
+
+    records = []
+    for line in lines:
+        if not line:
+            continue
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            # a torn final line from a crash mid-write
+            break
+
+    if not records or records[0].get("op") != "base":
+        raise ValueError(f"{path} is not a phase journal")
+    return (records[0], records[1:])
+
+
+def apply_record(callouts, record):
+    op = record["op"]
+    if op == "insert":
+        callouts.insert(record["row"], callout_from_dict(record["callout"]))
+    elif op == "edit":
+        setattr(callouts[record["row"]], record["field"], record["value"])
+    elif op == "remove":
+        del callouts[record["first"]:record["last"] + 1]
+    elif op == "move":
+        callouts.insert(record["to"], callouts.pop(record["row"]))
+    elif op == "clear":
+        callouts.clear()
+
+
+def read_sorted_phase(path):
+    # stable, like TimelineStore.sort
+    return sorted(iter_phase(path), key=lambda callout: callout.timestamp)
+
+
+def load_base(header, journal_path):
+    base_file = journal_base_file(header, journal_path)
+    if base_file is None:
+        return []
+
+    if file_digest(base_file) != header["digest"]:
+        # a compaction got as far as switching the journal but not the snapshot: finish it
+        pending_path = base_file + ".tmp"
+        if file_digest(pending_path) != header["digest"]:
+            raise ValueError(f"{base_file} does not match its journal")
+        os.replace(pending_path, base_file)
+
+    return read_sorted_phase(base_file)
+
+
+def next_state(state, op):
+    # (changes after the last save, last save not in the phase file yet) after a record
+    (unsaved, unpublished) = state
+    if op == "save":
+        return (False, True)
+    if op == "published":
+        return (unsaved, False)
+    if op == "saved_as":
+        return (False, False)
+    return (True, unpublished)
+
+
+def journal_state(header, records):
+    state = (header.get("unsaved", False), False)
+    for record in records:
+        state = next_state(state, record["op"])
+    return state
+
+
+def has_unsaved_records(path):
+    # whether a journal holds changes the phase file does not have; one that cannot be read is assumed to
+    try:
+        (header, records) = read_journal(path)
+    except ValueError:
+        return True
+    return any(journal_state(header, records))
+
+
+def journal_applies(journal_path, path):
+    # whether a journal holds the state of this phase file: it saves to it or started from it
+    if not os.path.exists(journal_path) or not os.path.exists(path):
+        return False
+    try:
+        (header, _) = read_journal(journal_path)
+        return any(candidate is not None and os.path.exists(candidate) and os.path.samefile(candidate, path)
+                   for candidate in (header.get("phase"), header["path"]))
+    except (ValueError, OSError, KeyError):
+        return False
+
+
+def rotate_journal(path):
+    # moves a journal and its snapshot aside under a free name that still ends in JOURNAL_EXTENSION, so
+    # it is still found and recovered, and points it at a phase file of the same name
+    (stem, extension) = os.path.splitext(path)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    rotated_path = f"{stem}.{stamp}{extension}"
+    count = 1
+    while os.path.exists(rotated_path):
+        rotated_path = f"{stem}.{stamp}-{count}{extension}"
+        count += 1
+
+    with open(path, 'r') as f:
+        lines = f.readlines()
+    try:
+        header = json.loads(lines[0])
+        if header.get("phase") is not None:
+            header["phase"] = os.path.splitext(rotated_path)[0] + os.path.splitext(header["phase"])[1]
+            lines[0] = json.dumps(header) + "\n"
+    except (ValueError, IndexError, AttributeError):
+        pass
+    if os.path.exists(snapshot_path(path)):
+        os.replace(snapshot_path(path), snapshot_path(rotated_path))
+    with open(rotated_path, 'w') as f:
+        f.writelines(lines)
+        f.flush()
+        os.fsync(f.fileno())
+    os.remove(path)
+    return rotated_path
+
+
+def recover(path):
+    # returns (callouts, base file, whether there are changes after the last save)
+    (header, records) = read_journal(path)
+    callouts = load_base(header, path)
+    for record in records:
+        apply_record(callouts, record)
+    return (callouts, journal_base_file(header, path), journal_state(header, records)[0])
+
+
+def saved_callouts(path, header, records):
+    # the timeline as of the last save, None if there is none
+    saves = [i for (i, record) in enumerate(records) if record["op"] == "save"]
+    if not saves:
+        return None
+    callouts = load_base(header, path)
+    for record in records[:saves[-1]]:
+        apply_record(callouts, record)
+    return callouts
+
+
+def write_published(phase_path, callouts):
+    pending_path = phase_path + ".tmp"
+    write_phase(pending_path, callouts, binary=is_binary_path(phase_path))
+    os.replace(pending_path, phase_path)
+
+
+def publish_pending(path):
+    # finishes writing a phase file that a crash cut short; returns (phase path, callouts written), or
+    # None when the phase file was up to date
+    (header, records) = read_journal(path)
+    if header.get("phase") is None or not journal_state(header, records)[1]:
+        return None
+    callouts = saved_callouts(path, header, records)
+    if callouts is None:
+        return None
+    write_published(header["phase"], callouts)
+    with open(path, 'a') as f:
+        f.write(json.dumps({"op": "published"}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    return (header["phase"], callouts)
+
+
+def load_phase(path, journal_path=None):
+    # a phase file brought up to date with its journal, if there is one that applies to it
+    journal_path = journal_path or os.path.splitext(path)[0] + JOURNAL_EXTENSION
+    if journal_applies(journal_path, path):
+        try:
+            return recover(journal_path)[0]
+        except (ValueError, OSError, KeyError):
+            pass
+
+    return read_sorted_phase(path)
+
+
+def link_or_copy(source, destination):
+    # a hard link costs nothing and still holds the old contents once the source is replaced
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class PhaseJournal:
+    # on_published(phase path, callouts) is called on the background thread after every phase file
+    # written from the journal
+    def __init__(self, path, phase_path, compact_after=DEFAULT_COMPACT_AFTER, on_published=None):
+        self.path = path
+        self.phase_path = phase_path
+        self.compact_after = compact_after
+        self.on_published = on_published
+        self.lock = threading.Lock()
+        self.file = None
+        self.record_count = 0
+        self.state = (False, False)
+        self.save_count = 0
+        self.tail = None
+        self.worker = None
+
+    @classmethod
+    def create(cls, path, phase_path, base_path=None, compact_after=DEFAULT_COMPACT_AFTER, on_published=None):
+        # never truncates unsaved changes: a save a crash kept from the phase file is finished, and a
+        # journal holding changes after it is moved aside first
+        if os.path.exists(path):
+            try:
+                publish_pending(path)
+            except (ValueError, OSError, KeyError) as e:
+                print(f"could not finish saving from {path}: {e}")
+            if has_unsaved_records(path):
+                print(f"kept unsaved changes from {path} in {rotate_journal(path)}")
+        if os.path.exists(snapshot_path(path)):
+            os.remove(snapshot_path(path))
+
+        # the phase file itself is replaced on every save, so the journal keeps its own link to it
+        snapshot = base_path is not None and os.path.exists(phase_path) and os.path.samefile(base_path, phase_path)
+        if snapshot:
+            link_or_copy(base_path, snapshot_path(path))
+        digest = file_digest(snapshot_path(path) if snapshot else base_path)
+
+        journal = cls(path, phase_path, compact_after, on_published)
+        with open(path, 'w') as f:
+            f.write(json.dumps(base_record(base_path, digest, phase_path, snapshot)) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        journal.file = open(path, 'a')
+        return journal
+
+    @classmethod
+    def resume(cls, path, phase_path, compact_after=DEFAULT_COMPACT_AFTER, on_published=None):
+        (header, records) = read_journal(path)
+        journal = cls(path, header.get("phase") or phase_path, compact_after, on_published)
+        journal.record_count = len(records)
+        journal.state = journal_state(header, records)
+        journal.file = open(path, 'a')
+        return journal
+
+    @property
+    def unsaved(self):
+        return self.state[0]
+
+    def busy(self):
+        return self.worker is not None and self.worker.is_alive()
+
+    def needs_compaction(self):
+        # a save still to be published needs its records, folding them would lose the saved state
+        return self.record_count >= self.compact_after and not self.busy() and not self.state[1]
+
+    def write_record(self, record):
+        # with the lock held
+        line = json.dumps(record) + "\n"
+        self.file.write(line)
+        self.file.flush()
+        self.record_count += 1
+        self.state = next_state(self.state, record["op"])
+        if record["op"] == "save":
+            self.save_count += 1
+        if self.tail is not None:
+            self.tail.append(line)
+
+    def append(self, record):
+        with self.lock:
+            self.write_record(record)
+
+    def record_insert(self, row, callout):
+        self.append({"op": "insert", "row": row, "callout": callout_to_dict(callout)})
+
+    def record_edit(self, row, field, value):
+        self.append({"op": "edit", "row": row, "field": field, "value": value})
+
+    def record_remove(self, first, last):
+        self.append({"op": "remove", "first": first, "last": last})
+
+    def record_move(self, row, to_row):
+        self.append({"op": "move", "row": row, "to": to_row})
+
+    def record_clear(self):
+        self.append({"op": "clear"})
+
+    def record_saved_as(self, path):
+        # the session goes on in another phase, this one's file is left as it is
+        self.append({"op": "saved_as", "path": path})
+
+    def mark_saved(self):
+        self.append({"op": "save"})
+        with self.lock:
+            os.fsync(self.file.fileno())
+
+    def save(self):
+        # costs one record: once it is on disk the saved timeline can always be rebuilt from the
+        # journal, and the phase file is written from it in the background
+        self.mark_saved()
+        self.run_in_background(self.publish)
+
+    def run_in_background(self, target, *args):
+        # one job at a time, in the order they were asked for
+        previous = self.worker
+
+        def run():
+            if previous is not None:
+                previous.join()
+            target(*args)
+
+        self.worker = threading.Thread(target=run, daemon=True)
+        self.worker.start()
+
+    def publish(self):
+        with self.lock:
+            if self.file is None:
+                return
+            (header, records) = read_journal(self.path)
+            save_count = self.save_count
+        try:
+            callouts = saved_callouts(self.path, header, records)
+            if callouts is None:
+                return
+            write_published(self.phase_path, callouts)
+        except (ValueError, OSError) as e:
+            print(f"saving {self.phase_path} failed: {e}")
+            return
+        if self.on_published is not None:
+            self.on_published(self.phase_path, callouts)
+        with self.lock:
+            # a later save is left for the job publishing it
+            if self.file is not None and self.save_count == save_count:
+                self.write_record({"op": "published"})
+
+    def compact(self, callouts):
+        # callouts is a snapshot taken on the caller's thread. The journal's snapshot file is rewritten
+        # in the background, records appended meanwhile are kept and become the new journal.
+        if self.busy():
+            return
+
+        with self.lock:
+            self.tail = []
+            unsaved = self.unsaved
+        self.run_in_background(self.write_compaction, callouts, unsaved)
+
+    def write_compaction(self, callouts, unsaved):
+        base_file = snapshot_path(self.path)
+        pending_path = base_file + ".tmp"
+        try:
+            write_phase(pending_path, callouts, binary=True)
+            digest = file_digest(pending_path)
+
+            with self.lock:
+                # switch the journal first: a crash before the snapshot is replaced leaves a journal
+                # whose digest matches the .tmp file, and load_base finishes the rename
+                journal_tmp = self.path + ".tmp"
+                with open(journal_tmp, 'w') as f:
+                    f.write(json.dumps(base_record(None, digest, self.phase_path, True, unsaved)) + "\n")
+                    f.writelines(self.tail)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.file.close()
+                os.replace(journal_tmp, self.path)
+                os.replace(pending_path, base_file)
+                self.file = open(self.path, 'a')
+                self.record_count = len(self.tail)
+        except OSError as e:
+            print(f"compacting {self.path} failed: {e}")
+        finally:
+            with self.lock:
+                self.tail = None
+
+    def close(self):
+        worker = self.worker
+        if worker is not None:
+            worker.join()
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
@@ -0,0 +1,75 @@
+import itertools
+import json
+
+from Models.callout import callout_from_dict
+from Storage.phase_file import is_binary_phase, iter_phase
+
+READ_SIZE = 1 << 20
+
+# the first chunk is about a screen of rows so the table fills in straight away, later chunks are
+# bigger so a large file costs few model updates
+FIRST_CHUNK_SIZE = 100
+CHUNK_SIZE = 5000
+
+WHITESPACE = " \t\r\n"
+SEPARATORS = WHITESPACE + ","
+
+
+def skip(buffer, position, characters):
+    while position < len(buffer) and buffer[position] in characters:
+        position += 1
+    return position
+
+
+def iter_json_array(f, read_size=READ_SIZE):
+    # the elements of a top-level JSON array, one at a time, without reading the whole file first
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+    started = False
+
+    while True:
+        position = skip(buffer, position, SEPARATORS if started else WHITESPACE)
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != "[":
+                    raise ValueError("phase file is not a JSON array")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                return
+            try:
+                (value, position) = decoder.raw_decode(buffer, position)
+                yield value
+                continue
+            except json.JSONDecodeError:
+                # an element cut off by the end of the buffer
+                if eof:
+                    raise
+
+        if eof:
+            raise ValueError("unexpected end of phase file")
+        data = f.read(read_size)
+        eof = not data
+        buffer = buffer[position:] + data
+        position = 0
+
+
+def iter_chunks(items, first_size=FIRST_CHUNK_SIZE, size=CHUNK_SIZE):
+    items = iter(items)
+    chunk = list(itertools.islice(items, first_size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(items, size))
+
+
+def iter_phase_chunks(path, first_size=FIRST_CHUNK_SIZE, size=CHUNK_SIZE):
+    if is_binary_phase(path):
+        # already columnar, the rows are built straight from the mapped file
+        yield from iter_chunks(iter_phase(path), first_size, size)
+        return
+
+    with open(path, 'r') as f:
+        yield from iter_chunks(map(callout_from_dict, iter_json_array(f)), first_size, size)
@@ -0,0 +1,244 @@
+import bisect
+import hashlib
+import json
+import os
+import time
+
+import util
+from Storage.phase_file import BINARY_EXTENSION, JSON_EXTENSION, BinaryPhase, is_binary_phase, iter_phase
+from Storage.phase_journal import JOURNAL_EXTENSION, journal_base_file, read_journal
+
+# The reference index keeps, for every phase and journal, the screenshots it points at, along with the
+# size and mtime of the file when they were read. It is one small file per source in
+# REFERENCES_FOLDER, so saving a phase rewrites only its own entry, and finding unreferenced
+# screenshots only reads the sources that changed since their entry was written.
+REFERENCES_FOLDER = os.path.join(util.BASE_PATH, "references")
+REFERENCE_EXTENSION = ".refs"
+# where a collection stopped by its limit left off in each screenshot folder
+GC_CURSOR_NAME = "gc.cursor"
+SOURCE_EXTENSIONS = (BINARY_EXTENSION, JSON_EXTENSION, JOURNAL_EXTENSION)
+IMAGE_EXTENSIONS = (".png", ".webp", ".ppm", ".jpg", ".jpeg", ".bmp")
+PATH_FIELDS = ("screen_image_path", "cast_image_path")
+
+# screenshots younger than this are never collected: they may belong to a capture still on its way
+# into the timeline
+DEFAULT_MIN_AGE_S = 3600
+
+
+def normalize(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def callout_screenshots(callouts):
+    screenshots = set()
+    for callout in callouts:
+        for path in (callout.screen_image_path, callout.cast_image_path):
+            if path:
+                screenshots.add(normalize(path))
+    return screenshots
+
+
+def phase_screenshots(path):
+    if is_binary_phase(path):
+        # only the path columns, the rest of the file is never decoded
+        with BinaryPhase(path) as phase:
+            strings = phase.strings()
+            return {normalize(screenshot) for column in PATH_FIELDS
+                    for screenshot in phase.column(column, strings) if screenshot}
+    return callout_screenshots(iter_phase(path))
+
+
+def journal_screenshots(path):
+    # every screenshot a journal ever inserted, including rows removed again since its last compaction
+    (_, records) = read_journal(path)
+    screenshots = set()
+    for record in records:
+        if record["op"] == "insert":
+            fields = record["callout"]
+        elif record["op"] == "edit" and record["field"] in PATH_FIELDS:
+            fields = {record["field"]: record["value"]}
+        else:
+            continue
+        for field in PATH_FIELDS:
+            if fields.get(field):
+                screenshots.add(normalize(fields[field]))
+    return screenshots
+
+
+def source_screenshots(path):
+    if os.path.splitext(path)[1] == JOURNAL_EXTENSION:
+        return journal_screenshots(path)
+    return phase_screenshots(path)
+
+
+def journal_base_path(path):
+    try:
+        return journal_base_file(read_journal(path)[0], path)
+    except (ValueError, OSError, KeyError):
+        return None
+
+
+class ReferenceIndex:
+    def __init__(self, folder=REFERENCES_FOLDER):
+        self.folder = folder
+
+    def entry_path(self, source_path):
+        name = hashlib.blake2b(normalize(source_path).encode("utf-8"), digest_size=16).hexdigest()
+        return os.path.join(self.folder, f"{name}{REFERENCE_EXTENSION}")
+
+    def load(self, source_path):
+        try:
+            with open(self.entry_path(source_path), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("path") != normalize(source_path):
+            return None
+        return entry
+
+    def store(self, source_path, screenshots, signature=None):
+        os.makedirs(self.folder, exist_ok=True)
+        entry = {
+            "path": normalize(source_path),
+            "signature": signature or file_signature(source_path),
+            "screenshots": sorted(screenshots),
+        }
+        path = self.entry_path(source_path)
+        with open(path + ".tmp", 'w') as f:
+            json.dump(entry, f)
+        os.replace(path + ".tmp", path)
+
+    def references(self, source_path):
+        # returns (screenshots, whether the source had to be read)
+        signature = file_signature(source_path)
+        entry = self.load(source_path)
+        if entry is not None and entry["signature"] == signature:
+            return (set(entry["screenshots"]), False)
+
+        screenshots = source_screenshots(source_path)
+        self.store(source_path, screenshots, signature)
+        return (screenshots, True)
+
+    def load_cursors(self):
+        try:
+            with open(os.path.join(self.folder, GC_CURSOR_NAME), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def store_cursors(self, cursors):
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, GC_CURSOR_NAME)
+        with open(path + ".tmp", 'w') as f:
+            json.dump(cursors, f)
+        os.replace(path + ".tmp", path)
+
+    def prune(self, source_paths):
+        # entries of sources that no longer exist
+        live = {os.path.basename(self.entry_path(path)) for path in source_paths}
+        removed = 0
+        if not os.path.isdir(self.folder):
+            return removed
+        for name in os.listdir(self.folder):
+            if name.endswith(REFERENCE_EXTENSION) and name not in live:
+                os.remove(os.path.join(self.folder, name))
+                removed += 1
+        return removed
+
+
+def update_references(phase_path, callouts, index=None):
+    # called once a phase has been written, with the callouts written to it
+    try:
+        (index or ReferenceIndex()).store(phase_path, callout_screenshots(callouts))
+    except OSError as e:
+        print(f"updating screenshot references of {phase_path} failed: {e}")
+
+
+def reference_sources(folder, skipped_folders):
+    # phases and journals anywhere under folder, without walking into the screenshot folders
+    skipped = {normalize(path) for path in skipped_folders}
+    sources = []
+    for (current, folders, files) in os.walk(folder):
+        folders[:] = [name for name in folders if normalize(os.path.join(current, name)) not in skipped]
+        sources.extend(os.path.join(current, name) for name in files
+                       if os.path.splitext(name)[1] in SOURCE_EXTENSIONS)
+    # a journal's base phase counts even when it lives somewhere else
+    for journal_path in [path for path in sources if path.endswith(JOURNAL_EXTENSION)]:
+        base_path = journal_base_path(journal_path)
+        if base_path is not None and os.path.exists(base_path):
+            sources.append(base_path)
+    return sorted(set(map(normalize, sources)))
+
+
+def collect_references(sources, index):
+    # returns (every referenced screenshot, sources that were read, sources that could not be read)
+    screenshots = set()
+    read = 0
+    unreadable = []
+    for source_path in sources:
+        try:
+            (references, was_read) = index.references(source_path)
+        except (ValueError, OSError, KeyError, TypeError) as e:
+            unreadable.append((source_path, e))
+            continue
+        screenshots |= references
+        read += was_read
+    return (screenshots, read, unreadable)
+
+
+def image_names(folder):
+    # sorted, from the directory listing alone; nothing is stat'ed
+    with os.scandir(folder) as entries:
+        return sorted(entry.name for entry in entries
+                      if os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS)
+
+
+def unreferenced_screenshots(folders, references, min_age_s=DEFAULT_MIN_AGE_S, limit=None, cursors=None):
+    # returns ([(path, size)], images looked at, their total size). Names are gone through in sorted
+    # order starting after the folder's entry in cursors, wrapping around to the start, and only the
+    # names looked at are stat'ed. A run stopped by limit records its last name in cursors, so the
+    # next run carries on from there; one that gets all the way round drops the folder's entry.
+    now = time.time()
+    garbage = []
+    (scanned, scanned_bytes) = (0, 0)
+    cursors = {} if cursors is None else cursors
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        if limit is not None and len(garbage) >= limit:
+            break
+        prefix = normalize(folder)
+        names = image_names(folder)
+        start = bisect.bisect_right(names, cursors.pop(prefix, ""))
+        for name in names[start:] + names[:start]:
+            path = os.path.join(folder, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if not os.path.isfile(path):
+                continue
+            scanned += 1
+            scanned_bytes += stat.st_size
+            if os.path.join(prefix, os.path.normcase(name)) not in references and now - stat.st_mtime >= min_age_s:
+                garbage.append((path, stat.st_size))
+            if limit is not None and len(garbage) >= limit:
+                cursors[prefix] = name
+                break
+    return (garbage, scanned, scanned_bytes)
+
+
+def remove_screenshots(garbage):
+    removed = 0
+    for (path, _) in garbage:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
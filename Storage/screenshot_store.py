@@ -0,0 +1,124 @@
+import hashlib
+import os
+import struct
+import threading
+
+from Capture.image_encoder import FORMAT_PNG, FORMAT_RAW, FORMAT_WEBP
+
+INDEX_FILE_NAME = "index.bin"
+
+# content digest, perceptual hash, width, height, extension code, flags
+INDEX_RECORD = struct.Struct("<16sQHHBB2x")
+EXTENSIONS = (FORMAT_PNG, FORMAT_WEBP, FORMAT_RAW)
+FLAG_HAS_PHASH = 1
+
+PHASH_SIZE = 8
+
+
+def content_digest(image):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.mode}:{image.width}x{image.height}:".encode())
+    digest.update(image.tobytes())
+    return digest.digest()
+
+
+def perceptual_hash(image):
+    # 64-bit difference hash: sign of the horizontal gradient over a 9x8 greyscale thumbnail
+    import numpy as np
+    from PIL import Image
+
+    pixels = np.asarray(image.convert("L").resize((PHASH_SIZE + 1, PHASH_SIZE), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def hamming_distances(hashes, phash):
+    import numpy as np
+
+    diff = np.bitwise_xor(hashes, np.uint64(phash))
+    return np.unpackbits(diff.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class ScreenshotStore:
+    # Content-addressed screenshot blobs. Identical frames resolve to one file, and with
+    # near_duplicate_distance set, frames whose perceptual hashes differ by at most that many bits
+    # reuse an existing blob of the same size. index.bin holds one fixed-size record per blob.
+    def __init__(self, folder, encoder, near_duplicate_distance=None):
+        self.folder = folder
+        self.encoder = encoder
+        self.near_duplicate_distance = near_duplicate_distance
+        self.index_path = os.path.join(folder, INDEX_FILE_NAME)
+        self.lock = threading.Lock()
+
+        self.blobs = {}
+        self.phashes = {}
+        self.phash_arrays = {}
+        self.load_index()
+
+    def load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+
+        with open(self.index_path, 'rb') as f:
+            data = f.read()
+
+        # ignore a trailing partial record left by a crash mid-append
+        end = len(data) - len(data) % INDEX_RECORD.size
+        for (digest, phash, width, height, extension, flags) in INDEX_RECORD.iter_unpack(data[:end]):
+            self.add_entry(digest, phash if flags & FLAG_HAS_PHASH else None, (width, height),
+                           EXTENSIONS[extension])
+
+    def add_entry(self, digest, phash, size, extension):
+        name = f"{digest.hex()}.{extension}"
+        self.blobs[digest] = name
+        if phash is not None:
+            (hashes, names) = self.phashes.setdefault(size, ([], []))
+            hashes.append(phash)
+            names.append(name)
+            self.phash_arrays.pop(size, None)
+        return name
+
+    def blob_path(self, name):
+        return os.path.join(self.folder, name)
+
+    def find_near_duplicate(self, size, phash):
+        import numpy as np
+
+        if size not in self.phashes:
+            return None
+
+        hashes = self.phash_arrays.get(size)
+        if hashes is None:
+            hashes = np.array(self.phashes[size][0], dtype=np.uint64)
+            self.phash_arrays[size] = hashes
+
+        distances = hamming_distances(hashes, phash)
+        best = int(distances.argmin())
+        if distances[best] <= self.near_duplicate_distance:
+            return self.phashes[size][1][best]
+        return None
+
+    def save(self, image, path=None):
+        digest = content_digest(image)
+        phash = perceptual_hash(image) if self.near_duplicate_distance is not None else None
+        size = (image.width, image.height)
+
+        with self.lock:
+            name = self.blobs.get(digest)
+            if name is None and phash is not None:
+                name = self.find_near_duplicate(size, phash)
+            if name is not None:
+                path = self.blob_path(name)
+                if os.path.exists(path) or self.encoder.pending_image(path) is not None:
+                    return path
+
+            if name is None:
+                extension = self.encoder.extension()
+                name = self.add_entry(digest, phash, size, extension)
+                with open(self.index_path, 'ab') as f:
+                    f.write(INDEX_RECORD.pack(
+                        digest, phash or 0, image.width, image.height, EXTENSIONS.index(extension),
+                        FLAG_HAS_PHASH if phash is not None else 0))
+
+            # new blob, or an indexed one whose file never made it to disk (e.g. a crash mid-encode)
+            return self.encoder.submit(image, self.blob_path(name), os.path.splitext(name)[1][1:])
@@ -1,97 +1,361 @@
-import dataclasses
+import glob
 import os
-import json
 
 from PySide6 import QtWidgets
 from PySide6 import QtGui
 
 import util
+from Diagnostics import tracing
 from Models.callout import Callout
+from Storage import phase_export
+from Storage.phase_file import BINARY_EXTENSION, JSON_EXTENSION, write_phase
+from Storage.phase_journal import JOURNAL_EXTENSION, PhaseJournal, journal_applies, publish_pending, recover
+from Storage.phase_stream import iter_chunks, iter_phase_chunks
+from Storage.screenshot_refs import update_references
+from UI.phase_loader import PhaseLoader
+
+# phases are saved in the binary format, JSON phases still open and convert with Storage.phase_file
+PHASE_EXTENSION = BINARY_EXTENSION
+
 
 class ControlsWidget(QtWidgets.QWidget):
     def __init__(self, parent):
         super(ControlsWidget, self).__init__()
         self.parent = parent
+        self.journal: PhaseJournal = None
+        self.journal_phase_path = None
+        self.phase_loader: PhaseLoader = None
+        self.inserting_chunk = False
+        self.changed_while_loading = False
 
         grid_layout = QtWidgets.QGridLayout(self)
 
         self.set_export_button = QtWidgets.QPushButton("Export (clipboard)")
+        self.export_file_button = QtWidgets.QPushButton("Export (file)")
         self.set_capture_region_button = QtWidgets.QPushButton("Set Capture Region")
         self.set_cast_bar_region_button = QtWidgets.QPushButton("Set Cast Bar Region")
         self.set_save_folder_button = QtWidgets.QPushButton("Set Save Folder")
+        self.preroll_checkbox = QtWidgets.QCheckBox("Pre-roll Capture")
+        self.cast_detection_checkbox = QtWidgets.QCheckBox("Detect Casts")
 
         self.phase_name = QtWidgets.QLineEdit("untitled")
         self.new_phase_button = QtWidgets.QPushButton("New Phase")
         self.save_phase_button = QtWidgets.QPushButton("Save Phase")
         self.open_phase_button = QtWidgets.QPushButton("Open Phase")
+        self.merge_pulls_button = QtWidgets.QPushButton("Merge Pulls")
+        self.tracing_checkbox = QtWidgets.QCheckBox("Trace")
+        self.tracing_checkbox.setChecked(tracing.enabled)
+        self.stats_button = QtWidgets.QPushButton("Stats")
+        self.stats_panel = None
 
         grid_layout.addWidget(self.set_export_button, 0, 0, 1, 1)
         grid_layout.addWidget(self.set_capture_region_button, 1, 0, 1, 1)
         grid_layout.addWidget(self.set_cast_bar_region_button, 2, 0, 1, 1)
         grid_layout.addWidget(self.set_save_folder_button, 3, 0, 1, 1)
+        grid_layout.addWidget(self.preroll_checkbox, 4, 0, 1, 1)
+        grid_layout.addWidget(self.cast_detection_checkbox, 4, 1, 1, 1)
         grid_layout.addWidget(self.phase_name, 0, 1, 1, 1)
         grid_layout.addWidget(self.new_phase_button, 1, 1, 1, 1)
         grid_layout.addWidget(self.save_phase_button, 2, 1, 1, 1)
         grid_layout.addWidget(self.open_phase_button, 3, 1, 1, 1)
+        grid_layout.addWidget(self.export_file_button, 5, 0, 1, 1)
+        grid_layout.addWidget(self.merge_pulls_button, 5, 1, 1, 1)
+        grid_layout.addWidget(self.tracing_checkbox, 6, 0, 1, 1)
+        grid_layout.addWidget(self.stats_button, 6, 1, 1, 1)
 
         self.setLayout(grid_layout)
 
         self.set_export_button.clicked.connect(self.export)
+        self.export_file_button.clicked.connect(self.export_file)
         self.set_capture_region_button.clicked.connect(self.parent.select_capture_region)
         self.set_cast_bar_region_button.clicked.connect(self.parent.select_cast_bar_region)
+        self.preroll_checkbox.toggled.connect(self.parent.set_preroll_enabled)
+        self.cast_detection_checkbox.toggled.connect(self.parent.set_cast_detection_enabled)
         #self.play_phase_button.clicked.connect(self.parent.playback_phase)
 
         grid_layout.addWidget(self.new_phase_button, 1, 1, 1, 1)
         self.new_phase_button.clicked.connect(self.new_phase)
         self.save_phase_button.clicked.connect(self.save_phase)
         self.open_phase_button.clicked.connect(self.open_phase)
+        self.merge_pulls_button.clicked.connect(self.merge_pulls)
+        self.tracing_checkbox.toggled.connect(self.set_tracing_enabled)
+        self.stats_button.clicked.connect(self.show_stats)
+
+        # every change to the timeline is journaled as it happens
+        table_model = self.parent.table_model
+        table_model.rowsInserted.connect(self.on_rows_inserted)
+        table_model.rowsRemoved.connect(self.on_rows_removed)
+        table_model.rowsMoved.connect(self.on_rows_moved)
+        table_model.batch_inserted.connect(self.on_batch_inserted)
+        table_model.batch_removed.connect(self.on_batch_removed)
+        table_model.callout_edited.connect(self.on_callout_edited)
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self.shutdown_loading)
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self.close_journal)
 
     def export(self, event):
-        callouts_txt = ""
+        callouts_txt = phase_export.export_text(self.parent.table_model.callouts)
+        QtGui.QGuiApplication.clipboard().setText(callouts_txt, mode=QtGui.QClipboard.Mode.Clipboard)
 
-        for callout in self.parent.table_model.callouts:
-            if callout.active:
-                callouts_txt += f"{util.format_ms(callout.timestamp)}\t{callout.description}\n"
+    def export_file(self):
+        filters = [f"{name} (*{extension})" for (name, (extension, _)) in phase_export.EXPORT_FORMATS.items()]
+        (path, selected) = QtWidgets.QFileDialog.getSaveFileName(
+            self, 'Export', os.path.join(util.BASE_PATH, self.phase_name.text()), filter=";;".join(filters))
+        if not path:
+            return
 
-        QtGui.QGuiApplication.clipboard().setText(callouts_txt, mode=QtGui.QClipboard.Mode.Clipboard)
+        # the selected filter picks the format, the file gets its extension if it has none
+        export_format = selected.split(" ")[0] if selected else phase_export.format_for_path(path)
+        extension = phase_export.EXPORT_FORMATS[export_format][0]
+        if not os.path.splitext(path)[1]:
+            path += extension
+        try:
+            phase_export.export_file(path, self.parent.table_model.callouts, export_format)
+        except OSError as e:
+            print(f"exporting to {path} failed: {e}")
 
-    def new_phase(self):
-        self.phase_name.setText("new phase")
+    def set_tracing_enabled(self, enabled):
+        if enabled:
+            tracing.clear()
+            tracing.enable()
+            return
+        tracing.disable()
+        from UI.stats_panel import save_trace
+        save_trace()
+
+    def show_stats(self):
+        # the panel is only built the first time it is asked for
+        if self.stats_panel is None:
+            from UI.stats_panel import StatsPanel
+            self.stats_panel = StatsPanel(self)
+        self.stats_panel.show()
+        self.stats_panel.raise_()
+
+    def phase_path(self):
+        return os.path.join(util.BASE_PATH, f"{self.phase_name.text()}{PHASE_EXTENSION}")
+
+    def journal_path(self, phase_path):
+        return os.path.splitext(phase_path)[0] + JOURNAL_EXTENSION
+
+    def start_journal(self, phase_path, base_path=None):
+        self.close_journal()
+        self.journal = PhaseJournal.create(self.journal_path(phase_path), phase_path, base_path,
+                                           on_published=update_references)
+        self.journal_phase_path = phase_path
+
+    def resume_journal(self, phase_path, journal_path=None):
+        self.close_journal()
+        self.journal = PhaseJournal.resume(journal_path or self.journal_path(phase_path), phase_path,
+                                           on_published=update_references)
+        self.journal_phase_path = phase_path
+
+    def close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def snapshot(self):
+        return [Callout(*values) for values in self.parent.table_model.callouts.rows()]
+
+    def journaled(self):
+        if self.journal.needs_compaction():
+            self.journal.compact(self.snapshot())
+
+    def journaling(self):
+        # changes made while a phase streams in are not journaled one by one: the journal is resynced
+        # from the whole timeline once loading finishes
+        if self.phase_loader is not None and not self.inserting_chunk:
+            self.changed_while_loading = True
+        return self.journal is not None
+
+    def on_rows_inserted(self, parent, first, last):
+        if not self.journaling():
+            return
+        for row in range(first, last + 1):
+            self.journal.record_insert(row, self.parent.table_model.callouts[row])
+        self.journaled()
+
+    def on_rows_removed(self, parent, first, last):
+        if not self.journaling():
+            return
+        self.journal.record_remove(first, last)
+        self.journaled()
+
+    def on_rows_moved(self, parent, start, end, destination, row):
+        # the model only moves single rows; Qt's row counts the moved row as still in place
+        if not self.journaling():
+            return
+        self.journal.record_move(start, row - 1 if row > start else row)
+        self.journaled()
+
+    def on_batch_inserted(self, rows):
+        # replaying inserts in ascending final row order rebuilds the merged timeline
+        if not self.journaling():
+            return
+        for row in rows:
+            self.journal.record_insert(row, self.parent.table_model.callouts[row])
+        self.journaled()
+
+    def on_batch_removed(self, rows):
+        if not self.journaling():
+            return
+        for row in reversed(rows):
+            self.journal.record_remove(row, row)
+        self.journaled()
+
+    def on_callout_edited(self, row, field, value):
+        if not self.journaling():
+            return
+        self.journal.record_edit(row, field, value)
+        self.journaled()
+
+    def load_callouts(self, callouts, phase_name):
+        # the journal is detached while loading, loaded rows are its base rather than changes
+        self.cancel_loading()
+        self.close_journal()
         self.parent.timer_widget.reset()
         self.parent.table_model.clear_rows()
+        self.parent.table_model.insert_callouts(callouts)
+        self.phase_name.setText(phase_name)
+
+    def stream_callouts(self, chunks, phase_name, phase_path, base_path=None, resume=False, journal_path=None):
+        # chunks is run on the loader thread; its callouts are inserted as they arrive and the journal
+        # is attached once the whole phase is in. resume reopens journal_path rather than starting one.
+        self.load_callouts([], phase_name)
+        self.changed_while_loading = False
+        self.phase_loader = PhaseLoader(self, chunks)
+        self.phase_loader.chunk_loaded.connect(self.on_chunk_loaded)
+        self.phase_loader.loaded.connect(
+            lambda loader: self.on_phase_loaded(loader, phase_path, base_path, resume, journal_path))
+        self.phase_loader.failed.connect(self.on_phase_load_failed)
+        self.phase_loader.start()
+
+    def cancel_loading(self):
+        if self.phase_loader is not None:
+            self.phase_loader.cancel()
+            self.phase_loader = None
+
+    def on_chunk_loaded(self, loader, chunk):
+        if loader is not self.phase_loader:
+            return
+        self.inserting_chunk = True
+        try:
+            self.parent.table_model.insert_callouts(chunk)
+        finally:
+            self.inserting_chunk = False
+
+    def on_phase_loaded(self, loader, phase_path, base_path, resume, journal_path=None):
+        if loader is not self.phase_loader:
+            return
+        self.phase_loader = None
+
+        if resume:
+            self.resume_journal(phase_path, journal_path)
+        else:
+            self.start_journal(phase_path, base_path)
+
+        if self.changed_while_loading or (base_path is None and not resume):
+            # the journal describes the loaded phase, restate the timeline as it is now on top of it;
+            # a timeline with no file behind it is restated in full
+            self.journal.record_clear()
+            for (row, callout) in enumerate(self.parent.table_model.callouts):
+                self.journal.record_insert(row, callout)
+            self.journaled()
+
+    def on_phase_load_failed(self, loader, error):
+        if loader is not self.phase_loader:
+            return
+        self.phase_loader = None
+        print(f"loading {self.phase_name.text()} failed: {error}")
+        self.new_phase()
+
+    def shutdown_loading(self):
+        loader = self.phase_loader
+        self.cancel_loading()
+        if loader is not None:
+            loader.wait()
+
+    def recover_session(self):
+        # reopen the most recently journaled phase that has changes after its last save
+        journal_paths = glob.glob(os.path.join(util.BASE_PATH, f"*{JOURNAL_EXTENSION}"))
+        for journal_path in sorted(journal_paths, key=os.path.getmtime, reverse=True):
+            try:
+                # a save the last run did not get to write out is finished first
+                published = publish_pending(journal_path)
+                if published is not None:
+                    update_references(*published)
+                (callouts, _, unsaved) = recover(journal_path)
+            except (ValueError, OSError, KeyError) as e:
+                print(f"could not recover {journal_path}: {e}")
+                continue
+
+            if unsaved:
+                # saved under the journal's own name, never over a base phase opened from elsewhere
+                phase_path = os.path.splitext(journal_path)[0] + PHASE_EXTENSION
+                phase_name = os.path.splitext(os.path.basename(journal_path))[0]
+                self.stream_callouts(lambda: iter_chunks(callouts), phase_name, phase_path, resume=True,
+                                     journal_path=journal_path)
+                print(f"recovering unsaved phase from {journal_path}")
+                return
+
+        self.start_journal(self.phase_path())
+
+    def new_phase(self):
+        self.load_callouts([], "new phase")
+        self.start_journal(self.phase_path())
 
     def save_phase(self):
-        path = os.path.join(util.BASE_PATH, f"{self.phase_name.text()}.json")
-        with open(path, 'w') as f:
-            json.dump([dataclasses.asdict(callout) for callout in self.parent.table_model.callouts], f)
+        if self.phase_loader is not None:
+            print(f"{self.phase_name.text()} is still loading")
+            return
+
+        path = self.phase_path()
+        if self.journal is not None and path == self.journal_phase_path:
+            # only a save record here, the journal writes the phase file out in the background
+            self.journal.save()
+            return
+
+        # saving under a new name writes the phase in full once and journals on top of it; the old
+        # journal is ended without touching its phase file, so the session is not recovered from it again
+        if self.journal is not None:
+            self.journal.record_saved_as(path)
+        snapshot = self.snapshot()
+        write_phase(path, snapshot)
+        update_references(path, snapshot)
+        self.start_journal(path, path)
 
     def open_phase(self):
         file_dialog = QtWidgets.QFileDialog(self)
         file_dialog.setDirectory(str(util.BASE_PATH))
-        file_name = file_dialog.getOpenFileName(self, 'OpenFile')[0]
+        file_name = file_dialog.getOpenFileName(
+            self, 'OpenFile', filter=f"Phases (*{BINARY_EXTENSION} *{JSON_EXTENSION});;All files (*)")[0]
 
         if not file_name:
             return
 
-        callout_dicts = []
-        with open(file_name, 'r') as f:
-            callout_dicts = json.load(f)
+        phase_name = os.path.splitext(os.path.basename(file_name))[0]
+        phase_path = os.path.join(util.BASE_PATH, f"{phase_name}{PHASE_EXTENSION}")
+        journal_path = self.journal_path(phase_path)
 
-        callouts = [
-            Callout(
-                timestamp=c["timestamp"],
-                description=c["description"],
-                active=c["active"],
-                notes=c["notes"],
-                screen_image_path=c["screen_image_path"],
-                cast_image_path=c["cast_image_path"])
-            for c in callout_dicts]
+        # a journal saving to or started from this file holds changes made since, possibly never saved
+        if journal_applies(journal_path, file_name):
+            self.stream_callouts(lambda: iter_chunks(recover(journal_path)[0]), phase_name, phase_path,
+                                 resume=True, journal_path=journal_path)
+            return
 
-        self.parent.timer_widget.reset()
-        self.parent.table_model.clear_rows()
-        self.parent.table_model.set_rows(callouts)
+        self.stream_callouts(lambda: iter_phase_chunks(file_name), phase_name, phase_path, file_name)
+
+    def merge_pulls(self):
+        file_names = QtWidgets.QFileDialog.getOpenFileNames(
+            self, 'Merge Pulls', str(util.BASE_PATH),
+            filter=f"Phases (*{BINARY_EXTENSION} *{JSON_EXTENSION});;All files (*)")[0]
+        if len(file_names) < 2:
+            return
 
-        self.phase_name.setText(os.path.splitext(os.path.basename(file_name))[0])
+        # aligning runs on the loader thread, the consensus then loads like any other phase
+        from Models.pull_alignment import consensus_from_files
+        phase_name = f"{self.phase_name.text()} consensus"
+        self.stream_callouts(lambda: iter_chunks(consensus_from_files(file_names)[0]), phase_name,
+                             os.path.join(util.BASE_PATH, f"{phase_name}{PHASE_EXTENSION}"))
 
 if __name__ == '__main__':
     import sys
@@ -0,0 +1,65 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PySide6 import QtCore, QtGui
+
+from Diagnostics import tracing
+
+DEFAULT_WORKER_COUNT = 2
+
+
+class ImageLoader(QtCore.QObject):
+    # Decodes screenshots off the GUI thread and pre-scales them to the preview size. QImage is safe
+    # to use from worker threads, the GUI thread only has to turn the result into a QPixmap.
+    # loaded(path, size, image, scaled): image is None for prefetches, which only keep the scaled copy.
+    loaded = QtCore.Signal(str, object, object, object)
+    # screenshots are not checked for when a phase loads, a path that cannot be read turns up here
+    missing = QtCore.Signal(str)
+
+    def __init__(self, parent=None, worker_count=DEFAULT_WORKER_COUNT):
+        QtCore.QObject.__init__(self, parent)
+        self.executor = ThreadPoolExecutor(worker_count)
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.futures)
+
+    def load(self, path, size, keep_full=True):
+        with self.lock:
+            key = (path, keep_full)
+            if key in self.futures:
+                return
+            self.futures[key] = self.executor.submit(self.decode, path, QtCore.QSize(size), keep_full)
+            tracing.counter("decode queue", len(self.futures))
+
+    def retain(self, paths):
+        # cancel queued loads for images that are no longer current or upcoming
+        with self.lock:
+            for (key, future) in list(self.futures.items()):
+                if key[0] not in paths and future.cancel():
+                    del self.futures[key]
+
+    def decode(self, path, size, keep_full):
+        with tracing.span("decode", "preview"):
+            image = QtGui.QImageReader(path).read()
+        if image.isNull():
+            with self.lock:
+                self.futures.pop((path, keep_full), None)
+            self.missing.emit(path)
+            return
+
+        scaled = None
+        if not size.isEmpty():
+            with tracing.span("scale", "preview"):
+                scaled = image.scaled(size, aspectMode=QtCore.Qt.KeepAspectRatio,
+                                      mode=QtCore.Qt.SmoothTransformation)
+
+        with self.lock:
+            self.futures.pop((path, keep_full), None)
+            tracing.counter("decode queue", len(self.futures))
+        self.loaded.emit(path, size, image if keep_full else None, scaled)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
@@ -1,23 +1,45 @@
 import os
+import threading
 import uuid
 
-from PIL import ImageGrab
 from PySide6 import QtCore, QtWidgets
 
 import util
 
+from Capture import capture_backends
+from Capture.capture_pool import CapturePool
+from Capture.image_encoder import ImageEncoder
+from Capture.preroll import FrameRingBuffer, PrerollSampler
+from Capture.screen_capture import capture_callout
+from Diagnostics import tracing
 from Models.callout import Callout
+from Storage.screenshot_store import ScreenshotStore
 from UI.controls_widget import ControlsWidget
-from UI.timeline_table_model import TimelineTableModel
+from UI.timeline_table_model import TimelineTableModel, configure_view
 from UI.preview_pane import PreviewPane
-from UI.timer_widget import TimerWidget
-from UI.select_region_widget import SelectRegionWidget
+from UI.timer_widget import RUNNING, TimerWidget
 
 
 REGION_CAPTURE = 1
 REGION_CAST_BAR = 2
 
-SCREENSHOTS_FOLDER = os.path.join(util.BASE_PATH, "screenshots")
+SCREENSHOTS_FOLDER = util.SCREENSHOTS_FOLDER
+
+# how long before Add Call was pressed the pre-roll frame is taken from
+DEFAULT_PREROLL_MS = 500
+
+# how many upcoming callouts have their screenshots decoded ahead of time
+PREFETCH_COUNT = 3
+
+# name screenshots by content so repeated frames share one file; set a bit distance to also fold
+# near-identical frames into one blob
+DEDUPLICATE_SCREENSHOTS = True
+NEAR_DUPLICATE_DISTANCE = None
+
+DEFAULT_DESCRIPTION = "Some Mechanic"
+
+# the capture backend is picked by timing a few grabs once the window is up
+CALIBRATION_DELAY_MS = 1000
 
 
 class MainPane(QtWidgets.QWidget):
@@ -26,8 +48,6 @@ class MainPane(QtWidgets.QWidget):
 
         self.parent = parent
         self.callout_count = 0
-        self.threads = []
-        self.workers = []
 
         self.timer_widget: TimerWidget = None
         self.table_model: TimelineTableModel = None
@@ -36,6 +56,13 @@ class MainPane(QtWidgets.QWidget):
         self.cast_bar_region = None
         self.current_row = None
 
+        self.preroll_sampler: PrerollSampler = None
+        self.preroll_buffer = FrameRingBuffer()
+        self.preroll_ms = DEFAULT_PREROLL_MS
+        self.preroll_best_frame = False
+
+        self.cast_sampler = None
+
         main_layout = QtWidgets.QHBoxLayout()
 
         self.splitter = QtWidgets.QSplitter(QtCore.Qt.Horizontal)
@@ -48,7 +75,8 @@ class MainPane(QtWidgets.QWidget):
         layout.addWidget(self.setup_settings())
         left_panel.setLayout(layout)
 
-        self.preview_pane = PreviewPane(self, r"C:\Users\clara\Downloads\finallycontent.gif")
+        self.preview_pane = PreviewPane(self)
+        self.preview_pane.watch_model(self.table_model)
 
         self.splitter.addWidget(left_panel)
         self.splitter.addWidget(self.preview_pane)
@@ -58,11 +86,34 @@ class MainPane(QtWidgets.QWidget):
         main_layout.addWidget(self.splitter)
         self.setLayout(main_layout)
 
-        if not os.path.exists(SCREENSHOTS_FOLDER):
-            os.mkdir(SCREENSHOTS_FOLDER)
+        # the journal is written from startup on; the screenshots folder, the screenshot index and the
+        # full-screen region selector are only set up once they are first needed
+        os.makedirs(util.BASE_PATH, exist_ok=True)
+        self.screenshots_ready = False
+        self.select_region_widget = None
+
+        self.image_encoder = ImageEncoder(self)
+        self.image_encoder.saved.connect(self.on_image_saved)
+        self.image_encoder.failed.connect(self.on_image_save_failed)
 
-        self.select_region_widget = SelectRegionWidget(app=QtWidgets.QApplication.instance())
-        self.select_region_widget.on_region_selected = self.on_region_selected
+        self.screenshot_store = None
+
+        self.capture_pool = CapturePool(self)
+        self.capture_pool.finished.connect(self.update_on_finish)
+        self.capture_pool.failed.connect(self.on_capture_failed)
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self.capture_pool.shutdown)
+        QtWidgets.QApplication.instance().aboutToQuit.connect(lambda: self.set_preroll_enabled(False))
+        QtWidgets.QApplication.instance().aboutToQuit.connect(lambda: self.set_cast_detection_enabled(False))
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self.image_encoder.shutdown)
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self.preview_pane.image_loader.shutdown)
+        QtWidgets.QApplication.instance().aboutToQuit.connect(capture_backends.shutdown)
+        if tracing.trace_path_from_environment():
+            QtWidgets.QApplication.instance().aboutToQuit.connect(
+                lambda: tracing.write_trace(tracing.trace_path_from_environment()))
+
+        self.settings_widget.recover_session()
+
+        QtCore.QTimer.singleShot(CALIBRATION_DELAY_MS, self.calibrate_capture)
 
     def setup_timers(self):
         self.timer_widget = TimerWidget(self)
@@ -72,11 +123,9 @@ class MainPane(QtWidgets.QWidget):
         self.table_model = TimelineTableModel(self)
         self.table_view = QtWidgets.QTableView()
         self.table_view.setModel(self.table_model)
+        self.timer_widget.watch_model(self.table_model)
 
-        resize = QtWidgets.QHeaderView.ResizeToContents
-        self.table_view.horizontalHeader().setSectionResizeMode(resize)
-        self.table_view.horizontalHeader().setStretchLastSection(True)
-        self.table_view.verticalHeader().setSectionResizeMode(resize)
+        configure_view(self.table_view)
 
         self.table_view.verticalHeader().sectionDoubleClicked.connect(self.on_row_double_clicked)
 
@@ -100,48 +149,108 @@ class MainPane(QtWidgets.QWidget):
         self.table_view.selectionModel().currentRowChanged.emit(new_index, old_index)
 
     def update_on_finish(self, callout):
-        self.table_model.add_callout(callout)
-        self.select_row(self.table_model.rowCount() - 1)
+        self.select_row(self.table_model.add_callout(callout))
 
-    def lap_button_clicked(self, elapsed_ms):
-        class Worker(QtCore.QObject):
-            finished = QtCore.Signal()
+    def on_capture_failed(self, error, args):
+        # the callout is kept without its screenshots, as when the queue is full
+        callout = args[0]
+        print(f"capture failed: {error}, added the callout at {util.format_ms(callout.timestamp)}s without screenshots")
+        self.add_without_screenshots(callout)
 
-            def __init__(self, data):
-                QtCore.QObject.__init__(self)
-                self.data = data
+    def add_without_screenshots(self, callout):
+        # the preview shows its screenshots missing
+        callout.screen_image_path = ""
+        callout.cast_image_path = ""
+        self.update_on_finish(callout)
 
-            def run(self):
-                (worker_callout, capture_region, cast_bar_region) = self.data
+    def on_image_saved(self, path):
+        callout = self.preview_pane.current_callout
+        if callout is not None and callout.screen_image_path == path:
+            self.preview_pane.load_image(path)
 
-                ImageGrab.grab(bbox=capture_region).save(worker_callout.screen_image_path)
-                ImageGrab.grab(bbox=cast_bar_region).save(worker_callout.cast_image_path)
-                self.finished.emit()
+    def on_image_save_failed(self, path, error):
+        print(f"saving {path} failed: {error}")
 
+    def lap_button_clicked(self, elapsed_ms, description=DEFAULT_DESCRIPTION):
         file_id = str(uuid.uuid4())
+        extension = self.image_encoder.extension()
         callout = Callout(
             timestamp=elapsed_ms,
-            description="Some Mechanic",
+            description=description,
             active=True,
             notes="",
-            screen_image_path=os.path.join(SCREENSHOTS_FOLDER, f"{file_id}_capture.png"),
-            cast_image_path=os.path.join(SCREENSHOTS_FOLDER, f"{file_id}_cast_bar.png"))
+            screen_image_path=os.path.join(SCREENSHOTS_FOLDER, f"{file_id}_capture.{extension}"),
+            cast_image_path=os.path.join(SCREENSHOTS_FOLDER, f"{file_id}_cast_bar.{extension}"))
+
+        submitted = self.capture_pool.submit(
+            capture_callout, callout, self.capture_region, self.cast_bar_region,
+            preroll_frame=self.preroll_frame(elapsed_ms), save=self.screenshot_saver())
+        if not submitted:
+            # the callout is still added, only its screenshots are dropped
+            print(f"capture queue full ({self.capture_pool.depth()} pending), added the callout at "
+                  f"{util.format_ms(elapsed_ms)}s without screenshots")
+            self.add_without_screenshots(callout)
 
         self.callout_count += 1
 
-        thread = QtCore.QThread()
-        worker = Worker((callout, self.capture_region, self.cast_bar_region))
-
-        self.threads.append(thread)
-        self.workers.append(worker)
-
-        worker.moveToThread(thread)
-        thread.started.connect(worker.run)
-        worker.finished.connect(thread.quit)
-        worker.finished.connect(worker.deleteLater)
-        thread.finished.connect(thread.deleteLater)
-        thread.finished.connect(lambda: self.update_on_finish(callout))
-        thread.start()
+    def screenshot_saver(self):
+        if not self.screenshots_ready:
+            os.makedirs(SCREENSHOTS_FOLDER, exist_ok=True)
+            if DEDUPLICATE_SCREENSHOTS:
+                self.screenshot_store = ScreenshotStore(SCREENSHOTS_FOLDER, self.image_encoder, NEAR_DUPLICATE_DISTANCE)
+            self.screenshots_ready = True
+        return self.screenshot_store.save if self.screenshot_store is not None else self.image_encoder.submit
+
+    def calibrate_capture(self):
+        # timed on the capture region if one is set already, else on the primary screen's top left
+        bbox = self.capture_region
+        if bbox is None:
+            screen = QtWidgets.QApplication.primaryScreen()
+            geometry = screen.geometry()
+            bbox = capture_backends.calibration_bbox(capture_backends.physical_screen_rect(
+                (geometry.x(), geometry.y()), (geometry.width(), geometry.height()), screen.devicePixelRatio()))
+        # off the GUI thread, which the Qt backend still needs free to grab on
+        threading.Thread(target=capture_backends.select_fastest, args=(bbox,), name="capture calibration",
+                         daemon=True).start()
+
+    def set_preroll_enabled(self, enabled):
+        if enabled and self.preroll_sampler is None:
+            self.preroll_sampler = PrerollSampler(self.timer_widget.current_elapsed_ms, self.preroll_buffer)
+            self.preroll_sampler.set_regions(self.capture_region, self.cast_bar_region)
+            self.preroll_sampler.start()
+        elif not enabled and self.preroll_sampler is not None:
+            self.preroll_sampler.stop()
+            self.preroll_sampler = None
+            self.preroll_buffer.clear()
+
+    def set_cast_detection_enabled(self, enabled):
+        if enabled and self.cast_sampler is None:
+            # imported here so numpy is only needed once detection is turned on
+            from Capture.cast_sampler import CastSampler
+            self.cast_sampler = CastSampler(self.timer_widget.current_elapsed_ms)
+            self.cast_sampler.set_region(self.cast_bar_region)
+            self.cast_sampler.cast_started.connect(self.on_cast_started)
+            self.cast_sampler.start()
+        elif not enabled and self.cast_sampler is not None:
+            self.cast_sampler.stop()
+            if self.cast_sampler.sample_time.count:
+                print(self.cast_sampler.report())
+            self.cast_sampler = None
+
+    def on_cast_started(self, elapsed_ms):
+        # detected casts go through the same path as pressing Add Call
+        from Capture.cast_detector import DETECTED_DESCRIPTION
+        if self.timer_widget.state == RUNNING:
+            self.lap_button_clicked(elapsed_ms, DETECTED_DESCRIPTION)
+
+    def preroll_frame(self, elapsed_ms):
+        if self.preroll_sampler is None:
+            return None
+
+        start_ms = elapsed_ms - self.preroll_ms
+        if self.preroll_best_frame:
+            return self.preroll_buffer.best_frame(start_ms, elapsed_ms)
+        return self.preroll_buffer.frame_at(start_ms)
 
     def on_row_double_clicked(self, row):
         self.timer_widget.set_elapsed_ms(self.table_model.callouts[row].timestamp)
@@ -153,10 +262,19 @@ class MainPane(QtWidgets.QWidget):
             self.capture_region = bbox
         elif region == REGION_CAST_BAR:
             self.cast_bar_region = bbox
+
+        if self.preroll_sampler is not None:
+            self.preroll_sampler.set_regions(self.capture_region, self.cast_bar_region)
+        if self.cast_sampler is not None:
+            self.cast_sampler.set_region(self.cast_bar_region)
         (x1, y1, x2, y2) = bbox
         print(str(f"region: {region}, x1: {x1}, x2: {x2}, y1: {y1}, y2: {y2}"))
 
     def select_region(self, region):
+        if self.select_region_widget is None:
+            from UI.select_region_widget import SelectRegionWidget
+            self.select_region_widget = SelectRegionWidget(app=QtWidgets.QApplication.instance())
+            self.select_region_widget.on_region_selected = self.on_region_selected
         self.setWindowState(QtCore.Qt.WindowMinimized)
         self.select_region_widget.start(region)
 
@@ -171,6 +289,9 @@ class MainPane(QtWidgets.QWidget):
         callout = self.table_model.callouts[current.row()]
         self.preview_pane.update_callout(callout)
 
+        upcoming = self.table_model.callouts[current.row() + 1:current.row() + 1 + PREFETCH_COUNT]
+        self.preview_pane.prefetch([c.screen_image_path for c in upcoming])
+
     def playback_phase(self):
         return
 
@@ -0,0 +1,31 @@
+from PySide6 import QtCore
+
+
+class PhaseLoader(QtCore.QThread):
+    # Parses a phase on a worker thread and hands it to the GUI thread a chunk of callouts at a time,
+    # so the first rows show while the rest of the file is still being read. Every signal carries the
+    # loader so a superseded load's queued chunks can be told apart and dropped.
+    chunk_loaded = QtCore.Signal(object, object)
+    loaded = QtCore.Signal(object)
+    failed = QtCore.Signal(object, object)
+
+    def __init__(self, parent, chunks):
+        QtCore.QThread.__init__(self, parent)
+        self.chunks = chunks
+        self.cancelled = False
+        self.finished.connect(self.deleteLater)
+
+    def run(self):
+        try:
+            for chunk in self.chunks():
+                if self.cancelled:
+                    return
+                self.chunk_loaded.emit(self, chunk)
+        except Exception as e:
+            # anything a damaged file can raise, the GUI thread has to hear the load ended either way
+            self.failed.emit(self, e)
+            return
+        self.loaded.emit(self)
+
+    def cancel(self):
+        self.cancelled = True
@@ -0,0 +1,44 @@
+from collections import OrderedDict
+
+DEFAULT_BYTE_BUDGET = 64 * 1024 * 1024
+
+
+def pixmap_size_bytes(pixmap):
+    return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+
+class PixmapCache:
+    # LRU of scaled pixmaps keyed by (image key, width, height), capped by estimated pixel memory.
+    def __init__(self, byte_budget=DEFAULT_BYTE_BUDGET):
+        self.byte_budget = byte_budget
+        self.size_bytes = 0
+        self.pixmaps = OrderedDict()
+
+    def __len__(self):
+        return len(self.pixmaps)
+
+    def get(self, key):
+        pixmap = self.pixmaps.get(key)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(key)
+        return pixmap
+
+    def put(self, key, pixmap):
+        old = self.pixmaps.pop(key, None)
+        if old is not None:
+            self.size_bytes -= pixmap_size_bytes(old)
+
+        self.pixmaps[key] = pixmap
+        self.size_bytes += pixmap_size_bytes(pixmap)
+
+        while self.size_bytes > self.byte_budget and len(self.pixmaps) > 1:
+            (_, evicted) = self.pixmaps.popitem(last=False)
+            self.size_bytes -= pixmap_size_bytes(evicted)
+
+    def discard(self, image_key):
+        for key in [key for key in self.pixmaps if key[0] == image_key]:
+            self.size_bytes -= pixmap_size_bytes(self.pixmaps.pop(key))
+
+    def clear(self):
+        self.pixmaps.clear()
+        self.size_bytes = 0
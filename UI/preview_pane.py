@@ -1,23 +1,47 @@
 from PySide6 import QtCore, QtGui, QtWidgets
 
+from Diagnostics import tracing
+from UI.image_loader import ImageLoader
+from UI.pixmap_cache import PixmapCache
+
+# how long the label has to stay the same size before the fast resize preview is replaced by a
+# smooth scale
+SMOOTH_SCALE_DELAY_MS = 150
+
+LOADING_TEXT = "Loading..."
+MISSING_TEXT = "Screenshot missing"
+
 
 class PreviewPane(QtWidgets.QWidget):
-    def __init__(self, parent, file_path):
+    def __init__(self, parent, file_path=None):
         QtWidgets.QWidget.__init__(self)
         self.current_callout = None
 
         self.parent = parent
-        self.image = QtGui.QImage(file_path)
+        # an initial image is decoded off the GUI thread once the pane is first shown
+        self.image = None
+        self.image_key = file_path
+        self.scaled_size = None
+        self.pixmap_cache = PixmapCache()
+
+        self.image_loader = ImageLoader(self)
+        self.image_loader.loaded.connect(self.on_image_loaded)
+        self.image_loader.missing.connect(self.on_image_missing)
+
+        self.smooth_scale_timer = QtCore.QTimer(self)
+        self.smooth_scale_timer.setSingleShot(True)
+        self.smooth_scale_timer.setInterval(SMOOTH_SCALE_DELAY_MS)
+        self.smooth_scale_timer.timeout.connect(self.smooth_scale)
 
         self.layout = QtWidgets.QVBoxLayout(self)
 
         self.splitter = QtWidgets.QSplitter(QtCore.Qt.Vertical)
-        self.splitter.splitterMoved.connect(self.resize_image)
 
         self.image_label = QtWidgets.QLabel(self)
         self.image_label.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding)
         self.image_label.setMinimumSize(1, 1)
         self.image_label.setAlignment(QtCore.Qt.AlignCenter)
+        self.image_label.installEventFilter(self)
         self.notes = QtWidgets.QTextEdit(self)
         self.notes.setBaseSize(50, 50)
         self.notes.textChanged.connect(self.notes_changed)
@@ -32,25 +56,133 @@ class PreviewPane(QtWidgets.QWidget):
 
         self.setLayout(self.layout)
 
-        self.resize_image()
-
-    def resize_image(self, event=None):
-        image = self.image.scaled(
-            self.image_label.size(),
-            aspectMode=QtCore.Qt.KeepAspectRatio,
-            mode=QtCore.Qt.SmoothTransformation)
-        self.image_label.setPixmap(QtGui.QPixmap.fromImage(image))
-
-    def paintEvent(self, event):
-        self.resize_image(event)
+    def showEvent(self, event):
+        if self.image is None and self.image_key and self.current_callout is None:
+            self.image_loader.load(self.image_key, self.image_label.size())
+
+    def eventFilter(self, watched, event):
+        if watched is self.image_label and event.type() == QtCore.QEvent.Resize:
+            self.resize_image()
+        return False
+
+    def cache_key(self, path, size):
+        return (path, size.width(), size.height())
+
+    def scaled_pixmap(self, size, mode):
+        with tracing.span("scale pixmap", "preview"):
+            return QtGui.QPixmap.fromImage(self.image.scaled(size, aspectMode=QtCore.Qt.KeepAspectRatio, mode=mode))
+
+    def resize_image(self):
+        # while the label is being resized use a cheap scale, then smooth it once resizing stops
+        size = self.image_label.size()
+        if size == self.scaled_size or self.image is None:
+            return
+        self.scaled_size = size
+
+        pixmap = self.pixmap_cache.get(self.cache_key(self.image_key, size))
+        if pixmap is None:
+            pixmap = self.scaled_pixmap(size, QtCore.Qt.FastTransformation)
+            self.smooth_scale_timer.start()
+        self.image_label.setPixmap(pixmap)
+
+    def smooth_scale(self):
+        if self.image is None:
+            return
+
+        size = self.image_label.size()
+        self.scaled_size = size
+
+        key = self.cache_key(self.image_key, size)
+        pixmap = self.pixmap_cache.get(key)
+        if pixmap is None:
+            pixmap = self.scaled_pixmap(size, QtCore.Qt.SmoothTransformation)
+            self.pixmap_cache.put(key, pixmap)
+        self.image_label.setPixmap(pixmap)
+
+    def watch_model(self, model):
+        # a removed row is no longer previewed; a reset may also only have reordered the rows
+        model.rowsRemoved.connect(self.forget_removed_callout)
+        model.modelReset.connect(self.forget_removed_callout)
+        model.batch_removed.connect(self.forget_removed_callout)
+
+    def forget_removed_callout(self, *args):
+        if self.current_callout is None or self.current_callout.current_row() is not None:
+            return
+        self.current_callout = None
+        self.image = None
+        self.image_key = None
+        self.scaled_size = None
+        self.smooth_scale_timer.stop()
+        self.image_label.clear()
+        self.notes.blockSignals(True)
+        self.notes.clear()
+        self.notes.blockSignals(False)
 
     def update_callout(self, callout):
         self.current_callout = callout
-        self.image = QtGui.QImage(callout.screen_image_path)
+        self.load_image(callout.screen_image_path)
         self.notes.setText(callout.notes)
 
+    def load_image(self, path):
+        self.image_key = path
+        self.smooth_scale_timer.stop()
+
+        if not path:
+            # a callout added without screenshots has nothing to load
+            self.image = None
+            self.scaled_size = None
+            self.image_label.setText(MISSING_TEXT)
+            return
+
+        # a capture that is still being encoded is shown from memory instead of a half-written file
+        pending = self.parent.image_encoder.pending_image(path)
+        if pending is not None:
+            from PIL.ImageQt import ImageQt
+            self.image = ImageQt(pending)
+            self.smooth_scale()
+            return
+
+        # decode off the GUI thread, showing the cached scaled copy (or a placeholder) meanwhile
+        self.image = None
+        size = self.image_label.size()
+        pixmap = self.pixmap_cache.get(self.cache_key(path, size))
+        if pixmap is not None:
+            self.scaled_size = size
+            self.image_label.setPixmap(pixmap)
+        else:
+            self.scaled_size = None
+            self.image_label.setText(LOADING_TEXT)
+        self.image_loader.load(path, size)
+
+    def prefetch(self, paths):
+        size = self.image_label.size()
+        self.image_loader.retain(set(paths) | {self.image_key})
+        for path in paths:
+            if path and path != self.image_key and self.pixmap_cache.get(self.cache_key(path, size)) is None:
+                self.image_loader.load(path, size, keep_full=False)
+
+    def on_image_loaded(self, path, size, image, scaled):
+        if scaled is not None:
+            self.pixmap_cache.put(self.cache_key(path, size), QtGui.QPixmap.fromImage(scaled))
+
+        if path != self.image_key or image is None or self.image is not None:
+            return
+
+        self.image = image
+        if size == self.image_label.size() and scaled is not None:
+            self.scaled_size = size
+            self.image_label.setPixmap(self.pixmap_cache.get(self.cache_key(path, size)))
+        else:
+            self.smooth_scale()
+
+    def on_image_missing(self, path):
+        if path == self.image_key and self.image is None:
+            self.image_label.setText(MISSING_TEXT)
+
     def notes_changed(self):
-        self.current_callout.notes = self.notes.toPlainText()
+        row = self.current_callout.current_row() if self.current_callout is not None else None
+        if row is not None:
+            self.parent.table_model.set_notes(row, self.notes.toPlainText())
 
 
 if __name__ == '__main__':
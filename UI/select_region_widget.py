@@ -4,6 +4,8 @@ from PySide6.QtCore import *
 from PySide6.QtGui import *
 from PySide6.QtWidgets import *
 
+from Capture.capture_backends import to_physical_region
+
 
 class SelectRegionWidget(QWidget):
     # https://stackoverflow.com/questions/34567869/pyqt-take-screenshot-of-certain-screen-area
@@ -64,10 +66,11 @@ class SelectRegionWidget(QWidget):
     def mouseReleaseEvent(self, event):
         self.is_snipping = False
         QApplication.restoreOverrideCursor()
-        x1 = min(self.begin.x(), self.end.x()) * self.devicePixelRatio()
-        y1 = min(self.begin.y(), self.end.y()) * self.devicePixelRatio()
-        x2 = max(self.begin.x(), self.end.x()) * self.devicePixelRatio()
-        y2 = max(self.begin.y(), self.end.y()) * self.devicePixelRatio()
+        # regions are kept in physical pixels, which every capture backend grabs in
+        screen = QGuiApplication.screenAt(self.begin.toPoint()) or self.screen
+        origin = (screen.geometry().x(), screen.geometry().y())
+        (x1, y1, x2, y2) = to_physical_region((self.begin.x(), self.begin.y()), (self.end.x(), self.end.y()),
+                                              origin, screen.devicePixelRatio())
 
         if self.on_region_selected is not None:
             self.on_region_selected(self.region, (x1, y1, x2, y2))
@@ -0,0 +1,63 @@
+import os
+import time
+
+from PySide6 import QtCore, QtGui, QtWidgets
+
+import util
+from Diagnostics import tracing
+
+REFRESH_INTERVAL_MS = 500
+TRACES_FOLDER = os.path.join(util.BASE_PATH, "traces")
+
+
+def save_trace():
+    # the buffered events as a Chrome trace, named by the time it was written
+    os.makedirs(TRACES_FOLDER, exist_ok=True)
+    path = os.path.join(TRACES_FOLDER, time.strftime("trace-%Y%m%d-%H%M%S.json"))
+    tracing.write_trace(path)
+    print(f"trace written to {path}")
+    return path
+
+
+class StatsPanel(QtWidgets.QWidget):
+    # Span timings and counters from Diagnostics.tracing, refreshed while the panel is showing.
+    def __init__(self, parent=None):
+        QtWidgets.QWidget.__init__(self, parent, QtCore.Qt.Window)
+        self.setWindowTitle("Stats")
+
+        self.text = QtWidgets.QPlainTextEdit(self)
+        self.text.setReadOnly(True)
+        self.text.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        self.save_button = QtWidgets.QPushButton("Save Trace")
+        self.clear_button = QtWidgets.QPushButton("Clear")
+
+        layout = QtWidgets.QGridLayout(self)
+        layout.addWidget(self.text, 0, 0, 1, 2)
+        layout.addWidget(self.save_button, 1, 0, 1, 1)
+        layout.addWidget(self.clear_button, 1, 1, 1, 1)
+        self.setLayout(layout)
+        self.resize(480, 320)
+
+        self.save_button.clicked.connect(save_trace)
+        self.clear_button.clicked.connect(self.clear)
+
+        self.refresh_timer = QtCore.QTimer(self)
+        self.refresh_timer.setInterval(REFRESH_INTERVAL_MS)
+        self.refresh_timer.timeout.connect(self.refresh)
+
+    def refresh(self):
+        if not tracing.enabled:
+            self.text.setPlainText("Tracing is off.")
+            return
+        self.text.setPlainText(tracing.report() or "No spans yet.")
+
+    def clear(self):
+        tracing.clear()
+        self.refresh()
+
+    def showEvent(self, event):
+        self.refresh()
+        self.refresh_timer.start()
+
+    def hideEvent(self, event):
+        self.refresh_timer.stop()
@@ -1,22 +1,56 @@
 # https://doc.qt.io/qtforpython/tutorials/datavisualize/index.html
 
-from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, QEvent
+import operator
+
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, QEvent, Signal
 from PySide6.QtGui import QColor
-from PySide6.QtWidgets import QItemDelegate
+from PySide6.QtWidgets import QItemDelegate, QHeaderView
 
 import util
+from Diagnostics import tracing
 from Models.callout import Callout
+from Models.timeline_store import TimelineStore
 
 TIMESTAMP_COLUMN = 0
 CALLOUT_COLUMN = 1
 COLUMN_COUNT = 2
 
+# Qt passes roles as plain ints, and comparing those against Qt's enum members is slow on newer
+# PySide6, so data() compares against int copies
+DISPLAY_ROLE = int(Qt.DisplayRole)
+EDIT_ROLE = int(Qt.EditRole)
+CHECK_STATE_ROLE = int(Qt.CheckStateRole)
+BACKGROUND_ROLE = int(Qt.BackgroundRole)
+TEXT_ALIGNMENT_ROLE = int(Qt.TextAlignmentRole)
+
+# role values shared by every cell instead of being rebuilt on each data() call
+BACKGROUND = QColor(Qt.white)
+ALIGNMENTS = (int(Qt.AlignRight), int(Qt.AlignLeft))
+CHECK_STATES = (Qt.Unchecked, Qt.Checked)
+CHECKED_VALUE = Qt.Checked.value if hasattr(Qt.Checked, "value") else int(Qt.Checked)
+HEADERS = ("Time (s)", "Callout (uncheck to suppress)")
+TIMESTAMP_PADDING = 16
+# formatted timestamps kept before the cache starts over; only the rows on screen are asked for, so
+# a cleared cache refills with a screenful
+TIMESTAMP_TEXT_CACHE_SIZE = 65536
+TIMESTAMP_FLAGS = Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsEditable
+CALLOUT_FLAGS = Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsUserCheckable | Qt.ItemIsEditable
+
 
 class TimelineTableModel(QAbstractTableModel):
+    # row, field name, new value: every edit to a callout, including notes which are not a column
+    callout_edited = Signal(int, str, object)
+    # ascending rows of a batch applied with a model reset, which carries no rows of its own
+    batch_inserted = Signal(object)
+    batch_removed = Signal(object)
+
     def __init__(self, parent, data=None):
         QAbstractTableModel.__init__(self)
         self.parent = parent
-        self.callouts = data.copy() if data else []
+        self.callouts = TimelineStore(data or ())
+        self.callouts.sort()
+        # formatted timestamps keyed by value rather than row, so inserts and moves never invalidate it
+        self.timestamp_text = {}
 
     def rowCount(self, parent=QModelIndex()):
         return len(self.callouts)
@@ -25,68 +59,171 @@ class TimelineTableModel(QAbstractTableModel):
         return COLUMN_COUNT
 
     def headerData(self, section, orientation, role):
-        if role != Qt.DisplayRole:
+        if role != DISPLAY_ROLE:
             return None
         if orientation == Qt.Horizontal:
-            return ("Time (s)", "Callout (uncheck to suppress)")[section]
+            return HEADERS[section]
         else:
             return str(section)
 
-    def data(self, index, role=Qt.DisplayRole):
+    def data(self, index, role=DISPLAY_ROLE):
         column = index.column()
         row = index.row()
 
-        if role == Qt.DisplayRole or role == Qt.EditRole:
+        if role == DISPLAY_ROLE or role == EDIT_ROLE:
             if column == TIMESTAMP_COLUMN:
-                return util.format_ms(self.callouts[row].timestamp)
+                timestamp = self.callouts.timestamps[row]
+                text = self.timestamp_text.get(timestamp)
+                if text is None:
+                    if len(self.timestamp_text) >= TIMESTAMP_TEXT_CACHE_SIZE:
+                        # retimes and edits add values without removing old ones
+                        self.timestamp_text.clear()
+                    text = util.format_ms(timestamp)
+                    self.timestamp_text[timestamp] = text
+                return text
             elif column == CALLOUT_COLUMN:
-                return self.callouts[row].description
-        elif role == Qt.CheckStateRole:
+                return self.callouts.descriptions[row]
+        elif role == CHECK_STATE_ROLE:
             if column == CALLOUT_COLUMN:
-                return int(Qt.Checked) if self.callouts[row].active else int(Qt.Unchecked)
-        elif role == Qt.BackgroundRole:
-            return QColor(Qt.white)
-        elif role == Qt.TextAlignmentRole:
-            if column == TIMESTAMP_COLUMN:
-                return int(Qt.AlignRight)
-            elif column == CALLOUT_COLUMN:
-                return int(Qt.AlignLeft)
+                return CHECK_STATES[self.callouts.active[row]]
+        elif role == BACKGROUND_ROLE:
+            return BACKGROUND
+        elif role == TEXT_ALIGNMENT_ROLE:
+            return ALIGNMENTS[column]
 
         return None
 
     def setData(self, index, value, role):
-        if role == Qt.EditRole:
+        with tracing.span("edit row", "table"):
+            return self.set_data(index, value, role)
+
+    def set_data(self, index, value, role):
+        row = index.row()
+        if role == EDIT_ROLE:
             if index.column() == TIMESTAMP_COLUMN:
-                self.callouts[index.row()].timestamp = float(value) * 1000
+                timestamp = float(value) * 1000
+                self.callouts.timestamps[row] = timestamp
+                self.callout_edited.emit(row, "timestamp", timestamp)
+                row = self.move_to_sorted_position(row, timestamp)
+                index = self.index(row, TIMESTAMP_COLUMN)
             if index.column() == CALLOUT_COLUMN:
-                self.callouts[index.row()].description = value
+                self.callouts[row].description = value
+                self.callout_edited.emit(row, "description", value)
+            self.dataChanged.emit(index, index)
             return True
-        elif role == Qt.CheckStateRole:
-            self.callouts[index.row()].active = value == int(Qt.Checked)
+        elif role == CHECK_STATE_ROLE:
+            self.callouts.active[row] = value == CHECKED_VALUE or value == Qt.Checked
+            self.callout_edited.emit(row, "active", bool(self.callouts.active[row]))
+            self.dataChanged.emit(index, index)
             return True
         return False
 
+    def move_to_sorted_position(self, row, timestamp):
+        # a timestamp edit moves only the edited row, so views keep their selection and scroll position
+        new_row = self.callouts.sorted_position(row, timestamp)
+        if new_row != row:
+            # Qt's destination is the row to insert before, counted before the moved row is taken out
+            self.beginMoveRows(QModelIndex(), row, row, QModelIndex(), new_row + 1 if new_row > row else new_row)
+            self.callouts.move(row, new_row)
+            self.endMoveRows()
+        return new_row
+
     def flags(self, index):
         if index.column() == CALLOUT_COLUMN:
-            return Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsUserCheckable | Qt.ItemIsEditable
-        return Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsEditable
+            return CALLOUT_FLAGS
+        return TIMESTAMP_FLAGS
+
+    def set_notes(self, row, notes):
+        if self.callouts.notes[row] == notes:
+            return
+        self.callouts.notes[row] = notes
+        self.callout_edited.emit(row, "notes", notes)
 
     def add_callout(self, callout):
-        self.beginInsertRows(QModelIndex(), len(self.callouts), len(self.callouts))
-        self.callouts.append(callout)
-        self.endInsertRows()
-        return True
+        # returns the row the callout was inserted at, rows are kept in timestamp order
+        row = self.callouts.bisect_right(callout.timestamp)
+        with tracing.span("add row", "table"):
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.callouts.insert(row, callout)
+            self.endInsertRows()
+        return row
+
+    def insert_callouts(self, callouts):
+        # One signal per batch: a range insert when the batch lands after the existing rows in time
+        # order, otherwise a reset followed by batch_inserted. Returns the rows the callouts ended up in.
+        callouts = list(callouts)
+        if not callouts:
+            return []
+
+        first = len(self.callouts)
+        timestamps = [callout.timestamp for callout in callouts]
+        in_order = all(map(operator.le, timestamps, timestamps[1:]))
+        with tracing.span("insert rows", "table", rows=len(callouts)):
+            if in_order and (first == 0 or timestamps[0] >= self.callouts.timestamps[-1]):
+                self.beginInsertRows(QModelIndex(), first, first + len(callouts) - 1)
+                self.callouts.extend(callouts)
+                self.endInsertRows()
+                return list(range(first, first + len(callouts)))
+
+            self.beginResetModel()
+            rows = self.callouts.merge(callouts)
+            self.endResetModel()
+            self.batch_inserted.emit(rows)
+            return rows
+
+    def remove_callouts(self, rows):
+        # a range removal when the rows are contiguous, otherwise a reset followed by batch_removed
+        rows = sorted(set(rows))
+        if not rows:
+            return
+
+        with tracing.span("remove rows", "table", rows=len(rows)):
+            if rows[-1] - rows[0] + 1 == len(rows):
+                self.beginRemoveRows(QModelIndex(), rows[0], rows[-1])
+                del self.callouts[rows[0]:rows[-1] + 1]
+                self.endRemoveRows()
+                return
+
+            self.beginResetModel()
+            self.callouts.delete_rows(rows)
+            self.endResetModel()
+            self.batch_removed.emit(rows)
 
     def clear_rows(self):
         if len(self.callouts) > 0:
             self.beginRemoveRows(QModelIndex(), 0, len(self.callouts)-1)
             self.callouts.clear()
+            self.timestamp_text.clear()
             self.endRemoveRows()
 
-    def set_rows(self, callouts):
-        self.beginInsertRows(QModelIndex(), len(self.callouts), len(self.callouts) + len(callouts) - 1)
-        self.callouts.extend(callouts)
-        self.endInsertRows()
+
+def fit_timestamp_column(view):
+    # the widest timestamp is the latest (or most negative) one, and rows are in time order, so size
+    # the column from the last and first rows rather than letting the header measure every row
+    timestamps = view.model().callouts.timestamps
+    header = view.horizontalHeader()
+    width = header.sectionSizeHint(TIMESTAMP_COLUMN)
+    if timestamps:
+        metrics = view.fontMetrics()
+        for timestamp in (timestamps[-1], timestamps[0]):
+            width = max(width, metrics.horizontalAdvance(util.format_ms(timestamp)) + TIMESTAMP_PADDING)
+    header.resizeSection(TIMESTAMP_COLUMN, width)
+
+
+def configure_view(view):
+    # fixed row heights and an explicitly sized timestamp column, so neither header queries every row
+    view.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+    view.horizontalHeader().setStretchLastSection(True)
+    view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+
+    model = view.model()
+    refit = lambda *args: fit_timestamp_column(view)
+    model.rowsInserted.connect(refit)
+    model.rowsRemoved.connect(refit)
+    model.modelReset.connect(refit)
+    # an edited timestamp can be wider than the first and last were
+    model.dataChanged.connect(lambda top_left, *args: top_left.column() == TIMESTAMP_COLUMN and refit())
+    refit()
 
 
 if __name__ == "__main__":
@@ -1,6 +1,12 @@
+import math
+import time
+
 from PySide6 import QtCore, QtGui, QtWidgets
 
 import util
+from Diagnostics import tracing
+from Diagnostics.histogram import LatencyHistogram
+from UI.timeline_table_model import TIMESTAMP_COLUMN
 
 STOPPED = 1
 PAUSED = 2
@@ -17,8 +23,22 @@ class TimerWidget(QtWidgets.QWidget):
         self.timer = QtCore.QTimer(self)
         self.timer.setInterval(10)
         self.timer.timeout.connect(self.update_timer)
+
+        # elapsed time is offset_ms plus the time since elapsed_timer was started, never a sum of
+        # tick deltas, so late ticks and seeks cannot accumulate drift
+        self.offset_ms = 0
         self.elapsed_timer = QtCore.QElapsedTimer()
 
+        self.last_tick_ns = None
+        self.tick_lateness = LatencyHistogram("tick lateness")
+        self.callout_error = LatencyHistogram("callout firing error")
+
+        # fires once when the next callout is due instead of checking the timeline on every tick
+        self.callout_timer = QtCore.QTimer(self)
+        self.callout_timer.setSingleShot(True)
+        self.callout_timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.callout_timer.timeout.connect(self.on_callout_due)
+
         frame = QtWidgets.QFrame(self)
         grid_layout = QtWidgets.QGridLayout(self)
 
@@ -50,72 +70,145 @@ class TimerWidget(QtWidgets.QWidget):
         frame.setLayout(grid_layout)
         self.setLayout(grid_layout)
 
-        self.playback_row = 0
+        self.playback_position = 0
+
+    def watch_model(self, model):
+        # the model keeps its rows in timestamp order, so any change only needs the position re-synced
+        model.rowsInserted.connect(self.sync_playback)
+        model.rowsRemoved.connect(self.sync_playback)
+        model.rowsMoved.connect(self.sync_playback)
+        model.modelReset.connect(self.sync_playback)
+        model.layoutChanged.connect(self.sync_playback)
+        model.dataChanged.connect(self.on_data_changed)
+
+    def timeline(self):
+        return self.parent.table_model.callouts
+
+    def on_data_changed(self, top_left, bottom_right, roles=()):
+        if top_left.column() <= TIMESTAMP_COLUMN <= bottom_right.column():
+            self.sync_playback()
+
+    def sync_playback(self, *args):
+        # keep the playback position consistent with an edited timeline without moving the selection
+        self.playback_position = self.timeline().bisect_left(self.elapsed_ms)
+        self.arm_callout_timer()
+
+    def arm_callout_timer(self):
+        self.callout_timer.stop()
+        timeline = self.timeline()
+        if self.state != RUNNING or self.playback_position >= len(timeline):
+            return
+
+        delay = timeline.timestamps[self.playback_position] - self.current_elapsed_ms()
+        self.callout_timer.start(max(0, math.ceil(delay)))
+
+    def on_callout_due(self):
+        self.update_elapsed()
+        self.update_timer_label()
+        self.advance_playback()
+
+    def advance_playback(self):
+        timeline = self.timeline()
+        position = timeline.bisect_left(self.elapsed_ms)
+        if position != self.playback_position:
+            for passed in range(self.playback_position, position):
+                self.callout_error.record(self.elapsed_ms - timeline.timestamps[passed])
+            self.playback_position = position
+            self.parent.select_row(position)
+        self.arm_callout_timer()
 
     def add_second_button_clicked(self):
-        self.set_elapsed_ms(self.elapsed_ms + 1000)
+        self.set_elapsed_ms(self.current_elapsed_ms() + 1000)
 
     def sub_second_button_clicked(self):
-        self.set_elapsed_ms(self.elapsed_ms - 1000)
+        self.set_elapsed_ms(self.current_elapsed_ms() - 1000)
 
     def set_elapsed_ms(self, elapsed_ms):
+        self.offset_ms = elapsed_ms
+        self.elapsed_timer.restart()
         self.elapsed_ms = elapsed_ms
         self.update_timer_label()
 
-        self.playback_row = 0
-
-        while self.playback_row < self.parent.table_model.rowCount() and\
-            self.elapsed_ms > self.parent.table_model.callouts[self.playback_row].timestamp:
-            self.playback_row += 1
-
-        self.parent.select_row(self.playback_row)
+        self.playback_position = self.timeline().bisect_left(self.elapsed_ms)
+        self.parent.select_row(self.playback_position)
+        self.arm_callout_timer()
 
     def update_timer_label(self):
         self.timer_label.setText(util.format_ms(self.elapsed_ms)+"s")
 
-    def update_timer(self):
-        self.elapsed_ms += self.elapsed_timer.restart()
-        self.update_timer_label()
-
-        row_updated = False
+    def current_elapsed_ms(self):
+        if self.state == RUNNING:
+            return self.offset_ms + self.elapsed_timer.nsecsElapsed() / 1e6
+        return self.offset_ms
 
-        while self.playback_row < self.parent.table_model.rowCount() and\
-            self.elapsed_ms > self.parent.table_model.callouts[self.playback_row].timestamp:
-            self.playback_row += 1
-            row_updated = True
+    def update_elapsed(self):
+        self.elapsed_ms = self.current_elapsed_ms()
 
-        if row_updated:
-            self.parent.select_row(self.playback_row)
+    def update_timer(self):
+        now_ns = time.perf_counter_ns()
+        if self.last_tick_ns is not None:
+            lateness = (now_ns - self.last_tick_ns) / 1e6 - self.timer.interval()
+            self.tick_lateness.record(lateness)
+            if lateness >= self.timer.interval():
+                # a tick at least one interval late stands in for the ones that never came
+                tracing.increment("dropped ticks", int(lateness // self.timer.interval()))
+        self.last_tick_ns = now_ns
+
+        with tracing.span("tick", "timer"):
+            self.update_elapsed()
+            self.update_timer_label()
+
+    def timing_report(self):
+        return f"{self.tick_lateness.report()}\n{self.callout_error.report()}"
+
+    def clear_timing_stats(self):
+        self.tick_lateness.clear()
+        self.callout_error.clear()
 
     def start_button_clicked(self, event):
         if self.state == STOPPED:
+            self.last_tick_ns = None
             self.timer.start()
             self.elapsed_timer.start()
             self.start_button.setText("Pause")
             self.state = RUNNING
 
-            self.parent.select_row(0)
+            self.playback_position = self.timeline().bisect_left(self.elapsed_ms)
+            self.parent.select_row(self.playback_position)
+            self.arm_callout_timer()
         elif self.state == RUNNING:
             self.timer.stop()
+            self.offset_ms = self.current_elapsed_ms()
+            self.elapsed_ms = self.offset_ms
+            self.update_timer_label()
             self.start_button.setText("Resume")
             self.state = PAUSED
+            self.callout_timer.stop()
         elif self.state == PAUSED:
+            self.last_tick_ns = None
             self.timer.start()
             self.elapsed_timer.restart()
             self.start_button.setText("Pause")
             self.state = RUNNING
+            self.arm_callout_timer()
 
     def lap_button_clicked(self, event):
         if self.state == RUNNING:
-            self.parent.lap_button_clicked(self.elapsed_ms)
+            self.parent.lap_button_clicked(self.current_elapsed_ms())
 
     def reset(self):
+        if self.tick_lateness.count or self.callout_error.count:
+            print(self.timing_report())
+            self.clear_timing_stats()
+
         self.timer.stop()
+        self.callout_timer.stop()
         self.timer_label.setText("0.00s")
         self.start_button.setText("Start")
         self.state = STOPPED
         self.elapsed_ms = 0
-        self.playback_row = 0
+        self.offset_ms = 0
+        self.playback_position = 0
 
     def reset_button_clicked(self, event):
         self.reset()
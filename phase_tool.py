@@ -0,0 +1,282 @@
+# Phase maintenance without the GUI; nothing here imports PySide6, so it starts quickly from scripts
+# and cron jobs. Relative paths are taken from util.BASE_PATH, and a folder stands for every phase in
+# it. Files are processed in parallel across a process pool.
+#
+#   python phase_tool.py convert [PATHS ...] [--to phase|json] [--output-folder DIR]
+#   python phase_tool.py retime [PATHS ...] [--offset-ms MS] [--scale X] [--output-folder DIR]
+#   python phase_tool.py export [PATHS ...] [--format tsv|csv|jsonl|srt|overlay] [--all] [--start-ms MS]
+#       [--end-ms MS] [--output-folder DIR]
+#   python phase_tool.py merge PATHS ... --output FILE [--consensus]
+#   python phase_tool.py gc [--dry-run] [--folder DIR ...] [--min-age-hours H] [--limit N]
+#
+# gc --limit stops after that many screenshots, and the next gc carries on from the last one it looked
+# at, so a large folder can be collected a step at a time.
+#
+# A folder holding both a.phase and a.json holds one phase in two formats, only a.phase is taken from
+# it. Outputs are named after their phase; phases that would share an output name keep their own
+# extension in it too (a.json.tsv, a.phase.tsv), and a batch that would still write one file twice
+# is refused before anything runs.
+#
+# Phases are read with their journal applied, so unsaved changes from the app are included. A phase
+# file that a journal saves to or started from is never overwritten, the app would not see the change.
+import argparse
+import glob
+import heapq
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import util
+from Storage import screenshot_refs
+from Storage.phase_export import EXPORT_FORMATS, export_file
+from Storage.phase_file import BINARY_EXTENSION, JSON_EXTENSION, is_binary_path, write_phase
+from Storage.phase_journal import JOURNAL_EXTENSION, journal_applies, load_phase
+from Storage.screenshot_refs import ReferenceIndex, update_references
+
+PHASE_EXTENSIONS = (BINARY_EXTENSION, JSON_EXTENSION)
+FORMATS = {"phase": BINARY_EXTENSION, "json": JSON_EXTENSION}
+
+
+def resolve(path):
+    return os.path.join(util.BASE_PATH, path)
+
+
+def without_converted_copies(paths):
+    # a.json next to a.phase is the same phase converted, the app's own format is kept
+    binary_stems = {os.path.splitext(path)[0] for path in paths if path.endswith(BINARY_EXTENSION)}
+    kept = []
+    for path in paths:
+        if path.endswith(JSON_EXTENSION) and os.path.splitext(path)[0] in binary_stems:
+            print(f"skipping {path}, {os.path.splitext(path)[0]}{BINARY_EXTENSION} is the same phase",
+                  file=sys.stderr)
+            continue
+        kept.append(path)
+    return kept
+
+
+def phase_paths(paths, recursive=False):
+    found = []
+    for path in map(resolve, paths):
+        if not os.path.isdir(path):
+            found.append(path)
+            continue
+        pattern = os.path.join(path, "**", "*") if recursive else os.path.join(path, "*")
+        found.extend(without_converted_copies(sorted(name for name in glob.glob(pattern, recursive=recursive)
+                                                     if os.path.splitext(name)[1] in PHASE_EXTENSIONS)))
+    return found
+
+
+def same_path_key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def output_paths(paths, output_folder, extension=None):
+    # a destination for every path, named after it with extension, or its own extension if None. Names
+    # two paths would share keep the source's extension as well; raises ValueError if a file would
+    # still be written twice, or over another path of the batch.
+    def destination(path, name):
+        return os.path.join(resolve(output_folder) if output_folder else os.path.dirname(path), name)
+
+    def extension_of(path):
+        return extension or os.path.splitext(path)[1]
+
+    destinations = [destination(path, os.path.splitext(os.path.basename(path))[0] + extension_of(path))
+                    for path in paths]
+    counts = {}
+    for path in destinations:
+        counts[same_path_key(path)] = counts.get(same_path_key(path), 0) + 1
+    # a path already in the wanted format keeps its name, it is left as it is
+    destinations = [destination(path, os.path.basename(path) + extension_of(path))
+                    if counts[same_path_key(output)] > 1 and same_path_key(output) != same_path_key(path)
+                    else output for (path, output) in zip(paths, destinations)]
+
+    written = {}
+    sources = {same_path_key(path): path for path in paths}
+    for (path, output) in zip(paths, destinations):
+        key = same_path_key(output)
+        if key in written:
+            raise ValueError(f"{written[key]} and {path} would both be written to {output}")
+        if key in sources and key != same_path_key(path):
+            raise ValueError(f"{path} would be written over {sources[key]}, which is also being processed")
+        written[key] = path
+
+    for folder in {os.path.dirname(output) for output in destinations}:
+        os.makedirs(folder, exist_ok=True)
+    return destinations
+
+
+def replace_phase(path, callouts):
+    # written next to the destination and renamed over it, so a failed write leaves the old file
+    if journal_applies(os.path.splitext(path)[0] + JOURNAL_EXTENSION, path):
+        raise ValueError(f"{path} has a journal on top of it, open and save it in the app first")
+    pending_path = path + ".tmp"
+    write_phase(pending_path, callouts, binary=is_binary_path(path))
+    os.replace(pending_path, path)
+    update_references(path, callouts)
+
+
+def convert(path, destination):
+    extension = os.path.splitext(destination)[1]
+    if os.path.exists(destination) and os.path.samefile(destination, path):
+        return f"{path} is already {extension}"
+    callouts = load_phase(path)
+    replace_phase(destination, callouts)
+    return f"{path} -> {destination} ({len(callouts)} callouts)"
+
+
+def retime(path, destination, offset_ms=0.0, scale=1.0):
+    callouts = load_phase(path)
+    for callout in callouts:
+        callout.timestamp = callout.timestamp * scale + offset_ms
+    if scale < 0:
+        callouts.reverse()
+    replace_phase(destination, callouts)
+    return f"{path} -> {destination} ({len(callouts)} callouts)"
+
+
+def export(path, destination, export_format="tsv", **filters):
+    export_file(destination, load_phase(path), export_format, **filters)
+    return f"{path} -> {destination}"
+
+
+def run_batch(function, paths, destinations, workers, *args):
+    # every file on its own, a failure is reported and the rest carry on
+    failed = 0
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(function, path, destination, *args)
+                   for (path, destination) in zip(paths, destinations)]
+        for (path, future) in zip(paths, futures):
+            try:
+                print(future.result())
+            except (ValueError, OSError, KeyError, TypeError) as e:
+                print(f"{path}: {e}", file=sys.stderr)
+                failed += 1
+    return failed
+
+
+def merge(paths, output, consensus=False, workers=None):
+    if consensus:
+        # only this needs numpy
+        from Models.pull_alignment import consensus_from_files
+        callouts = consensus_from_files(paths)[0]
+    else:
+        # every phase is already sorted, so they merge in one pass
+        with ProcessPoolExecutor(workers) as executor:
+            phases = list(executor.map(load_phase, paths))
+        callouts = list(heapq.merge(*phases, key=lambda callout: callout.timestamp))
+    replace_phase(output, callouts)
+    return f"{len(paths)} phases -> {output} ({len(callouts)} callouts)"
+
+
+def collect_garbage(folders, min_age_s, limit=None, dry_run=False, ignore_unreadable=False):
+    # screenshots no phase or journal under util.BASE_PATH refers to
+    start = time.perf_counter()
+    index = ReferenceIndex()
+    sources = screenshot_refs.reference_sources(util.BASE_PATH, folders + [index.folder])
+    (references, read, unreadable) = screenshot_refs.collect_references(sources, index)
+    for (path, error) in unreadable:
+        print(f"cannot read {path}: {error}", file=sys.stderr)
+    if unreadable and not ignore_unreadable:
+        # its screenshots would look unreferenced
+        print("nothing collected, fix or move the files above or pass --ignore-unreadable", file=sys.stderr)
+        return 1
+    pruned = index.prune(sources)
+    print(f"{len(references)} screenshots referenced by {len(sources)} phases and journals "
+          f"({read} read, the rest from the index, {pruned} stale index entries dropped)")
+
+    cursors = index.load_cursors()
+    (garbage, scanned, scanned_bytes) = screenshot_refs.unreferenced_screenshots(
+        folders, references, min_age_s, limit, cursors)
+    garbage_bytes = sum(size for (_, size) in garbage)
+    if dry_run:
+        for (path, size) in garbage:
+            print(f"{size:>10} {path}")
+    else:
+        screenshot_refs.remove_screenshots(garbage)
+        index.store_cursors(cursors)
+    print(f"{'would remove' if dry_run else 'removed'} {len(garbage)} of {scanned} screenshots looked at, "
+          f"{garbage_bytes / 1e6:.1f}MB of {scanned_bytes / 1e6:.1f}MB, in {time.perf_counter() - start:.1f}s"
+          + (f", stopped at --limit {limit}" if limit is not None and len(garbage) >= limit else ""))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch phase maintenance, without the GUI.")
+    parser.add_argument("--workers", type=int, help="processes to use, one per core by default")
+    parser.add_argument("--recursive", action="store_true", help="include phases in subfolders of folders")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = commands.add_parser("convert", help="rewrite phases in another format")
+    convert_parser.add_argument("paths", nargs="*", default=["."])
+    convert_parser.add_argument("--to", choices=FORMATS, default="phase")
+    convert_parser.add_argument("--output-folder")
+
+    retime_parser = commands.add_parser("retime", help="scale and shift every timestamp")
+    retime_parser.add_argument("paths", nargs="*", default=["."])
+    retime_parser.add_argument("--offset-ms", type=float, default=0.0, help="added after scaling")
+    retime_parser.add_argument("--scale", type=float, default=1.0)
+    retime_parser.add_argument("--output-folder", help="where retimed phases go, in place by default")
+
+    export_parser = commands.add_parser("export", help="export every phase to a file")
+    export_parser.add_argument("paths", nargs="*", default=["."])
+    export_parser.add_argument("--format", choices=EXPORT_FORMATS, default="tsv")
+    export_parser.add_argument("--all", action="store_true", help="include inactive callouts")
+    export_parser.add_argument("--start-ms", type=float)
+    export_parser.add_argument("--end-ms", type=float)
+    export_parser.add_argument("--output-folder")
+
+    merge_parser = commands.add_parser("merge", help="combine phases into one")
+    merge_parser.add_argument("paths", nargs="+")
+    merge_parser.add_argument("--output", required=True)
+    merge_parser.add_argument("--consensus", action="store_true",
+                              help="treat the phases as pulls and keep the callouts they agree on")
+
+    gc_parser = commands.add_parser("gc", help="remove screenshots no phase refers to")
+    gc_parser.add_argument("--dry-run", action="store_true", help="list them with their sizes instead")
+    gc_parser.add_argument("--folder", dest="folders", action="append",
+                           help="screenshot folder to collect, util.SCREENSHOTS_FOLDER by default")
+    gc_parser.add_argument("--min-age-hours", type=float, default=screenshot_refs.DEFAULT_MIN_AGE_S / 3600,
+                           help="leave screenshots younger than this")
+    gc_parser.add_argument("--limit", type=int,
+                           help="remove at most this many; the next run carries on from where this one stopped")
+    gc_parser.add_argument("--ignore-unreadable", action="store_true",
+                           help="collect even when a phase or journal cannot be read")
+
+    args = parser.parse_args()
+    if args.command == "gc":
+        folders = [resolve(folder) for folder in args.folders or [util.SCREENSHOTS_FOLDER]]
+        return collect_garbage(folders, args.min_age_hours * 3600, args.limit, args.dry_run,
+                               args.ignore_unreadable)
+
+    paths = phase_paths(args.paths, args.recursive)
+    if not paths:
+        parser.error("no phases found")
+
+    if args.command == "merge":
+        print(merge(paths, resolve(args.output), args.consensus, args.workers))
+        return 0
+
+    # retimed phases keep their format
+    extension = None
+    if args.command == "convert":
+        extension = FORMATS[args.to]
+    elif args.command == "export":
+        extension = EXPORT_FORMATS[args.format][0]
+    try:
+        destinations = output_paths(paths, args.output_folder, extension)
+    except ValueError as e:
+        print(f"nothing written: {e}", file=sys.stderr)
+        return 1
+    if args.command == "convert":
+        return run_batch(convert, paths, destinations, args.workers)
+    if args.command == "retime":
+        return run_batch(retime, paths, destinations, args.workers, args.offset_ms, args.scale)
+    return run_batch(partial(export, export_format=args.format, active_only=not args.all,
+                             start_ms=args.start_ms, end_ms=args.end_ms),
+                     paths, destinations, args.workers)
+
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
@@ -1,6 +1,7 @@
 import os
 
 BASE_PATH = os.path.join(os.path.expanduser('~'), 'Documents', 'FFTimer')
+SCREENSHOTS_FOLDER = os.path.join(BASE_PATH, 'screenshots')
 
 def format_ms(t):
     return "{:.2f}".format(t/1000)